@@ -0,0 +1,74 @@
+# ---
+# jupyter:
+#   jupytext:
+#     formats: ipynb,py:percent
+#     text_representation:
+#       extension: .py
+#       format_name: percent
+#       format_version: '1.3'
+#       jupytext_version: 1.14.5
+#   kernelspec:
+#     display_name: Python 3 (ipykernel)
+#     language: python
+#     name: python3
+# ---
+
+# %%
+###############################################################################
+# This notebook provides some tools for better integration between the        #
+# Pacific EMIS and Pacific SIS. In particular applying a SQL script produced  #
+# by the other notebooks (e.g. ethnicity-sync-script.sql) without a MySQL     #
+# client: statements are batched and run in a transaction with progress       #
+###############################################################################
+
+# Core stuff
+import os
+import datetime as dt
+
+# Data stuff
+import pandas as pd # Data analysis
+import sqlalchemy as sa
+# Sync tools
+from pacific_sis.runtime import load_config, sis_engine
+from pacific_sis.scripts import apply_script
+# Pretty printing stuff
+from pacific_sis.runtime import display, HTML
+import pprint
+pp = pprint.PrettyPrinter(indent=4)
+
+# Initial setup
+cwd = os.getcwd()
+
+# Configuration
+config = load_config()
+        
+# SIS config
+sis_database = config['sis_database']
+sis_tenant_id = config['sis_tenant_id']
+sis_user_guid = config['sis_user_guid']
+sis_country = config['sis_country']
+sis_load_data_to_sql = config['sis_load_data_to_sql']
+# The script to apply (relative to data/<country>) and the connections to split the schools across
+sis_sync_script = config.get('sis_sync_script', 'ethnicity-sync-script.sql')
+sis_sync_script_connections = config.get('sis_sync_script_connections', 1)
+
+# Config
+country = config['country']
+datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+# MySQL Connection (created when first used)
+mysql_engine = sis_engine(config)
+
+print("Retrieving settings and creating database connections")
+
+# %%
+# %%time
+
+# Run the script, it is only committed when loading data into SQL (otherwise rolled back like the script itself)
+filename = 'data/' + country + '/' + sis_sync_script
+apply_script(mysql_engine, filename, connections=sis_sync_script_connections, commit=sis_load_data_to_sql == True)
+
+# %%
+# Close database connection
+print("Closing the MySQL connection engine")
+mysql_engine.dispose()
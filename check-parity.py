@@ -0,0 +1,88 @@
+# ---
+# jupyter:
+#   jupytext:
+#     formats: ipynb,py:percent
+#     text_representation:
+#       extension: .py
+#       format_name: percent
+#       format_version: '1.3'
+#       jupytext_version: 1.14.5
+#   kernelspec:
+#     display_name: Python 3 (ipykernel)
+#     language: python
+#     name: python3
+# ---
+
+# %%
+###############################################################################
+# This notebook provides some tools for better integration between the        #
+# Pacific EMIS and Pacific SIS. In particular a quick parity check between    #
+# the EMIS and the SIS for schools, students and staff. Only per school       #
+# aggregates (counts and key digests) are pulled from each server and only    #
+# the schools that differ are drilled down into (by grade and gender)         #
+###############################################################################
+
+# Core stuff
+import os
+import datetime as dt
+
+# Data stuff
+import pandas as pd # Data analysis
+import numpy as np
+import sqlalchemy as sa
+# Sync tools
+from pacific_sis.runtime import load_config, emis_engine, sis_engine
+from pacific_sis.parity import parity_report
+# Pretty printing stuff
+from pacific_sis.runtime import display, HTML
+import pprint
+pp = pprint.PrettyPrinter(indent=4)
+
+# Initial setup
+cwd = os.getcwd()
+
+# Configuration
+config = load_config()
+        
+# EMIS config
+emis_lookup = config['emis_lookup']
+emis_school_year = config['emis_school_year']
+        
+# SIS config
+sis_database = config['sis_database']
+sis_tenant_id = config['sis_tenant_id']
+sis_export_data_to_excel = config['sis_export_data_to_excel']
+
+# Config
+country = config['country']
+datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+# MS SQL Server connection (created when first used)
+mssql_engine = emis_engine(config)
+
+# MySQL Connection (created when first used)
+mysql_engine = sis_engine(config)
+
+print("Retrieving settings and creating database connections")
+
+# %%
+# Per school records and key digests of each entity on both sides, the schools
+# that differ are drilled down into
+report = parity_report(mssql_engine, mysql_engine, emis_school_year, sis_tenant_id, entities=['schools', 'students', 'staff'], config=config)
+
+for entity, r in report.items():
+    print("{} per school".format(entity))
+    display(r['schools'][~r['schools']['matches']])
+    if r['details'] is not None:
+        print("{} of the schools that differ".format(entity))
+        display(r['details'])
+
+# %%
+# Save the parity report (only the schools that differ)
+if sis_export_data_to_excel:
+    with pd.ExcelWriter('data/'+country+'/sis-parity-report.xlsx') as writer:
+        for entity, r in report.items():
+            print("Saving {} parity to Excel".format(entity))
+            r['schools'][~r['schools']['matches']].to_excel(writer, index=False, sheet_name=entity)
+            if r['details'] is not None:
+                r['details'].to_excel(writer, index=False, sheet_name=entity + '-details')
@@ -0,0 +1 @@
+"""Shared helpers for the Pacific EMIS to Pacific SIS sync notebooks."""
@@ -0,0 +1,5 @@
+import sys
+
+from pacific_sis.cli import main
+
+sys.exit(main())
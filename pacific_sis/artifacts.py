@@ -0,0 +1,129 @@
+"""On-disk artifact store used to hand data over from one sync notebook to another.
+
+Artifacts are written as Arrow IPC files (one file per artifact) and memory-mapped
+when read back so consumers get the data without re-parsing or copying it. Each
+file carries the run ID of the producer, the producing notebook and when it was
+written so a consumer can refuse stale inputs.
+"""
+
+import os
+import uuid
+import datetime as dt
+
+import pyarrow as pa
+
+METADATA_PREFIX = 'pacific_sis.'
+KIND_FRAME = 'frame'
+KIND_MAP = 'map'
+
+
+class ArtifactError(Exception):
+    pass
+
+
+class MissingArtifactError(ArtifactError):
+    pass
+
+
+class StaleArtifactError(ArtifactError):
+    pass
+
+
+def new_run_id():
+    """A sortable and unique ID for one run of a notebook."""
+    return '{}-{}'.format(dt.datetime.now().strftime('%Y%m%dT%H%M%S'), uuid.uuid4().hex[:8])
+
+
+class ArtifactStore:
+
+    def __init__(self, root, producer=None, run_id=None):
+        self.root = root
+        self.producer = producer
+        self.run_id = run_id or new_run_id()
+
+    @classmethod
+    def from_config(cls, config, producer=None):
+        """The store of the country in config.json (data/<country>/artifacts by default)"""
+        root = config.get('sis_artifacts_dir') or os.path.join('data', config['country'], 'artifacts')
+        return cls(root, producer=producer)
+
+    def path(self, name):
+        return os.path.join(self.root, name + '.arrow')
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def _write(self, name, table, kind):
+        metadata = dict(table.schema.metadata or {})
+        metadata.update({
+            (METADATA_PREFIX + 'name').encode(): name.encode(),
+            (METADATA_PREFIX + 'kind').encode(): kind.encode(),
+            (METADATA_PREFIX + 'run_id').encode(): self.run_id.encode(),
+            (METADATA_PREFIX + 'producer').encode(): (self.producer or '').encode(),
+            (METADATA_PREFIX + 'created_on').encode(): dt.datetime.now().isoformat().encode(),
+            (METADATA_PREFIX + 'rows').encode(): str(table.num_rows).encode(),
+        })
+        table = table.replace_schema_metadata(metadata)
+
+        # Write next to the final file and swap it in so a reader never sees half an artifact
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(name)
+        tmp_path = path + '.tmp'
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+        return self.info(name)
+
+    def publish(self, name, df):
+        """Store a DataFrame under name (replacing the previous version)"""
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        return self._write(name, table, KIND_FRAME)
+
+    def publish_map(self, name, mapping, key_name='key', value_name='value'):
+        """Store a plain dict (e.g. schools_sis_map) as a two column table"""
+        table = pa.table({key_name: list(mapping.keys()), value_name: list(mapping.values())})
+        return self._write(name, table, KIND_MAP)
+
+    def info(self, name):
+        """The metadata of an artifact, only the schema is read from disk"""
+        path = self.path(name)
+        if not os.path.exists(path):
+            raise MissingArtifactError("Artifact {} not found in {}, run the notebook producing it first".format(name, self.root))
+        with pa.memory_map(path, 'r') as source:
+            schema = pa.ipc.open_file(source).schema
+        metadata = schema.metadata or {}
+        info = {}
+        for k, v in metadata.items():
+            k = k.decode()
+            if k.startswith(METADATA_PREFIX):
+                info[k[len(METADATA_PREFIX):]] = v.decode()
+        info['created_on'] = dt.datetime.fromisoformat(info['created_on'])
+        info['rows'] = int(info['rows'])
+        info['columns'] = schema.names
+        info['path'] = path
+        return info
+
+    def _check_fresh(self, name, max_age_hours):
+        info = self.info(name)
+        if max_age_hours is not None:
+            age = dt.datetime.now() - info['created_on']
+            if age > dt.timedelta(hours=max_age_hours):
+                raise StaleArtifactError("Artifact {} was produced by {} (run {}) on {} which is older than {} hours".format(
+                    name, info['producer'], info['run_id'], info['created_on'], max_age_hours))
+        return info
+
+    def read_table(self, name, max_age_hours=None):
+        """The artifact as an Arrow table backed by the memory-mapped file (no copy)"""
+        self._check_fresh(name, max_age_hours)
+        with pa.memory_map(self.path(name), 'r') as source:
+            return pa.ipc.open_file(source).read_all()
+
+    def read(self, name, max_age_hours=None):
+        """The artifact as a DataFrame"""
+        return self.read_table(name, max_age_hours).to_pandas()
+
+    def read_map(self, name, max_age_hours=None):
+        """The artifact as a dict, the reverse of publish_map"""
+        table = self.read_table(name, max_age_hours)
+        return dict(zip(table.column(0).to_pylist(), table.column(1).to_pylist()))
@@ -0,0 +1,222 @@
+"""Backfill of historical student enrollments from the EMIS.
+
+The student sync only loads the enrollments of the current EMIS school year. This
+loads one student_enrollment record per past year for students already in the SIS
+(matched on alternate_id which holds the EMIS stuCardID). Years are processed in
+parallel, each streamed from StudentEnrolment_ (one enrollment per stuCardID and
+year, picked by the EMIS) and written a stream chunk per transaction. A year is
+recorded in the journal once completed, an interrupted year is reloaded skipping
+the records already in the SIS.
+
+New records take enrollment_ids above the last one of each student, once loaded
+the enrollments of each student are renumbered in chronological order so the
+current year's keeps the highest enrollment_id.
+"""
+
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+from pacific_sis.schoolyear import school_year_dates
+from pacific_sis.checkpoint import CheckpointJournal, DEFAULT_SCHOOLS_PER_CHUNK
+
+# A student enrolled twice in a year keeps the enrollment of the last school and class
+query_student_enrolment_year_emis = """
+SELECT E.stuCardID
+	,E.schNo
+	,E.schName
+	,E.stueYear
+	,E.stueClass
+FROM (
+	SELECT S.stuCardID
+		,SE.schNo
+		,SC.schName
+		,SE.stueYear
+		,SE.stueClass
+		,ROW_NUMBER() OVER (PARTITION BY S.stuCardID ORDER BY SE.schNo DESC, SE.stueClass DESC) AS n
+	FROM [dbo].[Student_] S
+	INNER JOIN [dbo].[StudentEnrolment_] SE ON S.stuID = SE.stuID
+	INNER JOIN [dbo].[Schools] SC ON SE.schNo = SC.schNo
+	WHERE SE.stueYear = {} AND S.stuCardID IS NOT NULL
+) E
+WHERE E.n = 1
+ORDER BY E.schNo, E.stueClass;
+"""
+
+query_students_sis = """
+SELECT `school_id`, `student_id`, `student_guid`, `alternate_id`
+FROM student_master
+WHERE tenant_id = '{}' AND alternate_id IS NOT NULL;
+"""
+
+query_student_enrollments_sis = """
+SELECT `school_id`, `student_id`, `enrollment_id`, `enrollment_date`
+FROM student_enrollment
+WHERE tenant_id = '{}';
+"""
+
+# Chronological rank of the enrollments of each student, only those out of order are kept
+query_enrollment_renumbering_sis = """
+CREATE TEMPORARY TABLE tmp_enrollment_renumbering AS
+SELECT * FROM (
+    SELECT `school_id`, `student_id`, `enrollment_id`,
+        ROW_NUMBER() OVER (PARTITION BY `school_id`, `student_id` ORDER BY `enrollment_date`, `enrollment_id`) AS new_enrollment_id
+    FROM student_enrollment
+    WHERE tenant_id = '{}'
+) r
+WHERE r.enrollment_id <> r.new_enrollment_id;
+"""
+
+# In two steps (through IDs above any existing one) so no two records of a student
+# ever have the same enrollment_id
+query_renumber_enrollments_sis = """
+UPDATE student_enrollment se
+INNER JOIN tmp_enrollment_renumbering r ON se.school_id = r.school_id AND se.student_id = r.student_id AND se.enrollment_id = {from_id}
+SET se.enrollment_id = {to_id}
+WHERE se.tenant_id = '{tenant_id}' AND r.school_id IN ({school_ids});
+"""
+
+RENUMBERING_OFFSET = 1000000
+
+student_enrollment_columns = [
+    'enrollment_id', 'school_id', 'student_id', 'tenant_id', 'calender_id',
+    'created_by', 'created_on', 'enrollment_code', 'enrollment_date',
+    'exit_code', 'exit_date', 'grade_id', 'grade_level_title', 'is_active',
+    'rolling_option', 'rollover_id', 'school_name', 'school_transferred',
+    'student_guid', 'transferred_grade', 'transferred_school_id',
+    'updated_by', 'updated_on']
+
+
+class StudentEnrollmentBackfill:
+
+    def __init__(self, config, mssql_engine, mysql_engine, schools_sis_map, gradelevels_sis_map, gradelevels_title_sis_map, calender_sis_map,
+                 enrollment_code='Rolled Over', exit_code='Rolled Over', chunksize=5000):
+        self.config = config
+        self.mssql_engine = mssql_engine
+        self.mysql_engine = mysql_engine
+        self.tenant_id = config['sis_tenant_id']
+        self.user_guid = config['sis_user_guid']
+        self.schools_sis_map = schools_sis_map
+        self.gradelevels_sis_map = gradelevels_sis_map
+        self.gradelevels_title_sis_map = gradelevels_title_sis_map
+        self.calender_sis_map = calender_sis_map
+        self.enrollment_code = enrollment_code
+        self.exit_code = exit_code
+        self.chunksize = chunksize
+        # Completed years, kept once the backfill is done so they're never loaded twice
+        self.journal = CheckpointJournal.for_load(config, 'student-enrollment-backfill')
+
+    def _load_sis_state(self):
+        with self.mysql_engine.begin() as conn:
+            df_students = pd.read_sql_query(sa.text(query_students_sis.format(self.tenant_id)), conn)
+            df_enrollments = pd.read_sql_query(sa.text(query_student_enrollments_sis.format(self.tenant_id)), conn)
+        # Students loaded more than once under the same stuCardID can not be told apart
+        self.df_students = df_students.drop_duplicates(subset=['alternate_id'], keep=False)
+        df_enrollments['enrollment_date'] = pd.to_datetime(df_enrollments['enrollment_date']).dt.strftime('%Y-%m-%d')
+        self.df_last_enrollment_id = df_enrollments.groupby(['school_id', 'student_id'], as_index=False)['enrollment_id'].max().rename(columns={'enrollment_id': 'last_enrollment_id'})
+        self.df_enrollment_dates = df_enrollments[['school_id', 'student_id', 'enrollment_date']].drop_duplicates()
+
+    def prepare(self, df_emis, year, enrollment_id_offset):
+        """The student_enrollment records of a chunk of EMIS enrollments of a year"""
+        start_date, end_date = school_year_dates(year, self.config)
+        datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        # The EMIS query has a single enrollment per stuCardID and year
+        df = df_emis.merge(self.df_students, left_on='stuCardID', right_on='alternate_id', how='inner')
+
+        # Skip what is already in the SIS for that year (e.g. a previous partial run)
+        df['enrollment_date'] = start_date
+        df = df.merge(self.df_enrollment_dates, on=['school_id', 'student_id', 'enrollment_date'], how='left', indicator=True)
+        df = df[df['_merge'] == 'left_only'].drop(columns=['_merge'])
+
+        df = df.merge(self.df_last_enrollment_id, on=['school_id', 'student_id'], how='left')
+        df['enrollment_id'] = df['last_enrollment_id'].fillna(0).astype(int) + enrollment_id_offset
+
+        # The school (and its grades) the student was enrolled in that year which
+        # is not necessarily the school of its student_master record
+        enrolled_school_id = df['schName'].map(self.schools_sis_map)
+        school_grade_val = enrolled_school_id.astype('Int64').astype(str) + '-' + df['stueClass']
+        df['tenant_id'] = self.tenant_id
+        df['calender_id'] = enrolled_school_id.map(self.calender_sis_map)
+        df['created_by'] = self.user_guid
+        df['created_on'] = datetime
+        df['enrollment_code'] = self.enrollment_code
+        df['exit_code'] = self.exit_code
+        df['exit_date'] = end_date
+        df['grade_id'] = school_grade_val.map(self.gradelevels_sis_map)
+        df['grade_level_title'] = school_grade_val.map(self.gradelevels_title_sis_map)
+        df['is_active'] = 0
+        df['rolling_option'] = 'Next grade at current school'
+        df['rollover_id'] = np.nan
+        df['school_name'] = df['schName']
+        df['school_transferred'] = np.nan
+        df['transferred_grade'] = np.nan
+        df['transferred_school_id'] = np.nan
+        df['updated_by'] = self.user_guid
+        df['updated_on'] = datetime
+        return df[student_enrollment_columns]
+
+    def backfill_year(self, year, enrollment_id_offset, load=True):
+        records = 0
+        with self.mssql_engine.connect() as conn_emis:
+            chunks = pd.read_sql_query(sa.text(query_student_enrolment_year_emis.format(year)), conn_emis.execution_options(stream_results=True), chunksize=self.chunksize)
+            for df_emis in chunks:
+                df = self.prepare(df_emis, year, enrollment_id_offset)
+                if load and not df.empty:
+                    # A transaction per chunk keeps the locks on student_enrollment short
+                    with self.mysql_engine.begin() as conn_sis:
+                        df.to_sql('student_enrollment', con=conn_sis, index=False, if_exists='append', method='multi', chunksize=1000)
+                records += len(df)
+        if load:
+            self.journal.mark_done(year, records=records)
+        print("Year {}: {} student_enrollment records {}".format(year, records, 'loaded' if load else 'prepared'))
+        return records
+
+    def renumber_enrollments(self, schools_per_chunk=DEFAULT_SCHOOLS_PER_CHUNK):
+        """Renumber the enrollment_id of the enrollments of each student in chronological order
+
+        Only the enrollments out of order are updated, a few schools per transaction.
+        Returns the number of enrollments renumbered.
+        """
+        renumbered = 0
+        with self.mysql_engine.connect() as conn:
+            conn.execute(sa.text("DROP TEMPORARY TABLE IF EXISTS tmp_enrollment_renumbering"))
+            conn.execute(sa.text(query_enrollment_renumbering_sis.format(self.tenant_id)))
+            school_ids = [r[0] for r in conn.execute(sa.text("SELECT DISTINCT school_id FROM tmp_enrollment_renumbering ORDER BY school_id"))]
+            conn.commit()
+            for i in range(0, len(school_ids), schools_per_chunk):
+                chunk = ', '.join(str(int(school_id)) for school_id in school_ids[i:i + schools_per_chunk])
+                result = conn.execute(sa.text(query_renumber_enrollments_sis.format(
+                    from_id='r.enrollment_id', to_id='r.new_enrollment_id + {}'.format(RENUMBERING_OFFSET), tenant_id=self.tenant_id, school_ids=chunk)))
+                conn.execute(sa.text(query_renumber_enrollments_sis.format(
+                    from_id='r.new_enrollment_id + {}'.format(RENUMBERING_OFFSET), to_id='r.new_enrollment_id', tenant_id=self.tenant_id, school_ids=chunk)))
+                conn.commit()
+                renumbered += result.rowcount
+            conn.execute(sa.text("DROP TEMPORARY TABLE IF EXISTS tmp_enrollment_renumbering"))
+        return renumbered
+
+    def run(self, years, max_workers=4, load=True):
+        """Backfill all the given EMIS survey years not already completed
+
+        Returns {year: number of student_enrollment records}.
+        """
+        years = sorted(years)
+        self._load_sis_state()
+        # Each year gets its own enrollment_id above the last one of each student (as
+        # reloaded on a resume) so years loaded concurrently never collide, the
+        # chronological order is restored by renumber_enrollments
+        todo = [(year, i + 1) for i, year in enumerate(y for y in years if not self.journal.is_done(y))]
+        skipped = [year for year in years if self.journal.is_done(year)]
+        if skipped:
+            print("Years already backfilled (skipped): {}".format(skipped))
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(todo) or 1))) as executor:
+            futures = {year: executor.submit(self.backfill_year, year, offset, load) for year, offset in todo}
+            for year, future in futures.items():
+                results[year] = future.result()
+        if load:
+            print("Enrollments renumbered in chronological order: {}".format(self.renumber_enrollments()))
+        return results
@@ -0,0 +1,93 @@
+"""Bulk load session for large loads into the SIS.
+
+Opt-in (sis_bulk_load in config.json) mode of load_in_chunks for large initial
+country loads. The records of each table are inserted in primary key order (so
+InnoDB appends to its clustered index instead of splitting pages) with the
+session foreign_key_checks and unique_checks off. As the server does not check
+the foreign keys of these records, they are checked in bulk with one anti-join
+per foreign key before the transaction commits, only for the records just loaded
+(their primary keys are uploaded in a temporary table) so orphans already in the
+SIS don't fail the loads. The loaded tables are analyzed at the end so the
+optimizer sees the new statistics.
+"""
+
+import contextlib
+
+import sqlalchemy as sa
+
+from pacific_sis.sql import primary_key, foreign_keys, insert_records
+
+# The records of a foreign key without a matching parent (only those loaded, see {where})
+query_orphans = """
+SELECT COUNT(*) AS orphans
+FROM `{table}` c
+WHERE {not_null} {where} AND NOT EXISTS (
+    SELECT 1 FROM `{referenced_table}` p WHERE {join}
+);
+"""
+
+
+class ForeignKeyError(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def bulk_session(conn):
+    """Turn off the foreign key and unique checks of the connection session for the block"""
+    conn.execute(sa.text("SET SESSION foreign_key_checks = 0, unique_checks = 0"))
+    try:
+        yield conn
+    finally:
+        conn.execute(sa.text("SET SESSION foreign_key_checks = 1, unique_checks = 1"))
+
+
+def sort_by_primary_key(conn, table, df):
+    """df sorted on the primary key of table (when df has all its columns)"""
+    key = primary_key(conn, table)
+    if key and all(c in df.columns for c in key):
+        return df.sort_values(key, kind='stable')
+    return df
+
+
+def check_foreign_keys(conn, table, where='', params=None):
+    """Raise ForeignKeyError if records of table (e.g. where="AND c.school_id IN (1, 2)") have no parent"""
+    for constraint, (columns, referenced_table, referenced_columns) in foreign_keys(conn, table).items():
+        query = query_orphans.format(
+            table=table, referenced_table=referenced_table, where=where,
+            not_null=' AND '.join('c.`{}` IS NOT NULL'.format(c) for c in columns),
+            join=' AND '.join('p.`{}` = c.`{}`'.format(p, c) for c, p in zip(columns, referenced_columns)))
+        stmt = sa.text(query)
+        if params and any(isinstance(v, (list, tuple)) for v in params.values()):
+            stmt = stmt.bindparams(*[sa.bindparam(k, expanding=True) for k, v in params.items() if isinstance(v, (list, tuple))])
+        orphans = conn.execute(stmt, params or {}).scalar()
+        if orphans:
+            raise ForeignKeyError("{} records of {} have no matching {} ({} on {})".format(
+                orphans, table, referenced_table, constraint, ', '.join(columns)))
+
+
+def check_loaded_foreign_keys(conn, table, df):
+    """Raise ForeignKeyError if records of df just loaded into table have no parent
+
+    The records are found by their primary key (or all their columns when df does
+    not have it) uploaded in a temporary table with the types of table.
+    """
+    key = primary_key(conn, table)
+    columns = key if key and all(c in df.columns for c in key) else list(df.columns)
+    # NULL safe comparison when the records are found by all their columns
+    operator = '=' if columns == key else '<=>'
+    conn.execute(sa.text("DROP TEMPORARY TABLE IF EXISTS `tmp_bulk_loaded_keys`"))
+    conn.execute(sa.text("CREATE TEMPORARY TABLE `tmp_bulk_loaded_keys` {} SELECT {} FROM `{}` LIMIT 0".format(
+        '(INDEX ({}))'.format(', '.join('`{}`'.format(c) for c in columns)) if columns == key else '',
+        ', '.join('`{}`'.format(c) for c in columns), table)))
+    insert_records(conn, 'tmp_bulk_loaded_keys', df[columns])
+    try:
+        check_foreign_keys(conn, table, 'AND EXISTS (SELECT 1 FROM `tmp_bulk_loaded_keys` k WHERE {})'.format(
+            ' AND '.join('k.`{c}` {op} c.`{c}`'.format(c=c, op=operator) for c in columns)))
+    finally:
+        conn.execute(sa.text("DROP TEMPORARY TABLE IF EXISTS `tmp_bulk_loaded_keys`"))
+
+
+def analyze_tables(engine, tables):
+    """Refresh the optimizer statistics of tables"""
+    with engine.connect() as conn:
+        return conn.execute(sa.text("ANALYZE TABLE {}".format(', '.join('`{}`'.format(t) for t in tables)))).all()
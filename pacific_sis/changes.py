@@ -0,0 +1,53 @@
+"""Detecting and applying changes of records already in the SIS.
+
+EMIS and SIS records matched on their keys are compared column by column in
+vectorized form. Only the rows with at least one changed column are kept, each
+column with a <column>_changed flag, and they are applied with a single
+UPDATE ... JOIN per table against a temporary table of the changes.
+"""
+
+import sqlalchemy as sa
+
+from pacific_sis.sql import temp_table
+
+
+def diff_matched(df_new, df_old, keys, columns):
+    """The changed columns of the records of df_new matching (on keys) a record of df_old
+
+    Missing values in df_new are never considered a change (the SIS value is kept).
+    Returns a DataFrame with the keys, the new values of columns and a boolean
+    <column>_changed flag per column, restricted to the rows with a change.
+    """
+    df = df_new[keys + columns].merge(df_old[keys + columns], on=keys, how='inner', suffixes=('', '_sis'))
+    any_changed = None
+    for c in columns:
+        new, old = df[c], df[c + '_sis']
+        changed = new.notna() & (old.isna() | (new != old))
+        df[c + '_changed'] = changed
+        any_changed = changed if any_changed is None else any_changed | changed
+    df = df.drop(columns=[c + '_sis' for c in columns])
+    if any_changed is not None:
+        df = df[any_changed]
+    return df.reset_index(drop=True)
+
+
+def summarize_changes(df_changes, columns):
+    """Number of records changed per column"""
+    return {c: int(df_changes[c + '_changed'].sum()) for c in columns}
+
+
+def apply_changes(conn, table, df_changes, keys, columns, tenant_id, user_guid, datetime):
+    """Apply the output of diff_matched to table in one UPDATE ... JOIN statement"""
+    if df_changes.empty:
+        return 0
+    tmp = temp_table(conn, 'tmp_{}_changes'.format(table), df_changes, index=keys)
+    join = ' AND '.join('t.`{}` = c.`{}`'.format(k, k) for k in keys)
+    sets = ', '.join('t.`{}` = IF(c.`{}_changed`, c.`{}`, t.`{}`)'.format(c, c, c, c) for c in columns)
+    update = """
+    UPDATE `{}` t INNER JOIN `{}` c ON {}
+    SET {}, t.`updated_by` = :user_guid, t.`updated_on` = :datetime
+    WHERE t.`tenant_id` = :tenant_id
+    """.format(table, tmp, join, sets)
+    result = conn.execute(sa.text(update), {'user_guid': user_guid, 'datetime': datetime, 'tenant_id': tenant_id})
+    conn.execute(sa.text("DROP TEMPORARY TABLE IF EXISTS `{}`".format(tmp)))
+    return result.rowcount
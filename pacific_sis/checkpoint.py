@@ -0,0 +1,152 @@
+"""Chunked loading into the SIS with a checkpoint journal.
+
+Instead of loading everything in one transaction the records are loaded a few
+schools at a time, each chunk in its own transaction. The schools of every
+committed chunk are recorded in a small JSON journal so when a load is
+interrupted (e.g. a dropped connection) a rerun skips straight to the schools
+not loaded yet. The journal is removed once a load completes.
+
+The journal also records a fingerprint of the load (its name, the EMIS school
+year and the databases and tenant of config.json) and is only resumed by a load
+with the same fingerprint, the journal of an abandoned load is discarded by a
+later different one. It never depends on the records loaded since a rerun no
+longer prepares those already committed.
+
+With bulk set the chunks are loaded in a bulk session (see pacific_sis.bulk).
+"""
+
+import os
+import json
+import hashlib
+import contextlib
+import threading
+import datetime as dt
+
+import pandas as pd
+
+from pacific_sis.bulk import bulk_session, sort_by_primary_key, check_loaded_foreign_keys, analyze_tables
+
+DEFAULT_SCHOOLS_PER_CHUNK = 10
+
+
+def journal_key(value):
+    """A JSON friendly key (school IDs come as numpy integers or floats)"""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return 'null'
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+# The configuration that identifies a load, not how it is loaded (e.g. chunk size)
+RUN_CONFIG_KEYS = ['country', 'emis_database', 'emis_school_year', 'sis_database', 'sis_tenant_id']
+
+
+def run_fingerprint(config, name):
+    """A digest of the name of a load, the EMIS school year and the databases of config"""
+    run = {'name': name}
+    run.update({k: config.get(k) for k in RUN_CONFIG_KEYS})
+    return hashlib.sha1(json.dumps(run, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class CheckpointJournal:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.run = None
+        self.done = {}
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                journal = json.load(file)
+            self.run = journal.get('run')
+            self.done = journal['done']
+
+    @classmethod
+    def for_load(cls, config, name):
+        """The journal of a named load of the country in config.json"""
+        journal = cls(os.path.join('data', config['country'], 'checkpoints', name + '.json'))
+        journal.start(run_fingerprint(config, name))
+        return journal
+
+    def start(self, run):
+        """Resume the journal if it is the one of run (a fingerprint), discard it otherwise"""
+        if self.done and self.run != run:
+            print("Discarding the checkpoint journal {} of a different load ({} keys)".format(self.path, len(self.done)))
+            self.clear()
+        self.run = run
+
+    def is_done(self, key):
+        return journal_key(key) in self.done
+
+    def mark_done(self, *keys, **info):
+        """Record keys (e.g. the schools of a chunk) as committed"""
+        with self.lock:
+            info['committed_on'] = dt.datetime.now().isoformat()
+            for key in keys:
+                self.done[journal_key(key)] = info
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump({'run': self.run, 'done': self.done}, file, indent=1)
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        with self.lock:
+            self.done = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def load_in_chunks(engine, frames, journal, by='school_id', schools_per_chunk=DEFAULT_SCHOOLS_PER_CHUNK, bulk=False, updates=None):
+    """Append the DataFrames of frames ({sql_table: df}) a chunk of schools per transaction
+
+    Within a chunk the tables are loaded in the order of frames, then the
+    updates ({name: (df, apply)}) of its schools are applied in the same
+    transaction with apply(conn, df_chunk) returning the number of records
+    updated. Schools already committed according to the journal are skipped.
+    With bulk the records are inserted in primary key order without the session
+    checks, their foreign keys are checked before each commit and the tables
+    analyzed at the end. Returns the number of records loaded (or updated) per
+    table (or update).
+    """
+    updates = updates or {}
+    keys = pd.concat([df[by] for df in frames.values()] + [df[by] for df, apply in updates.values()], ignore_index=True).map(journal_key).drop_duplicates()
+    skipped = [k for k in keys if k in journal.done]
+    todo = [k for k in keys if k not in journal.done]
+    if skipped:
+        print("Skipping {} schools already loaded by a previous run: {}".format(len(skipped), skipped))
+
+    loaded = {table: 0 for table in list(frames) + list(updates)}
+    if bulk:
+        with engine.connect() as conn:
+            frames = {table: sort_by_primary_key(conn, table, df) for table, df in frames.items()}
+    df_keys = {table: df[by].map(journal_key) for table, df in frames.items()}
+    df_update_keys = {name: df[by].map(journal_key) for name, (df, apply) in updates.items()}
+    for i in range(0, len(todo), schools_per_chunk):
+        chunk = todo[i:i + schools_per_chunk]
+        rows = {}
+        with engine.begin() as conn, (bulk_session(conn) if bulk else contextlib.nullcontext()):
+            df_chunks = {}
+            for table, df in frames.items():
+                df_chunks[table] = df_chunk = df[df_keys[table].isin(chunk)]
+                if not df_chunk.empty:
+                    df_chunk.to_sql(table, con=conn, index=False, if_exists='append')
+                rows[table] = len(df_chunk)
+            if bulk:
+                # The server did not check them, an orphan rolls the chunk back
+                for table, df_chunk in df_chunks.items():
+                    if not df_chunk.empty:
+                        check_loaded_foreign_keys(conn, table, df_chunk)
+            for name, (df, apply) in updates.items():
+                df_chunk = df[df_update_keys[name].isin(chunk)]
+                rows[name] = apply(conn, df_chunk) if not df_chunk.empty else 0
+        journal.mark_done(*chunk)
+        for table, n in rows.items():
+            loaded[table] += n
+        print("Committed schools {} ({})".format(chunk, ', '.join('{} {}'.format(n, t) for t, n in rows.items())))
+
+    journal.clear()
+    if bulk:
+        analyze_tables(engine, [table for table, n in loaded.items() if n > 0])
+    return loaded
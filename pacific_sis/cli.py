@@ -0,0 +1,114 @@
+"""The pacific-sis command line.
+
+    pacific-sis list
+    pacific-sis sync student --dry-run
+    pacific-sis run rollover --config config-fsm.json --set sis_rollover_to_year=2026
+
+Each command runs the corresponding notebook script (e.g. sync-student.py) of
+the working directory (or --dir), the checkout holding config.json and data/, as
+when run from Jupyter. Only argparse is imported until a script actually runs
+so --help, list and mistakes on the command line answer immediately; pandas,
+SQLAlchemy and the database drivers are loaded by the script itself and the
+databases are only connected to when first queried (see pacific_sis.runtime).
+"""
+
+import os
+import sys
+import json
+import argparse
+
+SYNC_SCRIPTS = {
+    'lookups': 'sync-lookups.py',
+    'schools-update-existing': 'sync-schools-update-existing.py',
+    'schools-insert-new': 'sync-schools-insert-new.py',
+    'schools-grades-insert-new': 'sync-schools-grades-insert-new.py',
+    'school-calendars': 'sync-school-calendars.py',
+    'subjects': 'sync-subjects.py',
+    'attendance': 'sync-attendance.py',
+    'staff': 'sync-staff.py',
+    'student': 'sync-student.py',
+}
+
+TOOL_SCRIPTS = {
+    'parity': 'check-parity.py',
+    'rollover': 'rollover-academic-year.py',
+    'propagate-templates': 'propagate-templates.py',
+    'apply-script': 'apply-sync-script.py',
+}
+
+
+def _override(value):
+    key, sep, raw = value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError("expected key=value, got {}".format(value))
+    try:
+        return key, json.loads(raw)
+    except ValueError:
+        return key, raw
+
+
+def _add_run_options(parser):
+    parser.add_argument('--config', default='config.json', help="configuration file, relative to --dir (default: config.json)")
+    parser.add_argument('--set', dest='overrides', metavar='KEY=VALUE', type=_override, action='append', default=[],
+                        help="override a configuration key, VALUE in JSON (e.g. --set sis_bulk_load=true)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="prepare and export everything but write nothing to the SIS (sis_load_data_to_sql=false)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='pacific-sis', description="Sync the Pacific EMIS with the openSIS based SIS")
+    parser.add_argument('--dir', default='.', help="directory with the notebook scripts, config.json and data/ (default: .)")
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    commands.add_parser('list', help="list the syncs and tools")
+
+    sync = commands.add_parser('sync', help="run a sync notebook")
+    sync.add_argument('entity', choices=list(SYNC_SCRIPTS), metavar='entity', help=', '.join(SYNC_SCRIPTS))
+    _add_run_options(sync)
+
+    run = commands.add_parser('run', help="run a maintenance notebook")
+    run.add_argument('tool', choices=list(TOOL_SCRIPTS), metavar='tool', help=', '.join(TOOL_SCRIPTS))
+    _add_run_options(run)
+    return parser
+
+
+def run_script(directory, script, config_path, overrides):
+    """Run a notebook script in directory with the configuration config_path and overrides"""
+    import runpy
+    from pacific_sis import runtime
+
+    directory = os.path.abspath(directory)
+    path = os.path.join(directory, script)
+    if not os.path.exists(path):
+        raise SystemExit("{} not found, run pacific-sis from the checkout holding the notebooks (or use --dir)".format(path))
+    runtime.CONFIG_PATH = os.path.abspath(config_path)
+    runtime.CONFIG_OVERRIDES = dict(overrides)
+    os.chdir(directory)
+    sys.path.insert(0, directory)
+    runpy.run_path(path, run_name='__main__')
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == 'list':
+        print("pacific-sis sync <entity>")
+        for name, script in SYNC_SCRIPTS.items():
+            print("  {:28}{}".format(name, script))
+        print("pacific-sis run <tool>")
+        for name, script in TOOL_SCRIPTS.items():
+            print("  {:28}{}".format(name, script))
+        return 0
+
+    script = SYNC_SCRIPTS[args.entity] if args.command == 'sync' else TOOL_SCRIPTS[args.tool]
+    overrides = list(args.overrides)
+    if args.dry_run:
+        overrides.append(('sis_load_data_to_sql', False))
+    config_path = os.path.join(args.dir, args.config) if not os.path.isabs(args.config) else args.config
+    run_script(args.dir, script, config_path, overrides)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""Cloning template records of a school to other schools.
+
+Several notebooks set up new schools (attendance codes, subjects, permissions,
+etc.) by copying the records of a template school. clone_template does it for a
+template DataFrame and a DataFrame of target schools (one row per school with the
+per school values, e.g. school_id): the template rows are tiled and the target
+rows repeated with NumPy indexing so the result is built in one allocation,
+whatever the number of template rows. iter_clone_template yields the same
+records a chunk of schools at a time for very large templates.
+"""
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+# Schools of the tenant without any record in a table (and optional condition on it)
+query_schools_without = """
+SELECT sm.school_id
+FROM school_master sm
+WHERE sm.tenant_id = '{tenant_id}' AND NOT EXISTS (
+    SELECT 1 FROM `{table}` t
+    WHERE t.tenant_id = sm.tenant_id AND t.school_id = sm.school_id {where}
+)
+ORDER BY sm.school_id;
+"""
+
+
+def schools_without(engine, table, tenant_id, where=''):
+    """The DataFrame of the school_id with no records in table (e.g. where="AND t.academic_year = 2023")"""
+    with engine.begin() as conn:
+        return pd.read_sql_query(sa.text(query_schools_without.format(tenant_id=tenant_id, table=table, where=where)), conn)
+
+
+def _clone(df_template, targets, overrides, ids, id_offset):
+    n, m = len(targets), len(df_template)
+    df = df_template.take(np.tile(np.arange(m), n)).reset_index(drop=True)
+    rows = np.repeat(np.arange(n), m)
+    for c in targets.columns:
+        if c in df.columns:
+            df[c] = targets[c].to_numpy()[rows]
+    for c, value in (overrides or {}).items():
+        df[c] = value
+    for c, start in (ids or {}).items():
+        df[c] = np.arange(start + id_offset, start + id_offset + len(df))
+    return df
+
+
+def clone_template(df_template, targets, overrides=None, ids=None):
+    """The records of df_template for each school of targets
+
+    The columns of targets (e.g. school_id, school_guid) replace those of the
+    template for the records of each school, overrides ({column: value}) are set
+    on all the records and ids ({column: first id}) are numbered sequentially
+    from the given first id. Any other column (including the template's own IDs)
+    is copied as is.
+    """
+    return _clone(df_template, targets.reset_index(drop=True), overrides, ids, 0)
+
+
+def iter_clone_template(df_template, targets, overrides=None, ids=None, schools_per_chunk=100):
+    """Same as clone_template but yields the records a chunk of schools at a time"""
+    targets = targets.reset_index(drop=True)
+    for i in range(0, len(targets), schools_per_chunk):
+        yield _clone(df_template, targets.iloc[i:i + schools_per_chunk], overrides, ids, i * len(df_template))
@@ -0,0 +1,108 @@
+"""Persistent crosswalk between the EMIS and the SIS students.
+
+The emis_student_crosswalk table of the SIS database records, for every student
+loaded from the EMIS, the EMIS stuID (and stuCardID) with the SIS school_id,
+student_id and student_guid. Its rows are loaded together with the new students
+and the existing students are backfilled from student_master.alternate_id
+(the stuCardID). Students are then matched on their stuID with an indexed key
+lookup, the names and date of birth only being a fallback for the students not
+in the crosswalk, so corrected names no longer create duplicates.
+"""
+
+import pandas as pd
+import sqlalchemy as sa
+
+from pacific_sis.sql import temp_table
+
+CROSSWALK_TABLE = 'emis_student_crosswalk'
+
+create_crosswalk = """
+CREATE TABLE IF NOT EXISTS `emis_student_crosswalk` (
+    `tenant_id` CHAR(36) NOT NULL,
+    `emis_stu_id` VARCHAR(50) NOT NULL,
+    `emis_stu_card_id` VARCHAR(50) NULL,
+    `school_id` INT NOT NULL,
+    `student_id` INT NOT NULL,
+    `student_guid` CHAR(36) NULL,
+    `created_on` DATETIME NULL,
+    PRIMARY KEY (`tenant_id`, `emis_stu_id`),
+    UNIQUE KEY `ix_emis_student_crosswalk_student` (`tenant_id`, `school_id`, `student_id`),
+    KEY `ix_emis_student_crosswalk_card` (`tenant_id`, `emis_stu_card_id`)
+);
+"""
+
+# SIS students with the stuCardID of exactly one EMIS student (the others are uploaded
+# without one, MySQL can't refer to a temporary table twice) and not in the crosswalk yet
+backfill_crosswalk = """
+INSERT INTO `emis_student_crosswalk` (tenant_id, emis_stu_id, emis_stu_card_id, school_id, student_id, student_guid, created_on)
+SELECT sm.tenant_id, k.emis_stu_id, k.emis_stu_card_id, sm.school_id, sm.student_id, sm.student_guid, :datetime
+FROM tmp_emis_crosswalk_keys k
+INNER JOIN student_master sm ON sm.tenant_id = :tenant_id AND sm.alternate_id = k.emis_stu_card_id
+WHERE sm.alternate_id IN (SELECT alternate_id FROM student_master WHERE tenant_id = :tenant_id GROUP BY alternate_id HAVING COUNT(*) = 1)
+AND NOT EXISTS (SELECT 1 FROM `emis_student_crosswalk` c WHERE c.tenant_id = sm.tenant_id AND c.emis_stu_id = k.emis_stu_id)
+AND NOT EXISTS (SELECT 1 FROM `emis_student_crosswalk` c WHERE c.tenant_id = sm.tenant_id AND c.school_id = sm.school_id AND c.student_id = sm.student_id);
+"""
+
+query_crosswalk_students = """
+SELECT k.emis_stu_id, {columns}
+FROM tmp_emis_crosswalk_keys k
+INNER JOIN `emis_student_crosswalk` c ON c.tenant_id = :tenant_id AND c.emis_stu_id = k.emis_stu_id
+INNER JOIN student_master sm ON sm.tenant_id = c.tenant_id AND sm.school_id = c.school_id AND sm.student_id = c.student_id;
+"""
+
+
+def crosswalk_exists(engine):
+    with engine.connect() as conn:
+        return conn.execute(sa.text("SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"),
+                            {'table': CROSSWALK_TABLE}).scalar() > 0
+
+
+def _strip(values):
+    values = pd.Series(values).reset_index(drop=True)
+    return values.where(values.isna(), values.astype(str).str.strip())
+
+
+def _upload_keys(conn, stu_ids, stu_card_ids=None):
+    stu_ids = _strip(stu_ids)
+    stu_card_ids = _strip(stu_card_ids) if stu_card_ids is not None else pd.Series(None, index=stu_ids.index, dtype=object)
+    df_keys = pd.DataFrame({'emis_stu_id': stu_ids, 'emis_stu_card_id': stu_card_ids})
+    df_keys = df_keys.dropna(subset=['emis_stu_id']).drop_duplicates(subset=['emis_stu_id'])
+    df_keys.loc[df_keys['emis_stu_card_id'].duplicated(keep=False), 'emis_stu_card_id'] = None
+    temp_table(conn, 'tmp_emis_crosswalk_keys', df_keys, index=['emis_stu_id'], types={'emis_stu_id': 'VARCHAR(50)', 'emis_stu_card_id': 'VARCHAR(50)'})
+
+
+def ensure_crosswalk(engine, stu_ids, stu_card_ids, tenant_id, datetime):
+    """Create the crosswalk if needed and backfill it with the SIS students of the EMIS stuCardIDs"""
+    with engine.begin() as conn:
+        conn.execute(sa.text(create_crosswalk))
+        _upload_keys(conn, stu_ids, stu_card_ids)
+        n = conn.execute(sa.text(backfill_crosswalk), {'tenant_id': tenant_id, 'datetime': datetime}).rowcount
+        conn.execute(sa.text("DROP TEMPORARY TABLE IF EXISTS tmp_emis_crosswalk_keys"))
+    print("{} existing SIS students added to the crosswalk".format(n))
+    return n
+
+
+def crosswalk_students(engine, stu_ids, tenant_id, sis_columns):
+    """The emis_stu_id with the sis_columns of student_master of the EMIS students in the crosswalk"""
+    columns = ', '.join('sm.`{}`'.format(c) for c in sis_columns)
+    with engine.connect() as conn:
+        _upload_keys(conn, stu_ids)
+        df = pd.read_sql_query(sa.text(query_crosswalk_students.format(columns=columns)), conn, params={'tenant_id': tenant_id})
+        conn.execute(sa.text("DROP TEMPORARY TABLE IF EXISTS tmp_emis_crosswalk_keys"))
+        conn.commit()
+    return df
+
+
+def crosswalk_records(df_students, tenant_id, datetime):
+    """The crosswalk rows of new students (with stuID, alternate_id, school_id, student_id and student_guid)"""
+    df = pd.DataFrame({
+        'tenant_id': tenant_id,
+        'emis_stu_id': _strip(df_students['stuID']).values,
+        'emis_stu_card_id': df_students['alternate_id'].values,
+        'school_id': df_students['school_id'].values,
+        'student_id': df_students['student_id'].values,
+        'student_guid': df_students['student_guid'].values,
+        'created_on': datetime,
+    })
+    # A student enrolled twice in the EMIS is only in the crosswalk once
+    return df.dropna(subset=['emis_stu_id']).drop_duplicates(subset=['emis_stu_id'])
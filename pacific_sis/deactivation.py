@@ -0,0 +1,81 @@
+"""Deactivation of SIS students no longer enrolled in the EMIS.
+
+The EMIS stuCardIDs of the current school year are uploaded into a temporary
+table and the anti-join against student_master (alternate_id) is done by MySQL.
+Only the per school counts come back for the dry run and the updates are applied
+a few schools at a time, each batch in its own transaction. The exit code and
+date are set on the active student_enrollment records (student_master has no
+such columns) and student_master.is_active is cleared.
+"""
+
+import pandas as pd
+import sqlalchemy as sa
+
+from pacific_sis.sql import temp_table
+
+# Active SIS students not in the EMIS key set (students without alternate_id
+# were not loaded from the EMIS and are left alone)
+missing_students_where = """
+sm.tenant_id = :tenant_id AND sm.is_active = 1 AND sm.alternate_id IS NOT NULL AND e.alternate_id IS NULL
+"""
+
+query_students_to_deactivate = """
+SELECT sm.school_id, COUNT(*) AS students
+FROM student_master sm
+LEFT JOIN tmp_emis_students e ON sm.alternate_id = e.alternate_id
+WHERE {}
+GROUP BY sm.school_id
+ORDER BY sm.school_id;
+""".format(missing_students_where)
+
+update_student_enrollment = """
+UPDATE student_enrollment se
+INNER JOIN student_master sm ON se.tenant_id = sm.tenant_id AND se.school_id = sm.school_id AND se.student_id = sm.student_id
+LEFT JOIN tmp_emis_students e ON sm.alternate_id = e.alternate_id
+SET se.is_active = 0, se.exit_code = :exit_code, se.exit_date = :exit_date, se.updated_by = :user_guid, se.updated_on = :datetime
+WHERE {} AND se.is_active = 1 AND sm.school_id IN :school_ids;
+""".format(missing_students_where)
+
+update_student_master = """
+UPDATE student_master sm
+LEFT JOIN tmp_emis_students e ON sm.alternate_id = e.alternate_id
+SET sm.is_active = 0, sm.updated_by = :user_guid, sm.updated_on = :datetime
+WHERE {} AND sm.school_id IN :school_ids;
+""".format(missing_students_where)
+
+
+def upload_emis_keys(conn, alternate_ids):
+    ids = pd.Series(alternate_ids).dropna().astype(str).str.strip().drop_duplicates()
+    if ids.empty:
+        # Would deactivate every student of the tenant
+        raise ValueError("No EMIS students given, refusing to deactivate all SIS students")
+    temp_table(conn, 'tmp_emis_students', pd.DataFrame({'alternate_id': ids.values}), index=['alternate_id'])
+
+
+def deactivate_missing_students(engine, alternate_ids, tenant_id, user_guid, datetime, exit_code, exit_date, dry_run=True, schools_per_batch=20):
+    """Deactivate the active SIS students whose alternate_id is not in alternate_ids
+
+    Returns the DataFrame of students to deactivate per school_id. Nothing is
+    changed when dry_run is set.
+    """
+    params = {'tenant_id': tenant_id, 'user_guid': user_guid, 'datetime': datetime, 'exit_code': exit_code, 'exit_date': exit_date}
+    # A single connection so the temporary table is seen by all the batches
+    with engine.connect() as conn:
+        with conn.begin():
+            upload_emis_keys(conn, alternate_ids)
+            df_counts = pd.read_sql_query(sa.text(query_students_to_deactivate), conn, params={'tenant_id': tenant_id})
+        print("{} active SIS students in {} schools are not enrolled in the EMIS".format(int(df_counts['students'].sum()), len(df_counts)))
+        if dry_run:
+            return df_counts
+
+        school_ids = df_counts['school_id'].tolist()
+        enrollment_stmt = sa.text(update_student_enrollment).bindparams(sa.bindparam('school_ids', expanding=True))
+        master_stmt = sa.text(update_student_master).bindparams(sa.bindparam('school_ids', expanding=True))
+        for i in range(0, len(school_ids), schools_per_batch):
+            batch = school_ids[i:i + schools_per_batch]
+            with conn.begin():
+                # Enrollments first as they are found through the still active student_master
+                enrollments = conn.execute(enrollment_stmt, dict(params, school_ids=batch)).rowcount
+                students = conn.execute(master_stmt, dict(params, school_ids=batch)).rowcount
+            print("Schools {}: {} students and {} enrollments deactivated".format(batch, students, enrollments))
+    return df_counts
@@ -0,0 +1,108 @@
+"""Optional DuckDB engine for the match and transform stages of the student and staff syncs.
+
+With sis_transform_engine set to 'duckdb' the notebooks hand the extracted
+frames to an in-process DuckDB (as Arrow data, without copying them into
+Python objects) and the matching of the EMIS records to the SIS ones, the
+numbering of the new records per school and the projection of the final frames
+are done in SQL on all the cores. Only narrow results (one value per row, in
+the order of the input frame) come back for the matching and numbering and the
+final frames come back as Arrow tables. duckdb is only needed when used.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from pacific_sis.memory import arrow_string_dtype
+
+# Position of the rows of the input frame so the results can be put back in its order
+ROW = '_row'
+
+
+def connect():
+    """An in-memory DuckDB connection"""
+    try:
+        import duckdb
+    except ImportError:
+        raise ImportError("sis_transform_engine 'duckdb' requires the duckdb package, 1.1 or later (pip install 'duckdb>=1.1')")
+    return duckdb.connect()
+
+
+def _arrow(df, columns):
+    table = pa.Table.from_pandas(df[columns].reset_index(drop=True), preserve_index=False)
+    return table.append_column(ROW, pa.array(range(len(df)), pa.int64()))
+
+
+def _quote(c):
+    return '"{}"'.format(c)
+
+
+def _values(result, column):
+    """A column of a result as a numpy array (NULL as NaN, like pandas for the missing keys)"""
+    values = result.fetchnumpy()[column]
+    if np.ma.isMaskedArray(values):
+        values = values.astype(float).filled(np.nan) if values.mask.any() else values.data
+    return values
+
+
+def match(df, df_other, on, con=None):
+    """The _merge indicator ('both' or 'left_only') of each row of df as in a left merge with df_other on the columns on
+
+    Missing values match each other as they do in pandas.
+    """
+    con = con or connect()
+    con.register('l', _arrow(df, on))
+    con.register('r', pa.Table.from_pandas(df_other[on].drop_duplicates().reset_index(drop=True), preserve_index=False))
+    condition = ' AND '.join('r.{c} IS NOT DISTINCT FROM l.{c}'.format(c=_quote(c)) for c in on)
+    found = con.sql("SELECT l.{row}, EXISTS (SELECT 1 FROM r WHERE {condition}) AS found FROM l ORDER BY l.{row}".format(
+        row=ROW, condition=condition)).fetchnumpy()['found']
+    con.unregister('l')
+    con.unregister('r')
+    return pd.Series(pd.Categorical.from_codes(found.astype('int8'), ['left_only', 'both']), index=df.index, name='_merge')
+
+
+def cumcount(df, by, df_start=None, start_column=None, con=None):
+    """The position of each row of df within its by group (in the order of df) plus the start_column of the group in df_start (0 if none)
+
+    Rows without a by value are in no group (NaN) as with pandas.
+    """
+    con = con or connect()
+    con.register('l', _arrow(df, [by]))
+    start, join = '0', ''
+    if df_start is not None:
+        con.register('s', pa.Table.from_pandas(df_start[[by, start_column]].drop_duplicates(subset=[by]).reset_index(drop=True), preserve_index=False))
+        start = 'COALESCE(s.{}, 0)'.format(_quote(start_column))
+        join = 'LEFT JOIN s ON s.{by} = l.{by}'.format(by=_quote(by))
+    values = _values(con.sql("""
+SELECT l.{row}, CASE WHEN l.{by} IS NULL THEN NULL ELSE {start} + ROW_NUMBER() OVER (PARTITION BY l.{by} ORDER BY l.{row}) - 1 END AS n
+FROM l {join}
+ORDER BY l.{row}""".format(row=ROW, start=start, by=_quote(by), join=join)), 'n')
+    con.unregister('l')
+    if df_start is not None:
+        con.unregister('s')
+    return pd.Series(values, index=df.index)
+
+
+def ngroup(df, by, con=None):
+    """The number of the by group of each row of df, groups numbered in the order they first appear
+
+    Rows without a by value are in no group (NaN) as with pandas.
+    """
+    con = con or connect()
+    con.register('l', _arrow(df, [by]))
+    values = _values(con.sql("""
+SELECT f.{row}, CASE WHEN f.missing THEN NULL ELSE DENSE_RANK() OVER (PARTITION BY f.missing ORDER BY f.first_row) - 1 END AS n
+FROM (SELECT l.{row}, l.{by} IS NULL AS missing, MIN(l.{row}) OVER (PARTITION BY l.{by}) AS first_row FROM l) f
+ORDER BY f.{row}""".format(row=ROW, by=_quote(by))), 'n')
+    con.unregister('l')
+    return pd.Series(values, index=df.index)
+
+
+def project(df, columns, con=None):
+    """The columns of df (in that order) computed by DuckDB and returned through Arrow"""
+    con = con or connect()
+    con.register('l', df)
+    table = con.sql("SELECT {} FROM l".format(', '.join(_quote(c) for c in columns))).to_arrow_table()
+    con.unregister('l')
+    string_dtype = arrow_string_dtype()
+    return table.to_pandas(types_mapper=lambda t: string_dtype if pa.types.is_string(t) or pa.types.is_large_string(t) else None)
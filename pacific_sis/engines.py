@@ -0,0 +1,206 @@
+"""Transform engines of the student and staff syncs.
+
+The few heavy steps of sync-student and sync-staff (matching the EMIS records to
+the SIS ones, numbering the new records within a group and projecting the final
+frames) go through a transform engine chosen with sis_transform_engine:
+
+- 'pandas' the reference implementation (what the notebooks always did);
+- 'duckdb' an in-process DuckDB (see pacific_sis.duck);
+- 'polars' Polars lazy frames, so only the needed columns are converted and
+  the work is planned and run on all the cores.
+
+Every engine takes and returns pandas objects in the order of the input frame
+so the business rules of the notebooks stay the same whatever the engine. With
+sis_transform_parity_check set each result is also computed by the pandas engine
+and compared, a difference raises TransformParityError.
+"""
+
+import numpy as np
+import pandas as pd
+
+from pacific_sis import duck
+from pacific_sis.memory import arrow_string_dtype
+
+ENGINES = ['pandas', 'duckdb', 'polars']
+
+
+class TransformParityError(Exception):
+    pass
+
+
+class PandasEngine:
+
+    name = 'pandas'
+
+    def match(self, df, df_other, on):
+        """The _merge indicator ('both' or 'left_only') of each row of df in a left merge with df_other on the columns on"""
+        df_merged = df[on].merge(df_other[on].drop_duplicates(), on=on, how='left', indicator=True)
+        return pd.Series(df_merged['_merge'].astype(str).values, index=df.index, name='_merge')
+
+    def cumcount(self, df, by, df_start=None, start_column=None):
+        """The position of each row within its by group plus the start_column of the group in df_start (0 if none)"""
+        start = 0
+        if df_start is not None:
+            start = df[by].map(df_start.drop_duplicates(subset=[by]).set_index(by)[start_column]).fillna(0)
+        return df.groupby(by).cumcount() + start
+
+    def ngroup(self, df, by):
+        """The number of the by group of each row, in the order the groups first appear"""
+        return df.groupby(by, sort=False).ngroup()
+
+    def project(self, df, columns):
+        return df[columns]
+
+
+class DuckDBEngine:
+
+    name = 'duckdb'
+
+    def __init__(self):
+        self.con = duck.connect()
+
+    def match(self, df, df_other, on):
+        return duck.match(df, df_other, on, self.con)
+
+    def cumcount(self, df, by, df_start=None, start_column=None):
+        return duck.cumcount(df, by, df_start, start_column, self.con)
+
+    def ngroup(self, df, by):
+        return duck.ngroup(df, by, self.con)
+
+    def project(self, df, columns):
+        return duck.project(df, columns, self.con)
+
+
+class PolarsEngine:
+
+    name = 'polars'
+
+    def __init__(self):
+        try:
+            import polars
+        except ImportError:
+            raise ImportError("sis_transform_engine 'polars' requires the polars package, 1.24 or later (pip install 'polars>=1.24')")
+        self.pl = polars
+
+    def _lazy(self, df, columns):
+        # Only the columns used are converted (from their Arrow representation) and numbered rows keep the order
+        return self.pl.from_pandas(df[columns].reset_index(drop=True)).lazy().with_row_index('_row')
+
+    def _series(self, lf, df):
+        return pd.Series(lf.sort('_row').select('n').collect()['n'].to_numpy(), index=df.index)
+
+    def _same_keys(self, lf, lf_other, on):
+        """lf and lf_other with their on columns of the same type (Polars only joins identical types, pandas
+        joins e.g. the float school_id of unmapped schools with integer ones)"""
+        pl = self.pl
+        schema, other_schema = lf.collect_schema(), lf_other.collect_schema()
+        casts = {}
+        for c in on:
+            dtype, other_dtype = schema[c], other_schema[c]
+            if dtype == other_dtype:
+                continue
+            if dtype == pl.Null or other_dtype == pl.Null:
+                casts[c] = other_dtype if dtype == pl.Null else dtype
+            elif dtype.is_numeric() and other_dtype.is_numeric():
+                casts[c] = pl.Float64
+            else:
+                casts[c] = pl.String
+        if not casts:
+            return lf, lf_other
+        return (lf.with_columns([pl.col(c).cast(t) for c, t in casts.items()]),
+                lf_other.with_columns([pl.col(c).cast(t) for c, t in casts.items()]))
+
+    def match(self, df, df_other, on):
+        pl = self.pl
+        lf_other = self.pl.from_pandas(df_other[on].reset_index(drop=True)).lazy().unique().with_columns(pl.lit(True).alias('_found'))
+        lf, lf_other = self._same_keys(self._lazy(df, on), lf_other, on)
+        lf = lf.join(lf_other, on=on, how='left', nulls_equal=True)
+        found = lf.sort('_row').select(pl.col('_found').fill_null(False)).collect()['_found'].to_numpy()
+        return pd.Series(np.where(found, 'both', 'left_only'), index=df.index, name='_merge')
+
+    def cumcount(self, df, by, df_start=None, start_column=None):
+        pl = self.pl
+        lf = self._lazy(df, [by])
+        start = pl.lit(0)
+        if df_start is not None:
+            lf_start = self.pl.from_pandas(df_start[[by, start_column]].drop_duplicates(subset=[by]).reset_index(drop=True)).lazy()
+            lf, lf_start = self._same_keys(lf, lf_start, [by])
+            lf = lf.join(lf_start, on=by, how='left')
+            start = pl.col(start_column).fill_null(0)
+        # Rows without a by value are in no group, as with pandas
+        n = start + pl.int_range(pl.len()).over(by, order_by='_row')
+        lf = lf.with_columns(pl.when(pl.col(by).is_null()).then(None).otherwise(n).alias('n'))
+        return self._series(lf, df)
+
+    def ngroup(self, df, by):
+        pl = self.pl
+        first_row = pl.when(pl.col(by).is_null()).then(None).otherwise(pl.col('_row').min().over(by))
+        lf = self._lazy(df, [by]).with_columns((first_row.rank('dense') - 1).alias('n'))
+        return self._series(lf, df)
+
+    def project(self, df, columns):
+        df_result = self.pl.from_pandas(df[columns]).lazy().select(columns).collect().to_pandas()
+        for c in df_result.columns:
+            if df_result[c].dtype == object and pd.api.types.infer_dtype(df_result[c], skipna=True) == 'string':
+                df_result[c] = df_result[c].astype(arrow_string_dtype())
+        return df_result
+
+
+def _same(expected, actual):
+    """Compare a pandas result with the one of another engine (values only, not dtypes)"""
+    if isinstance(expected, pd.DataFrame):
+        if list(expected.columns) != list(actual.columns) or len(expected) != len(actual):
+            return False
+        return all(_same(expected[c].reset_index(drop=True), actual[c].reset_index(drop=True)) for c in expected.columns)
+    expected = pd.Series(expected).reset_index(drop=True)
+    actual = pd.Series(actual).reset_index(drop=True)
+    if len(expected) != len(actual):
+        return False
+    if pd.api.types.is_numeric_dtype(expected) and pd.api.types.is_numeric_dtype(actual):
+        return bool(np.allclose(expected.astype(float), actual.astype(float), equal_nan=True))
+    if pd.api.types.is_datetime64_any_dtype(expected) or pd.api.types.is_datetime64_any_dtype(actual):
+        return bool((pd.to_datetime(expected).fillna(pd.Timestamp.min) == pd.to_datetime(actual).fillna(pd.Timestamp.min)).all())
+    expected, actual = expected.astype(object), actual.astype(object)
+    both_missing = expected.isna() & actual.isna()
+    return bool((both_missing | (expected.astype(str) == actual.astype(str))).all())
+
+
+class ParityCheckedEngine:
+    """An engine whose every result is compared with the one of the pandas engine"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.reference = PandasEngine()
+        self.name = engine.name
+
+    def _check(self, method, *args, **kwargs):
+        actual = getattr(self.engine, method)(*args, **kwargs)
+        expected = getattr(self.reference, method)(*args, **kwargs)
+        if not _same(expected, actual):
+            raise TransformParityError("The {} engine {} result differs from the pandas one".format(self.engine.name, method))
+        return actual
+
+    def match(self, df, df_other, on):
+        return self._check('match', df, df_other, on)
+
+    def cumcount(self, df, by, df_start=None, start_column=None):
+        return self._check('cumcount', df, by, df_start, start_column)
+
+    def ngroup(self, df, by):
+        return self._check('ngroup', df, by)
+
+    def project(self, df, columns):
+        return self._check('project', df, columns)
+
+
+def transform_engine(name='pandas', parity_check=False):
+    """The transform engine of sis_transform_engine (optionally checked against pandas)"""
+    engines = {'pandas': PandasEngine, 'duckdb': DuckDBEngine, 'polars': PolarsEngine}
+    if name not in engines:
+        raise ValueError("Unknown transform engine {}, expected one of {}".format(name, ENGINES))
+    engine = engines[name]()
+    if parity_check and name != 'pandas':
+        engine = ParityCheckedEngine(engine)
+    print("Transform engine: {}{}".format(name, ' (checked against pandas)' if parity_check and name != 'pandas' else ''))
+    return engine
@@ -0,0 +1,87 @@
+"""Grade levels helpers.
+
+The EMIS warehouse.TeacherLocation records the levels a teacher teaches as one
+flag column per level year (Tpk for pre-school and T00 to T15). Those are packed
+into a single bitmask per teacher and decoded against the SIS gradelevels of the
+teacher's school, where equivalency_id holds the EMIS level year (lvlYear).
+"""
+
+import numpy as np
+import pandas as pd
+
+# The duty flags of warehouse.TeacherLocation in bit order and the EMIS level year of each
+DUTY_FLAGS = ['Tpk'] + ['T{:02d}'.format(y) for y in range(16)]
+DUTY_FLAG_YEARS = [-1] + list(range(16))
+
+
+def pack_duty_flags(df, flags=DUTY_FLAGS):
+    """A uint32 bitmask per row of df with bit i set when the flag column flags[i] is set"""
+    bits = df[flags].fillna(0).to_numpy(dtype=float) != 0
+    weights = np.left_shift(np.uint32(1), np.arange(len(flags), dtype=np.uint32))
+    return pd.Series(bits.astype(np.uint32) @ weights, index=df.index, dtype=np.uint32)
+
+
+def combine_duty_masks(masks, by):
+    """The duties of all the rows of each group (e.g. appointments of a TID) OR-ed together
+
+    Returns a Series aligned with masks.
+    """
+    bit_range = np.arange(len(DUTY_FLAGS), dtype=np.uint32)
+    bits = pd.DataFrame((masks.to_numpy(dtype=np.uint32)[:, None] >> bit_range) & 1, index=masks.index)
+    bits = bits.groupby(by.to_numpy()).transform('max').to_numpy(dtype=np.uint32)
+    weights = np.left_shift(np.uint32(1), bit_range)
+    return pd.Series(bits @ weights, index=masks.index, dtype=np.uint32)
+
+
+def grades_taught(school_ids, masks, df_gradelevels, years=DUTY_FLAG_YEARS, sep=','):
+    """The primary (lowest) and other grade level titles taught for each (school_id, mask)
+
+    school_ids and masks are aligned Series (e.g. columns of the staff DataFrame) and
+    df_gradelevels has the SIS gradelevels columns school_id, equivalency_id and title.
+    The titles are decoded once per distinct (school, mask) pair and broadcast back, so
+    the cost is driven by the handful of distinct duty combinations and not the number
+    of teachers. Returns a DataFrame with the index of school_ids and the columns
+    primary_grade_level_taught and other_grade_level_taught (NaN when nothing matches).
+    """
+    keys = pd.DataFrame({'school_id': school_ids, 'duties_mask': masks})
+    combos = keys.drop_duplicates().reset_index(drop=True)
+
+    # One row per (distinct combination, bit set)
+    masks_arr = combos['duties_mask'].to_numpy(dtype=np.uint32)
+    bits = (masks_arr[:, None] >> np.arange(len(years), dtype=np.uint32)) & 1
+    rows, cols = np.nonzero(bits)
+    df_taught = pd.DataFrame({
+        'combo': rows,
+        'school_id': combos['school_id'].to_numpy()[rows],
+        'equivalency_id': np.asarray(years)[cols],
+    })
+
+    df_gradelevels = df_gradelevels[['school_id', 'equivalency_id', 'title']].drop_duplicates(subset=['school_id', 'equivalency_id'])
+    df_taught = df_taught.merge(df_gradelevels, on=['school_id', 'equivalency_id'], how='inner')
+    df_taught = df_taught.sort_values(['combo', 'equivalency_id'])
+
+    primary = df_taught.groupby('combo')['title'].first()
+    other = df_taught[df_taught.duplicated(subset=['combo'])].groupby('combo')['title'].agg(sep.join)
+    combos['primary_grade_level_taught'] = primary.reindex(combos.index)
+    combos['other_grade_level_taught'] = other.reindex(combos.index)
+
+    result = keys.merge(combos, on=['school_id', 'duties_mask'], how='left')
+    result.index = keys.index
+    return result[['primary_grade_level_taught', 'other_grade_level_taught']]
+
+
+def link_next_grades(df):
+    """The next_grade_id of each grade of df (school_id, grade_id, equivalency_id)
+
+    The grades of a school are chained in equivalency_id order, the last one has
+    no next grade. Returns the next_grade_id Series aligned with df and the
+    DataFrame of the grades followed by a grade that is not the next level year
+    (anomalies to handle before loading).
+    """
+    df = df.sort_values(['school_id', 'equivalency_id', 'grade_id'])
+    by_school = df.groupby('school_id', sort=False)
+    next_grade_id = by_school['grade_id'].shift(-1)
+    next_equivalency_id = by_school['equivalency_id'].shift(-1)
+    gaps = next_equivalency_id.notna() & (next_equivalency_id != df['equivalency_id'] + 1)
+    df_anomalies = df.loc[gaps, ['school_id', 'grade_id', 'equivalency_id']].assign(next_equivalency_id=next_equivalency_id[gaps])
+    return next_grade_id.astype('Int64').reindex(df.index).sort_index(), df_anomalies
@@ -0,0 +1,70 @@
+"""GUIDs of the records created in the SIS.
+
+By default new GUIDs are random (uuid4) like the SIS itself does. With
+sis_deterministic_guids in config.json they are instead UUIDv5 derived from the
+tenant and the EMIS natural key (stuCardID for students, TID for staff and schNo
+for schools) so a rerun produces the same identities and a partially applied load
+can be reconciled with indexed GUID lookups.
+"""
+
+import uuid
+
+import pandas as pd
+import sqlalchemy as sa
+
+from pacific_sis.sql import temp_table
+
+# Never change this, it would change all the deterministic GUIDs
+GUID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'https://github.com/ghachey/pacific-sis-tools')
+
+query_existing_guids = """
+SELECT t.`{column}`
+FROM `{table}` t
+INNER JOIN tmp_guids g ON t.`{column}` = g.`guid`
+WHERE t.`tenant_id` = :tenant_id;
+"""
+
+
+def random_guids(n):
+    return [str(uuid.uuid4()) for _ in range(n)]
+
+
+def deterministic_guids(keys, tenant_id, entity):
+    """UUIDv5 GUIDs of the EMIS natural keys (a Series) of an entity (e.g. 'student')
+
+    Each distinct key is only hashed once. Records without a key, or sharing
+    their key with another record (e.g. a stuCardID given to two students),
+    can't be identified and get a random GUID.
+    """
+    keys = pd.Series(keys)
+    names = keys.astype(str).str.strip()
+    repeated = keys.notna() & names.duplicated(keep=False)
+    if repeated.any():
+        print("{} {} records share their key and get a random GUID: {}".format(int(repeated.sum()), entity, sorted(names[repeated].unique())))
+    identified = keys.notna() & ~repeated
+    unique = names[identified].unique()
+    guids = pd.Series([str(uuid.uuid5(GUID_NAMESPACE, '{}/{}/{}'.format(tenant_id, entity, name))) for name in unique], index=unique)
+    result = names.map(guids).where(identified)
+    missing = result.isna()
+    if missing.any():
+        result[missing] = random_guids(int(missing.sum()))
+    return result
+
+
+def make_guids(keys, tenant_id, entity, deterministic=False):
+    """The GUIDs of the records with the given EMIS natural keys (aligned with keys)"""
+    keys = pd.Series(keys)
+    if deterministic:
+        return deterministic_guids(keys, tenant_id, entity)
+    return pd.Series(random_guids(len(keys)), index=keys.index)
+
+
+def existing_guids(engine, table, column, guids, tenant_id):
+    """The subset of guids already in table (column being the GUID column)"""
+    guids = pd.Series(guids).dropna().drop_duplicates()
+    if guids.empty:
+        return set()
+    with engine.begin() as conn:
+        temp_table(conn, 'tmp_guids', pd.DataFrame({'guid': guids.values}), index=['guid'], types={'guid': 'CHAR(36)'})
+        df = pd.read_sql_query(sa.text(query_existing_guids.format(table=table, column=column)), conn, params={'tenant_id': tenant_id})
+    return set(df[column])
@@ -0,0 +1,88 @@
+"""Minimal difference sync of EMIS lookups into the SIS dpdown_valuelist.
+
+Rather than deleting all the values of a lookup and re-inserting them for every
+school, the EMIS lookup (code, description, sort order) is compared to the
+current values of each school and only the differences are written: DELETEs of
+the values no longer in the EMIS, UPDATEs of the changed ones and INSERTs of the
+missing ones. They are parameterized batches (see pacific_sis.sql) executed as
+is or rendered into the sync script.
+"""
+
+import pandas as pd
+
+from pacific_sis.sql import records
+
+value_columns = ['lov_code', 'lov_column_value', 'sort_order']
+
+
+def _normalize(df):
+    df = df.copy()
+    df['lov_code'] = df['lov_code'].astype(str).str.strip()
+    df['lov_column_value'] = df['lov_column_value'].astype(str).str.strip()
+    df['sort_order'] = pd.to_numeric(df['sort_order'], errors='coerce').astype('Int64')
+    return df
+
+
+def diff_lookup(lookup_values, df_dpdown_valuelist, school_ids):
+    """Compare an EMIS lookup to the per school values of a lov_name in dpdown_valuelist
+
+    lookup_values is the list of (code, description, sort_order) tuples of the
+    EMIS and df_dpdown_valuelist the current dpdown_valuelist rows of the lookup.
+    Returns the DataFrames of the values to insert, update and delete.
+    """
+    df_emis = _normalize(pd.DataFrame(lookup_values, columns=value_columns).drop_duplicates(subset=['lov_code']))
+    df_expected = pd.DataFrame({'school_id': school_ids}).merge(df_emis, how='cross')
+
+    df_sis = df_dpdown_valuelist.dropna(subset=['school_id'])[['id', 'school_id'] + value_columns]
+    df_sis = _normalize(df_sis)
+    df_sis['school_id'] = df_sis['school_id'].astype(int)
+    # A code is kept once per school, any other copy is deleted
+    df_sis = df_sis.sort_values('id')
+    df_sis_dups = df_sis[df_sis.duplicated(subset=['school_id', 'lov_code'], keep='first')]
+    df_sis = df_sis.drop(df_sis_dups.index)
+
+    df = df_expected.merge(df_sis, on=['school_id', 'lov_code'], how='outer', suffixes=('', '_sis'), indicator=True)
+    df_insert = df[df['_merge'] == 'left_only'][['school_id'] + value_columns]
+    df_matched = df[df['_merge'] == 'both']
+    changed = (df_matched['lov_column_value'] != df_matched['lov_column_value_sis']) | (df_matched['sort_order'].fillna(-1) != df_matched['sort_order_sis'].fillna(-1))
+    df_update = df_matched[changed][['id', 'school_id'] + value_columns]
+    df_delete = pd.concat([df[df['_merge'] == 'right_only'][['id', 'school_id']], df_sis_dups[['id', 'school_id']]])
+
+    df_update = df_update.astype({'id': int}).reset_index(drop=True)
+    df_delete = df_delete.astype({'id': int}).sort_values('id').reset_index(drop=True)
+    return df_insert.reset_index(drop=True), df_update, df_delete
+
+
+delete_value = """
+DELETE FROM dpdown_valuelist WHERE lov_name = :lov_name AND id = :id
+"""
+
+update_value = """
+UPDATE dpdown_valuelist SET lov_column_value = :lov_column_value, sort_order = :sort_order, updated_by = :updated_by, updated_on = :updated_on
+WHERE lov_name = :lov_name AND lov_code = :lov_code AND id = :id
+"""
+
+insert_value = """
+INSERT INTO dpdown_valuelist(id, tenant_id, school_id, lov_name, lov_column_value, lov_code, sort_order, created_by, created_on, updated_by, updated_on)
+VALUES (:id, :tenant_id, :school_id, :lov_name, :lov_column_value, :lov_code, :sort_order, :created_by, :created_on, :updated_by, :updated_on)
+"""
+
+
+def lookup_sync_batches(lov_name, df_insert, df_update, df_delete, next_id, tenant_id, user_guid, datetime):
+    """The parameterized (sql, rows) batches applying the output of diff_lookup
+
+    New values get the IDs of the deleted ones first (as the full sync does) and
+    then IDs after next_id (the current max id of dpdown_valuelist).
+    """
+    deleted_ids = df_delete['id'].tolist()
+    df_delete = pd.DataFrame({'lov_name': lov_name, 'id': deleted_ids})
+
+    df_update = df_update[['id', 'lov_code', 'lov_column_value', 'sort_order']].assign(lov_name=lov_name, updated_by=user_guid, updated_on=datetime)
+
+    new_ids = deleted_ids[:len(df_insert)]
+    new_ids += list(range(next_id + 1, next_id + 1 + len(df_insert) - len(new_ids)))
+    df_insert = df_insert[['school_id', 'lov_code', 'lov_column_value', 'sort_order']].assign(
+        id=new_ids, tenant_id=tenant_id, lov_name=lov_name, created_by=user_guid, created_on=datetime, updated_by=user_guid, updated_on=datetime)
+    df_insert['school_id'] = df_insert['school_id'].astype(int)
+
+    return [(sql, records(df)) for sql, df in [(delete_value, df_delete), (update_value, df_update), (insert_value, df_insert)] if len(df) > 0]
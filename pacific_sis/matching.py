@@ -0,0 +1,94 @@
+"""Matching the EMIS students to the SIS students on the server.
+
+Rather than downloading the whole student_master of the tenant to merge it with
+the EMIS students in pandas, only the EMIS keys (row number, stuCardID, names and
+date of birth) are uploaded into an indexed temporary table. MySQL does the
+anti-join and only the row numbers of the EMIS students not in the SIS come
+back, along with the SIS students sharing a stuCardID (alternate_id) with the
+EMIS ones (needed to find their changes).
+
+Names are compared with the collation of student_master (the columns of the
+temporary table are given the character set and collation of the student_master
+columns, the connection's default could differ and even be an illegal mix) and
+NULLs match each other as they do in a pandas merge. student_master collations
+are case insensitive, match_keys normalizes the names the same way (trimmed and
+lower case) for the matching in pandas. Accent insensitive collations (*_ai_ci)
+also match names differing only by their accents, which the matching in pandas
+does not.
+"""
+
+import pandas as pd
+import sqlalchemy as sa
+
+from pacific_sis.sql import temp_table
+
+key_columns = ['first_given_name', 'last_family_name', 'dob']
+name_columns = ['first_given_name', 'last_family_name']
+
+query_column_collations = """
+SELECT COLUMN_NAME, CHARACTER_SET_NAME, COLLATION_NAME
+FROM information_schema.COLUMNS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'student_master' AND COLLATION_NAME IS NOT NULL
+"""
+
+query_missing_students = """
+SELECT k.emis_row
+FROM tmp_emis_student_keys k
+WHERE NOT EXISTS (
+    SELECT 1 FROM student_master sm
+    WHERE sm.tenant_id = :tenant_id AND sm.first_given_name <=> k.first_given_name AND sm.last_family_name <=> k.last_family_name AND sm.dob <=> k.dob
+)
+ORDER BY k.emis_row;
+"""
+
+query_matched_students = """
+SELECT {columns}
+FROM student_master sm
+WHERE sm.tenant_id = :tenant_id AND sm.alternate_id IN (SELECT DISTINCT alternate_id FROM tmp_emis_student_keys);
+"""
+
+
+def match_keys(df):
+    """The key columns of df with the names normalized as the student_master collation compares them"""
+    df = df[key_columns].copy()
+    for c in name_columns:
+        df[c] = df[c].str.strip().str.lower()
+    return df
+
+
+def key_column_types(conn):
+    """The types of the string columns of tmp_emis_student_keys, with the collations of student_master"""
+    collations = {row[0]: (row[1], row[2]) for row in conn.execute(sa.text(query_column_collations))}
+    return {c: 'VARCHAR(255) CHARACTER SET {} COLLATE {}'.format(*collations[c]) for c in ['alternate_id'] + name_columns if c in collations}
+
+
+def match_students(engine, df_student_emis, tenant_id, sis_columns):
+    """The EMIS students not in the SIS (by names and date of birth) and the SIS students of their stuCardIDs
+
+    df_student_emis has the SIS column names (alternate_id, first_given_name,
+    last_family_name and dob). Returns the boolean Series (on the index of
+    df_student_emis) of the students missing from the SIS and the DataFrame of
+    sis_columns of the SIS students with the alternate_id of an EMIS student.
+    """
+    df_keys = df_student_emis[['alternate_id'] + key_columns].reset_index(drop=True)
+    df_keys.insert(0, 'emis_row', range(len(df_keys)))
+    for c in ['alternate_id', 'first_given_name', 'last_family_name']:
+        df_keys[c] = df_keys[c].where(df_keys[c].isna(), df_keys[c].astype(str).str.strip())
+    df_keys['dob'] = pd.to_datetime(df_keys['dob'], errors='coerce')
+
+    with engine.connect() as conn:
+        types = key_column_types(conn)
+        types.update({'emis_row': 'INT', 'dob': 'DATE'})
+        temp_table(conn, 'tmp_emis_student_keys', df_keys, index=['last_family_name', 'first_given_name', 'dob'], types=types)
+        conn.execute(sa.text("ALTER TABLE tmp_emis_student_keys ADD INDEX (alternate_id)"))
+        missing_rows = [row[0] for row in conn.execute(sa.text(query_missing_students), {'tenant_id': tenant_id})]
+        columns = ', '.join('sm.`{}`'.format(c) for c in sis_columns)
+        df_student_sis = pd.read_sql_query(sa.text(query_matched_students.format(columns=columns)), conn, params={'tenant_id': tenant_id})
+        conn.execute(sa.text("DROP TEMPORARY TABLE IF EXISTS tmp_emis_student_keys"))
+        conn.commit()
+
+    missing = pd.Series(False, index=df_student_emis.index)
+    missing.iloc[missing_rows] = True
+    print("{} EMIS keys uploaded: {} students not in the SIS, {} SIS students with their stuCardID".format(
+        len(df_keys), len(missing_rows), len(df_student_sis)))
+    return missing, df_student_sis
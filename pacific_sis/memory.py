@@ -0,0 +1,72 @@
+"""Compact in-memory representation of the sync DataFrames.
+
+The extracted frames are converted from Python object strings to Arrow backed
+strings (with NaN as missing value like the object columns, so the notebooks
+behave the same) and the columns of the final frames that repeat a few values
+(tenant_id, created_by, grade_level_title, enrollment_code, etc.) are stored as
+categoricals, i.e. a small integer code per row, until they are written. The
+constant columns (tenant_id, created_by and the many missing values) are built
+as categoricals to begin with (constant_column) so the wide frames of the new
+records never hold them as objects or floats. memory_report prints the deep
+memory footprint of some frames.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def arrow_string_dtype():
+    """The Arrow backed string dtype with NaN for missing values"""
+    try:
+        return pd.StringDtype('pyarrow', na_value=np.nan)
+    except TypeError:
+        # pandas < 2.3
+        return pd.StringDtype('pyarrow_numpy')
+
+
+def arrow_strings(df):
+    """df with its object columns of strings converted to Arrow strings"""
+    dtype = arrow_string_dtype()
+    df = df.copy()
+    for c in df.columns:
+        if df[c].dtype == object and pd.api.types.infer_dtype(df[c], skipna=True) in ('string', 'empty'):
+            df[c] = df[c].astype(dtype)
+    return df
+
+
+def constant_column(index, value, categorical=True):
+    """A column of value for the rows of index
+
+    With categorical a string or missing value is a categorical (one byte per
+    row), other values (e.g. numbers) are left as they are.
+    """
+    if categorical and (isinstance(value, str) or pd.isna(value)):
+        categories = [] if pd.isna(value) else [value]
+        codes = np.full(len(index), 0 if categories else -1, dtype='int8')
+        return pd.Series(pd.Categorical.from_codes(codes, categories=pd.Index(categories, dtype=object)), index=index)
+    return pd.Series(value, index=index)
+
+
+def compact(df, max_unique_ratio=0.1):
+    """df with its string (or constant) columns of few distinct values as categoricals"""
+    df = df.copy()
+    n = max(len(df), 1)
+    for c in df.columns:
+        series = df[c]
+        if isinstance(series.dtype, pd.CategoricalDtype) or not (pd.api.types.is_string_dtype(series) or series.dtype == object):
+            continue
+        if series.nunique(dropna=True) <= max(1, max_unique_ratio * n):
+            df[c] = series.astype('category')
+    return df
+
+
+def memory_report(frames):
+    """Print and return the rows, columns and deep memory (MB) of the DataFrames of frames ({name: df})"""
+    df_report = pd.DataFrame([{
+        'frame': name,
+        'rows': len(df),
+        'columns': len(df.columns),
+        'memory_mb': round(df.memory_usage(deep=True).sum() / 1024 ** 2, 2),
+    } for name, df in frames.items()])
+    print(df_report.to_string(index=False))
+    return df_report
@@ -0,0 +1,200 @@
+"""Parity between the EMIS and the SIS from per school aggregates.
+
+Instead of pulling both sides fully each server computes, per school, the number
+of records and a digest of their normalized keys (the sum of the first 32 bits of
+the MD5 of each key, which both SQL Server and MySQL compute identically). Only
+these small summaries are compared and only the schools whose summaries differ
+are drilled down into (counts by grade and gender).
+
+Schools are matched on the EMIS schNo (school_alt_id in the SIS), students on the
+stuCardID (alternate_id) and staff on the tPayroll (staff_internal_id). Like the
+EMIS teachers of the survey year, only the SIS staff_school_info records of a
+teacher and overlapping the school year (from config.json) are counted.
+
+MySQL hashes the utf8mb4 bytes of the keys so SQL Server hashes the UTF-8 bytes
+too (converted through a UTF-8 collation, SQL Server 2019 or later) and not the
+ones of the code page of the column, for the keys with non-ASCII characters
+(e.g. school names) to match.
+"""
+
+import pandas as pd
+import sqlalchemy as sa
+
+from pacific_sis.schoolyear import school_year_dates
+
+
+# A SQL Server collation whose code page is UTF-8
+EMIS_UTF8_COLLATION = 'Latin1_General_100_CI_AS_SC_UTF8'
+
+
+def emis_hash(column):
+    """SQL Server expression of the 32 bit hash of a normalized key (of its UTF-8 bytes)"""
+    utf8 = "CAST(CAST(UPPER(LTRIM(RTRIM(COALESCE({}, N'')))) AS NVARCHAR(200)) COLLATE {} AS VARCHAR(800))".format(column, EMIS_UTF8_COLLATION)
+    return "CAST(SUBSTRING(HASHBYTES('MD5', {}), 1, 4) AS BIGINT)".format(utf8)
+
+
+def sis_hash(column):
+    """MySQL expression of the 32 bit hash of a normalized key"""
+    return "CAST(CONV(LEFT(MD5(UPPER(TRIM(COALESCE({}, '')))), 8), 16, 10) AS UNSIGNED)".format(column)
+
+
+# The queries of each entity, all returning school_code, the detail columns (for
+# the drill down), records and digest. {select} and {group_by} are the detail
+# columns, {where} an optional restriction to some schools.
+query_students_emis = """
+SELECT SE.schNo AS school_code{select}, COUNT(*) AS records, SUM({hash}) AS digest
+FROM [dbo].[Student_] S
+INNER JOIN [dbo].[StudentEnrolment_] SE ON S.stuID = SE.stuID
+INNER JOIN [dbo].[Schools] SC ON SE.schNo = SC.schNo
+WHERE SE.stueYear = {year} {where}
+GROUP BY SE.schNo{group_by};
+"""
+
+query_students_sis = """
+SELECT sch.school_alt_id AS school_code{select}, COUNT(*) AS records, SUM({hash}) AS digest
+FROM student_master sm
+INNER JOIN school_master sch ON sm.tenant_id = sch.tenant_id AND sm.school_id = sch.school_id
+LEFT JOIN (
+    SELECT tenant_id, school_id, student_id, MAX(enrollment_id) AS enrollment_id
+    FROM student_enrollment
+    WHERE is_active = 1
+    GROUP BY tenant_id, school_id, student_id
+) le ON sm.tenant_id = le.tenant_id AND sm.school_id = le.school_id AND sm.student_id = le.student_id
+LEFT JOIN student_enrollment se ON le.tenant_id = se.tenant_id AND le.school_id = se.school_id AND le.student_id = se.student_id AND le.enrollment_id = se.enrollment_id
+LEFT JOIN gradelevels g ON se.tenant_id = g.tenant_id AND se.school_id = g.school_id AND se.grade_id = g.grade_id
+WHERE sm.tenant_id = '{tenant_id}' AND sm.is_active = 1 {where}
+GROUP BY sch.school_alt_id{group_by};
+"""
+
+query_staff_emis = """
+SELECT TL.SurveySchNo AS school_code{select}, COUNT(*) AS records, SUM({hash}) AS digest
+FROM [warehouse].[TeacherLocation] TL
+INNER JOIN [dbo].[lkpTeacherRole] TR ON TL.SurveyRole = TR.codeCode
+INNER JOIN [dbo].[Schools] S ON TL.SurveySchNo = S.schNo
+INNER JOIN [dbo].[TeacherIdentity] TI ON TL.TID = TI.tID
+WHERE TL.SurveyYear = {year} AND TL.TAMX IN ('T', 'M') {where}
+GROUP BY TL.SurveySchNo{group_by};
+"""
+
+query_staff_sis = """
+SELECT sch.school_alt_id AS school_code{select}, COUNT(*) AS records, SUM({hash}) AS digest
+FROM staff_school_info ssi
+INNER JOIN staff_master sm ON ssi.tenant_id = sm.tenant_id AND ssi.staff_id = sm.staff_id
+INNER JOIN school_master sch ON ssi.tenant_id = sch.tenant_id AND ssi.school_attached_id = sch.school_id
+WHERE ssi.tenant_id = '{tenant_id}' AND ssi.profile = 'Teacher'
+    AND ssi.start_date <= '{end_date}' AND (ssi.end_date IS NULL OR ssi.end_date >= '{start_date}') {where}
+GROUP BY sch.school_alt_id{group_by};
+"""
+
+query_schools_emis = """
+SELECT S.schNo AS school_code{select}, COUNT(*) AS records, SUM({hash}) AS digest
+FROM [dbo].[Schools] S
+WHERE 1 = 1 {where}
+GROUP BY S.schNo{group_by};
+"""
+
+query_schools_sis = """
+SELECT sch.school_alt_id AS school_code{select}, COUNT(*) AS records, SUM({hash}) AS digest
+FROM school_master sch
+WHERE sch.tenant_id = '{tenant_id}' {where}
+GROUP BY sch.school_alt_id{group_by};
+"""
+
+# Per entity: the queries, the key hashed on each side, the school code column to
+# restrict a drill down and the detail columns (detail name: (EMIS, SIS) expression)
+ENTITIES = {
+    'schools': {
+        'emis': query_schools_emis, 'sis': query_schools_sis,
+        'key': ("CONCAT(S.schNo, '|', S.schName)", "CONCAT(sch.school_alt_id, '|', sch.school_name)"),
+        'school_code': ('S.schNo', 'sch.school_alt_id'),
+        'details': {},
+    },
+    'students': {
+        'emis': query_students_emis, 'sis': query_students_sis,
+        'key': ('S.stuCardID', 'sm.alternate_id'),
+        'school_code': ('SE.schNo', 'sch.school_alt_id'),
+        'details': {
+            'grade': ('SE.stueClass', 'g.short_name'),
+            'gender': ("CASE WHEN S.stuGender = 'F' THEN 'Female' WHEN S.stuGender = 'M' THEN 'Male' ELSE 'Other' END", 'sm.gender'),
+        },
+    },
+    'staff': {
+        'emis': query_staff_emis, 'sis': query_staff_sis,
+        'key': ('TI.tPayroll', 'sm.staff_internal_id'),
+        'school_code': ('TL.SurveySchNo', 'sch.school_alt_id'),
+        'details': {
+            'gender': ("CASE WHEN TI.tSex = 'F' THEN 'Female' WHEN TI.tSex = 'M' THEN 'Male' ELSE 'Other' END", 'sm.gender'),
+        },
+    },
+}
+
+
+def _query(engine, side, entity, emis_school_year, tenant_id, details=False, school_codes=None, config=None):
+    spec = ENTITIES[entity]
+    start_date, end_date = school_year_dates(emis_school_year, config)
+    i = 0 if side == 'emis' else 1
+    select, group_by = '', ''
+    if details:
+        # SQL Server can't group by a column alias
+        select = ''.join(', {} AS {}'.format(expressions[i], name) for name, expressions in spec['details'].items())
+        group_by = ''.join(', {}'.format(expressions[i]) for expressions in spec['details'].values())
+    where = 'AND {} IN :school_codes'.format(spec['school_code'][i]) if school_codes is not None else ''
+    hash = emis_hash(spec['key'][0]) if side == 'emis' else sis_hash(spec['key'][1])
+    query = spec[side].format(select=select, group_by=group_by, hash=hash, year=emis_school_year, tenant_id=tenant_id, where=where,
+                              start_date=start_date, end_date=end_date)
+    stmt = sa.text(query)
+    params = {}
+    if school_codes is not None:
+        stmt = stmt.bindparams(sa.bindparam('school_codes', expanding=True))
+        params['school_codes'] = list(school_codes)
+    with engine.connect() as conn:
+        df = pd.read_sql_query(stmt, conn, params=params)
+    df['school_code'] = df['school_code'].astype(str).str.strip().str.upper()
+    # MySQL sums to DECIMAL, SQL Server to BIGINT
+    for c in ['records', 'digest']:
+        df[c] = pd.to_numeric(df[c]).astype('int64')
+    return df
+
+
+def compare(df_emis, df_sis, on):
+    """Outer join of the EMIS and SIS aggregates flagging the rows that differ"""
+    df = df_emis.merge(df_sis, on=on, how='outer', suffixes=('_emis', '_sis'))
+    for c in ['records_emis', 'records_sis', 'digest_emis', 'digest_sis']:
+        df[c] = df[c].fillna(0).astype('int64')
+    df['matches'] = (df['records_emis'] == df['records_sis']) & (df['digest_emis'] == df['digest_sis'])
+    return df.sort_values(on).reset_index(drop=True)
+
+
+def school_parity(mssql_engine, mysql_engine, entity, emis_school_year, tenant_id, config=None):
+    """Records and key digest per school of an entity on both sides"""
+    df_emis = _query(mssql_engine, 'emis', entity, emis_school_year, tenant_id, config=config)
+    df_sis = _query(mysql_engine, 'sis', entity, emis_school_year, tenant_id, config=config)
+    return compare(df_emis, df_sis, ['school_code'])
+
+
+def drill_down(mssql_engine, mysql_engine, entity, emis_school_year, tenant_id, school_codes, config=None):
+    """Records and key digest by the detail columns (e.g. grade and gender) of some schools"""
+    details = list(ENTITIES[entity]['details'])
+    if not details or len(school_codes) == 0:
+        return None
+    df_emis = _query(mssql_engine, 'emis', entity, emis_school_year, tenant_id, details=True, school_codes=school_codes, config=config)
+    df_sis = _query(mysql_engine, 'sis', entity, emis_school_year, tenant_id, details=True, school_codes=school_codes, config=config)
+    for df in [df_emis, df_sis]:
+        for c in details:
+            df[c] = df[c].fillna('').astype(str).str.strip()
+    df = compare(df_emis, df_sis, ['school_code'] + details)
+    return df[~df['matches']].reset_index(drop=True)
+
+
+def parity_report(mssql_engine, mysql_engine, emis_school_year, tenant_id, entities=None, config=None):
+    """The parity of each entity: {entity: {'schools': per school comparison, 'details': drill down}}"""
+    report = {}
+    for entity in entities or list(ENTITIES):
+        df_schools = school_parity(mssql_engine, mysql_engine, entity, emis_school_year, tenant_id, config=config)
+        mismatches = df_schools.loc[~df_schools['matches'], 'school_code'].tolist()
+        print("{}: {} of {} schools differ between the EMIS and the SIS".format(entity, len(mismatches), len(df_schools)))
+        report[entity] = {
+            'schools': df_schools,
+            'details': drill_down(mssql_engine, mysql_engine, entity, emis_school_year, tenant_id, mismatches, config=config),
+        }
+    return report
@@ -0,0 +1,111 @@
+"""Propagation of the template school configuration to all the schools.
+
+New schools get the permissions and custom fields of the template school when
+they are created (see sync-schools-insert-new). This brings the existing schools
+in line when the template changes: the rows of each school are compared in SQL
+to the template rows on their key (the IDs shared by all the schools as the rows
+are cloned with them), the missing rows are inserted and the changed ones updated.
+Each batch of schools is done in its own transaction with one INSERT ... SELECT
+and one UPDATE ... JOIN per table. Rows not in the template are left alone.
+"""
+
+import pandas as pd
+import sqlalchemy as sa
+
+from pacific_sis.sql import table_columns
+
+# In dependency order with the key of the rows within a school
+TEMPLATE_TABLES = {
+    'fields_category': ['category_id'],
+    'custom_fields': ['category_id', 'field_id'],
+    'permission_category': ['permission_category_id'],
+    'permission_subcategory': ['permission_subcategory_id'],
+    'role_permission': ['role_permission_id'],
+}
+
+# Never compared nor copied from the template
+untracked_columns = ['school_id', 'tenant_id', 'created_by', 'created_on', 'updated_by', 'updated_on']
+
+query_target_schools = """
+SELECT school_id FROM school_master WHERE tenant_id = :tenant_id AND school_id <> :template_school_id ORDER BY school_id;
+"""
+
+
+def _join(keys, left, right):
+    return ' AND '.join('{}.`{}` = {}.`{}`'.format(left, k, right, k) for k in keys)
+
+
+def _statements(table, keys, columns):
+    compared = [c for c in columns if c not in keys and c not in untracked_columns]
+    values = []
+    for c in columns:
+        if c == 'school_id':
+            values.append('s.school_id')
+        elif c in ('created_by', 'updated_by'):
+            values.append(':user_guid')
+        elif c in ('created_on', 'updated_on'):
+            values.append(':datetime')
+        else:
+            values.append('tpl.`{}`'.format(c))
+    missing_where = """
+tpl.tenant_id = :tenant_id AND tpl.school_id = :template_school_id
+AND s.tenant_id = :tenant_id AND s.school_id <> :template_school_id {{schools}}
+AND NOT EXISTS (SELECT 1 FROM `{table}` x WHERE x.tenant_id = s.tenant_id AND x.school_id = s.school_id AND {join})
+""".format(table=table, join=_join(keys, 'x', 'tpl'))
+    # NULL safe comparison so a NULL on one side only is a change
+    changed = ' OR '.join('NOT (x.`{}` <=> tpl.`{}`)'.format(c, c) for c in compared) or 'FALSE'
+    changed_where = """
+x.tenant_id = :tenant_id AND x.school_id <> :template_school_id {{schools}} AND ({changed})
+""".format(changed=changed)
+    return {
+        'count_missing': "SELECT COUNT(*) AS records, COUNT(DISTINCT s.school_id) AS schools FROM school_master s CROSS JOIN `{}` tpl WHERE {}".format(table, missing_where),
+        'count_changed': "SELECT COUNT(*) AS records, COUNT(DISTINCT x.school_id) AS schools FROM `{}` x INNER JOIN `{}` tpl ON tpl.tenant_id = x.tenant_id AND tpl.school_id = :template_school_id AND {} WHERE {}".format(
+            table, table, _join(keys, 'x', 'tpl'), changed_where),
+        'insert': "INSERT INTO `{}` ({}) SELECT {} FROM school_master s CROSS JOIN `{}` tpl WHERE {}".format(
+            table, ', '.join('`{}`'.format(c) for c in columns), ', '.join(values), table, missing_where),
+        'update': "UPDATE `{}` x INNER JOIN `{}` tpl ON tpl.tenant_id = x.tenant_id AND tpl.school_id = :template_school_id AND {} SET {} WHERE {}".format(
+            table, table, _join(keys, 'x', 'tpl'),
+            ', '.join(['x.`{}` = tpl.`{}`'.format(c, c) for c in compared] + ['x.`updated_by` = :user_guid', 'x.`updated_on` = :datetime']), changed_where),
+    }
+
+
+def propagate_templates(engine, tenant_id, template_school_id, user_guid, datetime, tables=None, apply=False, schools_per_batch=50):
+    """Insert the template rows missing from the schools and update the changed ones
+
+    Returns the DataFrame of the number of missing and changed records (and
+    schools) per table. Nothing is changed unless apply is set.
+    """
+    tables = [t for t in TEMPLATE_TABLES if tables is None or t in tables]
+    params = {'tenant_id': tenant_id, 'template_school_id': template_school_id, 'user_guid': user_guid, 'datetime': datetime}
+    statements = {}
+    counts = []
+    with engine.connect() as conn:
+        for table in tables:
+            statements[table] = _statements(table, TEMPLATE_TABLES[table], table_columns(conn, table))
+            missing = conn.execute(sa.text(statements[table]['count_missing'].format(schools='')), params).mappings().first()
+            changed = conn.execute(sa.text(statements[table]['count_changed'].format(schools='')), params).mappings().first()
+            counts.append({'table': table, 'missing_records': missing['records'], 'missing_schools': missing['schools'],
+                           'changed_records': changed['records'], 'changed_schools': changed['schools']})
+        school_ids = [row[0] for row in conn.execute(sa.text(query_target_schools), params)]
+        if conn.in_transaction():
+            conn.rollback()
+    df_counts = pd.DataFrame(counts)
+    print("Template school {} compared to {} schools".format(template_school_id, len(school_ids)))
+    print(df_counts.to_string(index=False))
+    if not apply:
+        return df_counts
+
+    for i in range(0, len(school_ids), schools_per_batch):
+        batch = school_ids[i:i + schools_per_batch]
+        inserted, updated = 0, 0
+        with engine.begin() as conn:
+            for table in tables:
+                for key, schools in [('insert', 'AND s.school_id IN :school_ids'), ('update', 'AND x.school_id IN :school_ids')]:
+                    stmt = sa.text(statements[table][key].format(schools=schools)).bindparams(sa.bindparam('school_ids', expanding=True))
+                    rowcount = conn.execute(stmt, dict(params, school_ids=batch)).rowcount
+                    if key == 'insert':
+                        inserted += rowcount
+                    else:
+                        updated += rowcount
+        print("Schools {} to {}: {} records inserted and {} updated".format(batch[0], batch[-1], inserted, updated))
+    return df_counts
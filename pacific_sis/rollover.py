@@ -0,0 +1,167 @@
+"""Academic year rollover of the per school configuration.
+
+The year scoped configuration (attendance codes, blocks, calendars, enrollment
+codes and subjects) of every school of the tenant is cloned from one academic
+year to the next with one INSERT ... SELECT per table, all in one transaction.
+Schools that already have records of the new year in a table are left alone so
+a rollover can be rerun safely.
+
+New IDs follow the current maximum ID of each table. The mapping of old to new
+IDs of each table is kept in a temporary table so the records referencing
+another year scoped table (e.g. attendance_code to attendance_code_categories)
+point to the new records. When the parent records of a school were rolled over
+by an earlier run they are found in the new year by their natural key (e.g. the
+title of an attendance category). Records whose parent is found in neither are
+not rolled over and reported as unmatched in the preview.
+"""
+
+import pandas as pd
+import sqlalchemy as sa
+
+from pacific_sis.sql import table_columns
+
+# In dependency order (parents before the tables referencing them)
+YEAR_SCOPED_TABLES = {
+    'attendance_code_categories': {'id': 'attendance_category_id', 'key': ['title']},
+    'attendance_code': {'id': 'attendance_code', 'references': {'attendance_category_id': 'attendance_code_categories'}},
+    'block': {'id': 'block_id'},
+    'school_calendars': {'id': 'calender_id', 'dates': ['start_date', 'end_date']},
+    'student_enrollment_code': {'id': 'enrollment_code'},
+    'subject': {'id': 'subject_id'},
+}
+
+# The records to roll over with their new ID
+create_rollover_map = """
+CREATE TEMPORARY TABLE `tmp_rollover_{table}` AS
+SELECT t.tenant_id, t.school_id, t.`{id}` AS old_id,
+    m.max_id + ROW_NUMBER() OVER (ORDER BY t.school_id, t.`{id}`) AS new_id
+FROM `{table}` t
+CROSS JOIN (SELECT COALESCE(MAX(`{id}`), 0) AS max_id FROM `{table}`) m
+WHERE t.tenant_id = :tenant_id AND t.academic_year = :from_year AND NOT EXISTS (
+    SELECT 1 FROM `{table}` n
+    WHERE n.tenant_id = t.tenant_id AND n.school_id = t.school_id AND n.academic_year = :to_year
+);
+"""
+
+# The records of the new year that are the rollover of a record (same natural key)
+create_existing_map = """
+CREATE TEMPORARY TABLE `tmp_rollover_existing_{table}` AS
+SELECT o.tenant_id, o.school_id, o.`{id}` AS old_id, MIN(n.`{id}`) AS new_id
+FROM `{table}` o
+INNER JOIN `{table}` n ON n.tenant_id = o.tenant_id AND n.school_id = o.school_id AND n.academic_year = :to_year AND {key}
+WHERE o.tenant_id = :tenant_id AND o.academic_year = :from_year
+GROUP BY o.tenant_id, o.school_id, o.`{id}`;
+"""
+
+# The records referencing a parent found neither rolled over now nor before
+delete_unmatched = """
+DELETE r FROM `tmp_rollover_{table}` r
+INNER JOIN `{table}` t ON t.tenant_id = r.tenant_id AND t.school_id = r.school_id AND t.`{id}` = r.old_id AND t.academic_year = :from_year{joins}
+WHERE {unmatched};
+"""
+
+query_rollover_counts = """
+SELECT COUNT(*) AS records, COUNT(DISTINCT school_id) AS schools FROM `tmp_rollover_{table}`;
+"""
+
+
+def _parent_joins(spec):
+    """The joins resolving the new ID of each parent and the expression of each new ID"""
+    joins, new_ids = '', {}
+    for c, parent in spec.get('references', {}).items():
+        joins += """
+LEFT JOIN `tmp_rollover_{parent}` `p_{c}` ON t.tenant_id = `p_{c}`.tenant_id AND t.school_id = `p_{c}`.school_id AND t.`{c}` = `p_{c}`.old_id""".format(parent=parent, c=c)
+        new_ids[c] = '`p_{}`.new_id'.format(c)
+        if 'key' in YEAR_SCOPED_TABLES[parent]:
+            joins += """
+LEFT JOIN `tmp_rollover_existing_{parent}` `e_{c}` ON t.tenant_id = `e_{c}`.tenant_id AND t.school_id = `e_{c}`.school_id AND t.`{c}` = `e_{c}`.old_id""".format(parent=parent, c=c)
+            new_ids[c] = 'COALESCE(`p_{}`.new_id, `e_{}`.new_id)'.format(c, c)
+    return joins, new_ids
+
+
+def _delete_unmatched(table, spec):
+    joins, new_ids = _parent_joins(spec)
+    unmatched = ' OR '.join('(t.`{}` IS NOT NULL AND {} IS NULL)'.format(c, new_id) for c, new_id in new_ids.items())
+    return delete_unmatched.format(table=table, id=spec['id'], joins=joins, unmatched=unmatched)
+
+
+def _rollover_insert(table, spec, columns):
+    joins, new_ids = _parent_joins(spec)
+    values = []
+    for c in columns:
+        if c == spec['id']:
+            values.append('r.new_id')
+        elif c == 'academic_year':
+            values.append(':to_year')
+        elif c in new_ids:
+            values.append(new_ids[c])
+        elif c in spec.get('dates', []):
+            values.append('DATE_ADD(t.`{}`, INTERVAL 1 YEAR)'.format(c))
+        elif c in ('created_by', 'updated_by'):
+            values.append(':user_guid')
+        elif c in ('created_on', 'updated_on'):
+            values.append(':datetime')
+        else:
+            values.append('t.`{}`'.format(c))
+    return """
+INSERT INTO `{table}` ({columns})
+SELECT {values}
+FROM `{table}` t
+INNER JOIN `tmp_rollover_{table}` r ON t.tenant_id = r.tenant_id AND t.school_id = r.school_id AND t.`{id}` = r.old_id{joins}
+WHERE t.academic_year = :from_year;
+""".format(table=table, columns=', '.join('`{}`'.format(c) for c in columns), values=', '.join(values), id=spec['id'], joins=joins)
+
+
+def rollover(engine, tenant_id, from_year, to_year, user_guid, datetime, tables=None, apply=False):
+    """Clone the year scoped configuration of all the schools from from_year to to_year
+
+    Returns the DataFrame of the number of records and schools rolled over per
+    table. Nothing is changed unless apply is set (the counts are a preview).
+    """
+    # The tables referenced by the requested ones are rolled over too
+    wanted = set(tables or YEAR_SCOPED_TABLES)
+    for table in list(wanted):
+        wanted.update(YEAR_SCOPED_TABLES[table].get('references', {}).values())
+    tables = [t for t in YEAR_SCOPED_TABLES if t in wanted]
+    params = {'tenant_id': tenant_id, 'from_year': from_year, 'to_year': to_year, 'user_guid': user_guid, 'datetime': datetime}
+    counts = []
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            for table in tables:
+                spec = YEAR_SCOPED_TABLES[table]
+                conn.execute(sa.text("DROP TEMPORARY TABLE IF EXISTS `tmp_rollover_{}`".format(table)))
+                conn.execute(sa.text(create_rollover_map.format(table=table, id=spec['id'])), params)
+                if 'key' in spec:
+                    conn.execute(sa.text("DROP TEMPORARY TABLE IF EXISTS `tmp_rollover_existing_{}`".format(table)))
+                    key = ' AND '.join('n.`{}` <=> o.`{}`'.format(k, k) for k in spec['key'])
+                    conn.execute(sa.text(create_existing_map.format(table=table, id=spec['id'], key=key)), params)
+                unmatched = conn.execute(sa.text(_delete_unmatched(table, spec)), params).rowcount if 'references' in spec else 0
+                row = conn.execute(sa.text(query_rollover_counts.format(table=table))).mappings().first()
+                counts.append({'table': table, 'records': row['records'], 'schools': row['schools'], 'unmatched': unmatched})
+            df_counts = pd.DataFrame(counts)
+            print("Rollover from academic year {} to {}".format(from_year, to_year))
+            print(df_counts.to_string(index=False))
+            if df_counts['unmatched'].sum() > 0:
+                print("Records not rolled over, their parent is in neither academic year {} nor the rollover: {}".format(
+                    to_year, df_counts[df_counts['unmatched'] > 0].set_index('table')['unmatched'].to_dict()))
+
+            if apply:
+                for table in tables:
+                    spec = YEAR_SCOPED_TABLES[table]
+                    columns = table_columns(conn, table)
+                    result = conn.execute(sa.text(_rollover_insert(table, spec, columns)), params)
+                    print("{}: {} records rolled over".format(table, result.rowcount))
+                trans.commit()
+            else:
+                trans.rollback()
+        except Exception:
+            trans.rollback()
+            raise
+        finally:
+            for table in tables:
+                conn.execute(sa.text("DROP TEMPORARY TABLE IF EXISTS `tmp_rollover_{}`".format(table)))
+                conn.execute(sa.text("DROP TEMPORARY TABLE IF EXISTS `tmp_rollover_existing_{}`".format(table)))
+            if conn.in_transaction():
+                conn.commit()
+    return df_counts
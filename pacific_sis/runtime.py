@@ -0,0 +1,99 @@
+"""What the sync scripts need to run both as notebooks and from the pacific-sis CLI.
+
+- load_config reads config.json with the overrides of the CLI (e.g. --dry-run);
+- emis_engine and sis_engine return engines that are only created (importing
+  the database driver) when first used, so a run that only needs MySQL never
+  loads pyodbc nor connects to SQL Server;
+- display and HTML are those of IPython in a notebook and print otherwise.
+"""
+
+import os
+import sys
+import json
+import threading
+
+# Set by the CLI before running a script
+CONFIG_PATH = os.environ.get('PACIFIC_SIS_CONFIG', 'config.json')
+CONFIG_OVERRIDES = {}
+
+
+def load_config(path=None):
+    """The configuration of config.json (or path) with the CLI overrides"""
+    with open(path or CONFIG_PATH, 'r') as file:
+        config = json.load(file)
+    config.update(CONFIG_OVERRIDES)
+    return config
+
+
+class LazyEngine:
+    """A SQLAlchemy engine created on first use"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._engine = None
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self):
+        # The template queries run on threads, only one of them creates the engine
+        with self._lock:
+            if self._engine is None:
+                self._engine = self._factory()
+        return self._engine
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def dispose(self):
+        if self._engine is not None:
+            self._engine.dispose()
+
+
+def _mssql_engine(config):
+    from sqlalchemy import create_engine
+    from sqlalchemy.engine import URL
+    mssql_connection_string = """
+    Driver={{ODBC Driver 17 for SQL Server}};
+    Server={},{};
+    Database={};
+    authentication=SqlPassword;UID={};PWD={};
+    TrustServerCertificate=yes;
+    autocommit=True
+    """.format(config['emis_server_ip'], config['emis_server_port'], config['emis_database'], config['emis_uid'], config['emis_pwd'])
+    return create_engine(URL.create("mssql+pyodbc", query={"odbc_connect": mssql_connection_string}))
+
+
+def _mysql_engine(config):
+    from sqlalchemy import create_engine
+    mysql_connection_string = "mysql+mysqlconnector://"+config['sis_user']+":"+config['sis_pwd']+"@"+config['sis_host']+":"+config['sis_server_port']+"/"+config['sis_database']
+    return create_engine(mysql_connection_string)
+
+
+def emis_engine(config):
+    """The (lazy) engine of the EMIS SQL Server database"""
+    return LazyEngine(lambda: _mssql_engine(config))
+
+
+def sis_engine(config):
+    """The (lazy) engine of the SIS MySQL database"""
+    return LazyEngine(lambda: _mysql_engine(config))
+
+
+def _in_notebook():
+    ipython = sys.modules.get('IPython')
+    return ipython is not None and ipython.get_ipython() is not None
+
+
+def display(*objs):
+    if _in_notebook():
+        from IPython.display import display as ipython_display
+        return ipython_display(*objs)
+    for obj in objs:
+        print(obj)
+
+
+def HTML(data):
+    if _in_notebook():
+        from IPython.display import HTML as ipython_html
+        return ipython_html(data)
+    return data
@@ -0,0 +1,93 @@
+"""School year helpers.
+
+The EMIS identifies a school year by its survey year which is the calendar year
+the school year ends in (e.g. 2023 for the 2022-23 school year). The month and day
+the SIS school year starts and ends can be set in config.json with
+sis_school_year_start and sis_school_year_end (MM-DD), a school year starting
+after the day it ends is assumed to start in the previous calendar year.
+
+The school calendars of a school year are generated from the same dates with
+the school weekdays (sis_calendar_weekdays, 0 being Sunday) and holidays
+(sis_calendar_holidays, each with a title and a start and optional end date as
+YYYY-MM-DD, or MM-DD for the holidays falling on the same day every year).
+"""
+
+import pandas as pd
+
+DEFAULT_SCHOOL_YEAR_START = '09-01'
+DEFAULT_SCHOOL_YEAR_END = '06-30'
+DEFAULT_CALENDAR_WEEKDAYS = [1, 2, 3, 4, 5]
+
+
+def school_year_dates(emis_school_year, config=None):
+    """The start and end dates ('YYYY-MM-DD') of the school year of an EMIS survey year"""
+    config = config or {}
+    start = config.get('sis_school_year_start') or DEFAULT_SCHOOL_YEAR_START
+    end = config.get('sis_school_year_end') or DEFAULT_SCHOOL_YEAR_END
+    start_year = emis_school_year - 1 if start > end else emis_school_year
+    return '{}-{}'.format(start_year, start), '{}-{}'.format(emis_school_year, end)
+
+
+def academic_year(emis_school_year, config=None):
+    """The SIS academic_year of an EMIS survey year (the year the school year starts in)"""
+    return int(school_year_dates(emis_school_year, config)[0][:4])
+
+
+def _holiday_dates(holiday, start_date, end_date):
+    """The (start, end) Timestamps of a holiday within a school year"""
+    start, end = holiday['start'], holiday.get('end') or holiday['start']
+    if len(start) == 5:
+        # Recurring holiday (MM-DD), it falls in the calendar year of the school year it's in
+        year = pd.Timestamp(start_date).year
+        start = pd.Timestamp('{}-{}'.format(year, start))
+        if start < pd.Timestamp(start_date):
+            year += 1
+            start = pd.Timestamp('{}-{}'.format(year, holiday['start']))
+        end = pd.Timestamp('{}-{}'.format(year, end))
+        if end < start:
+            end = pd.Timestamp('{}-{}'.format(year + 1, holiday.get('end')))
+        return start, end
+    return pd.Timestamp(start), pd.Timestamp(end)
+
+
+def calendar_days(emis_school_year, config=None):
+    """All the days of the school year of an EMIS survey year
+
+    Returns a DataFrame with the date, its weekday (0 being Sunday), the holiday
+    it falls in (if any) and whether it is a school day.
+    """
+    config = config or {}
+    start_date, end_date = school_year_dates(emis_school_year, config)
+    weekdays = config.get('sis_calendar_weekdays') or DEFAULT_CALENDAR_WEEKDAYS
+    dates = pd.date_range(start_date, end_date, freq='D')
+    df = pd.DataFrame({'date': dates, 'weekday': (dates.dayofweek + 1) % 7})
+    df['holiday'] = None
+    for holiday in config.get('sis_calendar_holidays', []):
+        start, end = _holiday_dates(holiday, start_date, end_date)
+        df.loc[(df['date'] >= start) & (df['date'] <= end), 'holiday'] = holiday['title']
+    df['is_school_day'] = df['weekday'].isin(weekdays) & df['holiday'].isna()
+    return df
+
+
+def school_calendars(school_ids, emis_school_years, config=None):
+    """The school_calendars values of each school for each EMIS survey year
+
+    Returns one row per school and year with the school_id, academic_year,
+    title, start_date, end_date, days (the school weekdays as in the SIS, e.g.
+    '12345') and the number of school days of the year.
+    """
+    config = config or {}
+    weekdays = config.get('sis_calendar_weekdays') or DEFAULT_CALENDAR_WEEKDAYS
+    years = []
+    for emis_school_year in emis_school_years:
+        start_date, end_date = school_year_dates(emis_school_year, config)
+        years.append({
+            'emis_school_year': emis_school_year,
+            'academic_year': academic_year(emis_school_year, config),
+            'title': '{}-{}'.format(start_date[:4], end_date[:4]),
+            'start_date': start_date,
+            'end_date': end_date,
+            'days': ''.join(str(d) for d in sorted(weekdays)),
+            'school_days': int(calendar_days(emis_school_year, config)['is_school_day'].sum()),
+        })
+    return pd.DataFrame({'school_id': list(school_ids)}).merge(pd.DataFrame(years), how='cross')
@@ -0,0 +1,285 @@
+"""Applying the generated .sql sync scripts without a MySQL client.
+
+The scripts written by the sync notebooks (e.g. *-sync-script.sql) hold one
+statement per row to change, wrapped in START TRANSACTION ... ROLLBACK with a few
+verification SELECTs. apply_script reads such a script statement by statement
+(the file is never loaded whole), skips the transaction control and SELECTs,
+merges consecutive single row INSERTs into the same table into multi-row
+INSERTs and runs everything in a transaction reporting progress as it goes.
+
+The batches are run as the script is read. When every statement belongs to one
+school (a school_id = N condition or column) the schools can be split across
+several connections: a first pass over the file only collects the schools and
+the second one hands each batch to the connection of its school. Each
+connection keeps its transaction open until all are done and they are then
+committed one after the other (or all rolled back). These commits are not
+atomic, if one fails the schools of the connections already committed stay
+committed.
+
+The scripts of sync-lookups never split: in replace mode they start with a
+DELETE of all the schools (school_id IS NOT NULL) and in diff mode the rows are
+deleted and updated by their id, they always run on a single connection.
+"""
+
+import re
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Never sent to the server, the executor does the transaction itself
+skipped_keywords = ['USE', 'START', 'BEGIN', 'COMMIT', 'ROLLBACK', 'SELECT']
+
+_insert = re.compile(r"^INSERT\s+INTO\s+(`?\w+`?)\s*\(([^)]*)\)\s*VALUES\s*(.*)$", re.IGNORECASE | re.DOTALL)
+_school_condition = re.compile(r"\bschool_id`?\s*=\s*(\d+)", re.IGNORECASE)
+
+
+def iter_statements(lines):
+    """The statements (without the ;) of the lines of a SQL script
+
+    Quoted strings (with '' or backslash escapes) and # or -- comments are
+    handled so a ; or # inside a value does not split a statement.
+    """
+    statement = []
+    quote = None
+    for line in lines:
+        i, start = 0, 0
+        while i < len(line):
+            c = line[i]
+            if quote:
+                if c == '\\':
+                    i += 1
+                elif c == quote:
+                    quote = None
+            elif c in ("'", '"', '`'):
+                quote = c
+            elif c == '#' or line.startswith('-- ', i) or line.startswith('--\n', i):
+                line = line[:i] + '\n'
+                break
+            elif c == ';':
+                statement.append(line[start:i])
+                text = ''.join(statement).strip()
+                if text:
+                    yield text
+                statement = []
+                start = i + 1
+            i += 1
+        statement.append(line[start:])
+    text = ''.join(statement).strip()
+    if text:
+        yield text
+
+
+def _split_values(values):
+    """The values of a single row VALUES (...) list, or None if there are several rows"""
+    parts, depth, quote, start = [], 0, None, None
+    i = 0
+    while i < len(values):
+        c = values[i]
+        if quote:
+            if c == '\\':
+                i += 1
+            elif c == quote:
+                quote = None
+        elif c in ("'", '"'):
+            quote = c
+        elif c == '(':
+            depth += 1
+            if depth == 1:
+                if parts:
+                    return None
+                start = i + 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                parts.append(values[start:i])
+                start = None
+        elif c == ',' and depth == 1:
+            parts.append(values[start:i])
+            start = i + 1
+        i += 1
+    return [p.strip() for p in parts]
+
+
+def parse_statement(text):
+    """The kind (first keyword), school_id (or None) and INSERT parts of a statement"""
+    keyword = text.split(None, 1)[0].upper()
+    info = {'kind': keyword, 'school_id': None, 'insert': None}
+    match = _insert.match(text) if keyword == 'INSERT' else None
+    if match:
+        table, columns, values = match.groups()
+        columns = [c.strip().strip('`') for c in columns.split(',')]
+        info['insert'] = (table.strip('`'), ', '.join(columns), values.strip())
+        row = _split_values(values)
+        if row is not None and 'school_id' in columns and len(row) == len(columns):
+            value = row[columns.index('school_id')]
+            if value.isdigit():
+                info['school_id'] = int(value)
+    else:
+        schools = set(_school_condition.findall(text))
+        if len(schools) == 1:
+            info['school_id'] = int(schools.pop())
+    return info
+
+
+def iter_batches(statements, batch_size=500):
+    """Group the parsed statements: consecutive INSERTs into the same table and columns are merged
+
+    Yields (sql, number of statements, school_id) with school_id None unless all
+    the statements are of the same school.
+    """
+    pending = None
+
+    def flush(p):
+        table, columns, values, count, school_id = p
+        return "INSERT INTO `{}` ({}) VALUES\n{}".format(table, columns, ',\n'.join(values)), count, school_id
+
+    for text, info in statements:
+        insert = info['insert']
+        if pending and insert and insert[:2] == tuple(pending[:2]) and info['school_id'] == pending[4] and pending[3] < batch_size:
+            pending[2].append(insert[2])
+            pending[3] += 1
+            continue
+        if pending:
+            yield flush(pending)
+            pending = None
+        if insert:
+            pending = [insert[0], insert[1], [insert[2]], 1, info['school_id']]
+        else:
+            yield text, 1, info['school_id']
+    if pending:
+        yield flush(pending)
+
+
+def iter_script(path, stats=None):
+    """The (statement, parsed statement) of the statements of a script to run, as the file is read
+
+    The statements skipped are counted in stats['skipped'] (if given).
+    """
+    with open(path, 'r') as file:
+        for text in iter_statements(file):
+            info = parse_statement(text)
+            if info['kind'] in skipped_keywords:
+                if stats is not None:
+                    stats['skipped'] = stats.get('skipped', 0) + 1
+            else:
+                yield text, info
+
+
+def script_schools(path):
+    """The schools of a script in their order of appearance, or None if a statement has no school"""
+    schools = {}
+    for text, info in iter_script(path):
+        if info['school_id'] is None:
+            return None
+        schools.setdefault(info['school_id'], len(schools))
+    return list(schools)
+
+
+class _Progress:
+
+    def __init__(self, every):
+        self.every = every
+        self.done, self.rows, self.reported = 0, 0, 0
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, statements, rows):
+        with self.lock:
+            self.done += statements
+            self.rows += max(rows, 0)
+            if self.done - self.reported >= self.every:
+                self.report()
+
+    def report(self):
+        self.reported = self.done
+        elapsed = time.time() - self.started
+        print("{} statements ({} rows affected) in {:.1f}s, {:.0f} statements/s".format(
+            self.done, self.rows, elapsed, self.done / elapsed if elapsed else 0))
+
+
+def _run(conn, batches, progress):
+    # The raw DBAPI cursor so the literals are sent as is (no bind parameter or % parsing)
+    cursor = conn.connection.cursor()
+    try:
+        for sql, count, school_id in batches:
+            cursor.execute(sql)
+            progress.add(count, cursor.rowcount)
+    finally:
+        cursor.close()
+
+
+def _run_queued(conn, batches, progress):
+    try:
+        _run(conn, batches, progress)
+    except Exception:
+        # Keep taking the batches of this connection so the reader is never blocked
+        for batch in batches:
+            pass
+        raise
+
+
+def _run_split(conns, path, schools, batch_size, progress, stats, queue_size=100):
+    """Run the batches of the script on the connections, the schools of a connection in the order of the script"""
+    school_conn = {school_id: i % len(conns) for i, school_id in enumerate(schools)}
+    queues = [queue.Queue(maxsize=queue_size) for conn in conns]
+    with ThreadPoolExecutor(max_workers=len(conns)) as executor:
+        futures = [executor.submit(_run_queued, conn, iter(q.get, None), progress) for conn, q in zip(conns, queues)]
+        try:
+            for batch in iter_batches(iter_script(path, stats), batch_size):
+                queues[school_conn[batch[2]]].put(batch)
+                if any(future.done() for future in futures):
+                    # A connection failed, the whole script is rolled back anyway
+                    break
+        finally:
+            for q in queues:
+                q.put(None)
+        for future in futures:
+            future.result()
+
+
+def apply_script(engine, path, batch_size=500, connections=1, commit=False, progress_every=5000):
+    """Run the statements of a generated sync script in a transaction, as the script is read
+
+    Nothing is kept unless commit is set (like the ROLLBACK ending the scripts).
+    With connections > 1 the schools are split across that many connections if
+    every statement belongs to a school, their transactions are then committed
+    one after the other (not atomically). Returns the number of statements run.
+    """
+    schools = None
+    if connections > 1:
+        schools = script_schools(path)
+        if schools is None:
+            print("Some statements are not tied to a school, running on a single connection")
+        else:
+            print("{}: {} schools split across {} connections".format(path, len(schools), min(connections, len(schools))))
+    progress = _Progress(progress_every)
+    stats = {}
+
+    conns = [engine.connect() for i in range(min(connections, len(schools)) if schools else 1)]
+    transactions = [conn.begin() for conn in conns]
+    try:
+        if len(conns) == 1:
+            _run(conns[0], iter_batches(iter_script(path, stats), batch_size), progress)
+        else:
+            _run_split(conns, path, schools, batch_size, progress, stats)
+        progress.report()
+        if stats.get('skipped'):
+            print("{} statements skipped (transaction control and SELECTs)".format(stats['skipped']))
+        if commit:
+            for trans in transactions:
+                trans.commit()
+            print("Committed {} statements".format(progress.done))
+        else:
+            for trans in transactions:
+                trans.rollback()
+            print("Rolled back {} statements (set commit to keep them)".format(progress.done))
+    except Exception:
+        for trans in transactions:
+            if trans.is_active:
+                trans.rollback()
+        raise
+    finally:
+        for conn in conns:
+            conn.close()
+    return progress.done
@@ -0,0 +1,147 @@
+"""Small SQL helpers for set-based work on the SIS (MySQL) database.
+
+The pattern used throughout is to upload a compact DataFrame into a temporary
+table (visible only to the connection and dropped with it) and then let MySQL do
+the joins, updates and deletes in a handful of statements.
+
+Statements generated by the notebooks are kept as (SQL with :named parameters,
+list of parameter dicts) batches. The same batches are executed with bound
+parameters (one statement text per batch so MySQL can reuse its parse, and no
+quoting of the values) and rendered with literals into the .sql audit scripts.
+"""
+
+import re
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+
+def sql_type(series):
+    """A MySQL column type able to hold the values of a pandas Series"""
+    if pd.api.types.is_bool_dtype(series):
+        return 'TINYINT'
+    if pd.api.types.is_integer_dtype(series):
+        return 'BIGINT'
+    if pd.api.types.is_float_dtype(series):
+        # Integer IDs with missing values end up as float
+        values = series.dropna()
+        if len(values) > 0 and np.all(np.mod(values, 1) == 0):
+            return 'BIGINT'
+        return 'DOUBLE'
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'DATETIME'
+    return 'VARCHAR(255)'
+
+
+def sql_value(value):
+    """A literal for the generated SQL scripts"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return 'NULL'
+    if isinstance(value, (bool, np.bool_)):
+        return str(int(value))
+    if isinstance(value, (dt.date, dt.time)):
+        value = str(value)
+    if isinstance(value, str):
+        return "'{}'".format(value.replace("\\", "\\\\").replace("'", "''"))
+    return str(value)
+
+
+def records(df):
+    """The rows of df as a list of dicts with missing values as None (i.e. NULL)"""
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict('records')
+
+
+def insert_records(conn, table, df, chunksize=5000):
+    """Insert df into table with batched parameterized INSERT statements"""
+    if df.empty:
+        return 0
+    columns = list(df.columns)
+    stmt = sa.text("INSERT INTO `{}` ({}) VALUES ({})".format(
+        table, ', '.join('`{}`'.format(c) for c in columns), ', '.join(':{}'.format(c) for c in columns)))
+    rows = records(df)
+    for i in range(0, len(rows), chunksize):
+        conn.execute(stmt, rows[i:i + chunksize])
+    return len(rows)
+
+
+def temp_table(conn, name, df, index=None, types=None):
+    """Create the temporary table name with the columns of df (and optional index columns) and fill it with df"""
+    types = types or {}
+    columns = ', '.join('`{}` {}'.format(c, types.get(c) or sql_type(df[c])) for c in df.columns)
+    if index:
+        columns += ', INDEX ({})'.format(', '.join('`{}`'.format(c) for c in index))
+    conn.execute(sa.text("DROP TEMPORARY TABLE IF EXISTS `{}`".format(name)))
+    conn.execute(sa.text("CREATE TEMPORARY TABLE `{}` ({})".format(name, columns)))
+    insert_records(conn, name, df)
+    return name
+
+
+def table_columns(conn, table):
+    """The column names of a table of the current database in their order"""
+    query = """
+    SELECT COLUMN_NAME
+    FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+    ORDER BY ORDINAL_POSITION
+    """
+    return [row[0] for row in conn.execute(sa.text(query), {'table': table})]
+
+
+# A quoted literal (left as is) or a :name parameter (but not a :: cast)
+_parameter = re.compile(r"""'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|(?<![:\w]):(\w+)""")
+
+
+def render_statement(sql, params):
+    """The statement sql with its :name parameters replaced by the literals of params"""
+    return _parameter.sub(lambda m: sql_value(params[m.group(1)]) if m.group(1) else m.group(0), sql).strip()
+
+
+def render_script(batches):
+    """The statements of the (sql, rows) batches with literals, one per row"""
+    return [render_statement(sql, params) + ';' for sql, rows in batches for params in rows]
+
+
+def execute_batches(conn, batches, chunksize=1000):
+    """Execute the (sql, rows) batches with bound parameters (executemany per chunk of rows)
+
+    Returns the number of affected rows of each batch.
+    """
+    counts = []
+    for sql, rows in batches:
+        stmt = sa.text(sql)
+        count = 0
+        for i in range(0, len(rows), chunksize):
+            result = conn.execute(stmt, rows[i:i + chunksize])
+            count += max(result.rowcount, 0)
+        counts.append(count)
+    return counts
+
+
+def primary_key(conn, table):
+    """The primary key columns of a table of the current database in their order"""
+    query = """
+    SELECT COLUMN_NAME
+    FROM information_schema.KEY_COLUMN_USAGE
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND CONSTRAINT_NAME = 'PRIMARY'
+    ORDER BY ORDINAL_POSITION
+    """
+    return [row[0] for row in conn.execute(sa.text(query), {'table': table})]
+
+
+def foreign_keys(conn, table):
+    """The foreign keys of a table as {constraint: (columns, referenced table, referenced columns)}"""
+    query = """
+    SELECT CONSTRAINT_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+    FROM information_schema.KEY_COLUMN_USAGE
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND REFERENCED_TABLE_NAME IS NOT NULL
+    ORDER BY CONSTRAINT_NAME, ORDINAL_POSITION
+    """
+    keys = {}
+    for constraint, column, referenced_table, referenced_column in conn.execute(sa.text(query), {'table': table}):
+        columns, _, referenced_columns = keys.setdefault(constraint, ([], referenced_table, []))
+        columns.append(column)
+        referenced_columns.append(referenced_column)
+    return keys
@@ -0,0 +1,36 @@
+"""Loading of the "template" DataFrames used by the sync notebooks.
+
+Each notebook describes its templates as a dict of
+{name: {'query': ..., 'sql_table': ..., 'df_name': ...}}. The queries are
+independent of each other so they are issued concurrently, each on its own
+pooled connection, instead of one after the other on a single connection.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import sqlalchemy as sa
+
+# SQLAlchemy's default QueuePool keeps 5 connections, staying within it means
+# the connections are re-used by later queries of the notebook
+DEFAULT_MAX_WORKERS = 5
+
+
+def read_template(engine, query):
+    with engine.connect() as conn:
+        return pd.read_sql_query(sa.text(query), conn)
+
+
+def load_templates(engine, templates, max_workers=DEFAULT_MAX_WORKERS):
+    """Run all the template queries concurrently and set template['df'] on each of them
+
+    Returns the same templates dict (in the same order) for convenience.
+    """
+    if not templates:
+        return templates
+    workers = max(1, min(max_workers, len(templates)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {k: executor.submit(read_template, engine, template['query']) for k, template in templates.items()}
+        for k, template in templates.items():
+            template['df'] = futures[k].result()
+    return templates
@@ -0,0 +1,81 @@
+# ---
+# jupyter:
+#   jupytext:
+#     formats: ipynb,py:percent
+#     text_representation:
+#       extension: .py
+#       format_name: percent
+#       format_version: '1.3'
+#       jupytext_version: 1.14.5
+#   kernelspec:
+#     display_name: Python 3 (ipykernel)
+#     language: python
+#     name: python3
+# ---
+
+# %%
+###############################################################################
+# This notebook provides some tools for better integration between the        #
+# Pacific EMIS and Pacific SIS. In particular the propagation of changes to   #
+# the template school (sis_template_school_id) permissions and custom fields  #
+# to all the other schools                                                    #
+###############################################################################
+
+# Core stuff
+import os
+import datetime as dt
+
+# Data stuff
+import pandas as pd # Data analysis
+import sqlalchemy as sa
+# Sync tools
+from pacific_sis.runtime import load_config, sis_engine
+from pacific_sis.propagation import propagate_templates
+# Pretty printing stuff
+from pacific_sis.runtime import display, HTML
+import pprint
+pp = pprint.PrettyPrinter(indent=4)
+
+# Initial setup
+cwd = os.getcwd()
+
+# Configuration
+config = load_config()
+        
+# SIS config
+sis_database = config['sis_database']
+sis_tenant_id = config['sis_tenant_id']
+sis_user_guid = config['sis_user_guid']
+sis_country = config['sis_country']
+sis_load_data_to_sql = config['sis_load_data_to_sql']
+# The school whose configuration is propagated to the other schools
+sis_template_school_id = config.get('sis_template_school_id', 115)
+
+# Config
+country = config['country']
+datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+# MySQL Connection (created when first used)
+mysql_engine = sis_engine(config)
+
+print("Retrieving settings and creating database connections")
+
+# %%
+# Preview the template rows missing from the schools and the ones that differ (nothing is changed)
+df_propagation_preview = propagate_templates(mysql_engine, sis_tenant_id, sis_template_school_id, sis_user_guid, datetime)
+display(df_propagation_preview)
+
+# %%
+# %%time
+
+# Apply the template to all the schools a batch of schools per transaction
+if sis_load_data_to_sql == True:
+    propagate_templates(mysql_engine, sis_tenant_id, sis_template_school_id, sis_user_guid, datetime, apply=True)
+    print("Template school {} configuration propagated successfully".format(sis_template_school_id))
+else:
+    print("Not loading the data into SQL")
+
+# %%
+# Close database connection
+print("Closing the MySQL connection engine")
+mysql_engine.dispose()
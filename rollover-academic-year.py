@@ -0,0 +1,88 @@
+# ---
+# jupyter:
+#   jupytext:
+#     formats: ipynb,py:percent
+#     text_representation:
+#       extension: .py
+#       format_name: percent
+#       format_version: '1.3'
+#       jupytext_version: 1.14.5
+#   kernelspec:
+#     display_name: Python 3 (ipykernel)
+#     language: python
+#     name: python3
+# ---
+
+# %%
+###############################################################################
+# This notebook provides some tools for better integration between the        #
+# Pacific EMIS and Pacific SIS. In particular the rollover of the year        #
+# scoped configuration of all the schools (attendance codes, blocks,          #
+# calendars, enrollment codes and subjects) from the previous academic year   #
+# to the academic year of emis_school_year                                    #
+###############################################################################
+
+# Core stuff
+import os
+import datetime as dt
+
+# Data stuff
+import pandas as pd # Data analysis
+import sqlalchemy as sa
+# Sync tools
+from pacific_sis.runtime import load_config, sis_engine
+from pacific_sis.schoolyear import academic_year
+from pacific_sis.rollover import rollover
+# Pretty printing stuff
+from pacific_sis.runtime import display, HTML
+import pprint
+pp = pprint.PrettyPrinter(indent=4)
+
+# Initial setup
+cwd = os.getcwd()
+
+# Configuration
+config = load_config()
+        
+# EMIS config
+emis_school_year = config['emis_school_year']
+        
+# SIS config
+sis_database = config['sis_database']
+sis_tenant_id = config['sis_tenant_id']
+sis_user_guid = config['sis_user_guid']
+sis_country = config['sis_country']
+sis_load_data_to_sql = config['sis_load_data_to_sql']
+# Rollover from the previous academic year to the one of the EMIS school year
+sis_rollover_to_year = academic_year(emis_school_year, config)
+sis_rollover_from_year = sis_rollover_to_year - 1
+
+# Config
+country = config['country']
+datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+# MySQL Connection (created when first used)
+mysql_engine = sis_engine(config)
+
+print("Retrieving settings and creating database connections")
+
+# %%
+# Preview what would be rolled over (nothing is changed), records whose parent (e.g. their
+# attendance category) is found in neither year are counted as unmatched and not rolled over
+df_rollover_preview = rollover(mysql_engine, sis_tenant_id, sis_rollover_from_year, sis_rollover_to_year, sis_user_guid, datetime)
+display(df_rollover_preview)
+
+# %%
+# %%time
+
+# Rollover all the tables in a single transaction
+if sis_load_data_to_sql == True:
+    df_rollover = rollover(mysql_engine, sis_tenant_id, sis_rollover_from_year, sis_rollover_to_year, sis_user_guid, datetime, apply=True)
+    print("Academic year {} configuration rolled over successfully".format(sis_rollover_to_year))
+else:
+    print("Not loading the data into SQL")
+
+# %%
+# Close database connection
+print("Closing the MySQL connection engine")
+mysql_engine.dispose()
@@ -32,19 +32,18 @@
 
 # Core stuff
 import os
-import json
 import datetime as dt
 
 # Data stuff
 import pandas as pd # Data analysis
-import xlrd # excel 
-import pyodbc # SQL DB
-from sqlalchemy.engine import URL
-from sqlalchemy import create_engine
 import sqlalchemy as sa
+# Sync tools
+from pacific_sis.runtime import load_config, emis_engine, sis_engine
+from pacific_sis.lookups import diff_lookup, lookup_sync_batches, insert_value
+from pacific_sis.sql import records, sql_value, render_script, execute_batches
 
 # Pretty printing stuff
-from IPython.display import display, HTML
+from pacific_sis.runtime import display, HTML
 import pprint
 pp = pprint.PrettyPrinter(indent=4)
 
@@ -52,8 +51,7 @@ pp = pprint.PrettyPrinter(indent=4)
 cwd = os.getcwd()
 
 # Configuration
-with open('config.json', 'r') as file:
-     config = json.load(file)
+config = load_config()
         
 # EMIS config
 emis_lookup = config['emis_lookup']
@@ -62,27 +60,19 @@ emis_lookup = config['emis_lookup']
 sis_database = config['sis_database']
 sis_tenant_id = config['sis_tenant_id']
 sis_user_guid = config['sis_user_guid']
+sis_load_data_to_sql = config['sis_load_data_to_sql']
+# 'diff' only writes the values that differ, 'replace' deletes and re-inserts them all
+sis_lookup_sync_mode = config.get('sis_lookup_sync_mode', 'replace')
 
 # Config
 country = config['country']
 datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-# MS SQL Server connection
-mssql_connection_string = """
-    Driver={{ODBC Driver 17 for SQL Server}};
-    Server={},{};
-    Database={};
-    authentication=SqlPassword;UID={};PWD={};
-    TrustServerCertificate=yes;
-    autocommit=True
-    """.format(config['emis_server_ip'], config['emis_server_port'], config['emis_database'], config['emis_uid'], config['emis_pwd'])
+# MS SQL Server connection (created when first used)
+mssql_engine = emis_engine(config)
 
-mssql_connection_url = URL.create("mssql+pyodbc", query={"odbc_connect": mssql_connection_string})
-mssql_engine = create_engine(mssql_connection_url)
-
-# MySQL Connection
-mysql_connection_string = "mysql+mysqlconnector://"+config['sis_user']+":"+config['sis_pwd']+"@"+config['sis_host']+":"+config['sis_server_port']+"/"+config['sis_database']
-mysql_engine = create_engine(mysql_connection_string)
+# MySQL Connection (created when first used)
+mysql_engine = sis_engine(config)
 
 # %%
 emis_lookups = {
@@ -232,17 +222,17 @@ display(df_fields_category_sis.head(3))
 # %%
 # Load specific lookup data of interest (just for quick viewing, not needed actually)
 query_custom_fields = """
-SELECT * FROM {}.custom_fields WHERE field_name = '{}';
-""".format(sis_database, sis_field_name)
+SELECT * FROM {}.custom_fields WHERE field_name = :field_name;
+""".format(sis_database)
 
 query_dpdown_valuelist = """
-SELECT * FROM {}.dpdown_valuelist WHERE lov_name = '{}';
-""".format(sis_database, sis_lov_name)
+SELECT * FROM {}.dpdown_valuelist WHERE lov_name = :lov_name;
+""".format(sis_database)
 
-df_custom_fields = pd.read_sql(query_custom_fields, mysql_engine)
+df_custom_fields = pd.read_sql(sa.text(query_custom_fields), mysql_engine.engine, params={'field_name': sis_field_name})
 display(df_custom_fields.head(3))
 
-df_dpdown_valuelist = pd.read_sql(query_dpdown_valuelist, mysql_engine)
+df_dpdown_valuelist = pd.read_sql(sa.text(query_dpdown_valuelist), mysql_engine.engine, params={'lov_name': sis_lov_name})
 display(df_dpdown_valuelist.head(3))
 
 # %%
@@ -256,11 +246,11 @@ SELECT * FROM {}.school_detail;
 """.format(sis_database)
 
 print("SIS school_master")
-df_school_master = pd.read_sql(query_school_master, mysql_engine)
+df_school_master = pd.read_sql(query_school_master, mysql_engine.engine)
 display(df_school_master.head(3))
 
 print("SIS school_detail")
-df_school_detail = pd.read_sql(query_school_detail, mysql_engine)
+df_school_detail = pd.read_sql(query_school_detail, mysql_engine.engine)
 display(df_school_detail.head(3))
 
 query_staff_master = """
@@ -268,7 +258,7 @@ SELECT * FROM {}.staff_master;
 """.format(sis_database)
 
 print("SIS staff_master")
-df_staff_master = pd.read_sql(query_staff_master, mysql_engine)
+df_staff_master = pd.read_sql(query_staff_master, mysql_engine.engine)
 display(df_staff_master.head(3))
 
 query_student_master = """
@@ -276,7 +266,7 @@ SELECT * FROM {}.student_master;
 """.format(sis_database)
 
 print("SIS student_master")
-df_student_master = pd.read_sql(query_student_master, mysql_engine)
+df_student_master = pd.read_sql(query_student_master, mysql_engine.engine)
 display(df_student_master.head(3))
 
 # %%
@@ -360,7 +350,7 @@ lookup_values = {
 }
 
 # %%
-print("Generating inserts script for lookup {}".format(emis_lookup))
+print("Generating the sync statements for lookup {}".format(emis_lookup))
 # List of existing ids used in dpdown_valuelist. Let's collect for re-use
 df_dpdown_valuelist.dropna(subset=['school_id'], inplace=True) # not default values with no school_id though
 dpdown_valuelist_ids = list(df_dpdown_valuelist['id'].values)
@@ -369,80 +359,113 @@ school_ids = list(df_schools_sis['school_id'].values)
 # Handling of primary key
 next_id = dpdown_valuelist_next_id
 # List of invalid values (i.e. not found in EMIS)
-invalid_vals = str(tuple(vals)).replace(",)",")").replace("()","('')")
+invalid_vals = "({})".format(', '.join(sql_value(v) for v in vals) or "''")
 
-filename = 'data/' + country + '/' + sis_field_name + '-sync-script.sql'
-file = open(filename, "w") 
-
-file.write("USE {};\n\n".format(sis_database))
-
-# Remove all existing ethnicities in the SIS in a rolled back transaction
-file.write("START TRANSACTION;\n\n")
-
-# Some basic summary verification
-file.write("SELECT school_id, count(lov_name) num_{} FROM dpdown_valuelist WHERE lov_name = '{}' GROUP BY school_id;\n".format(sis_field_name, sis_lov_name))
+# The statements are (SQL, rows of parameters) batches executed with bound parameters
+# (no quoting issues with values like O'Brien) and rendered into the script for auditing
+sync_batches = []
 
 # The following SQL depends on the lookup's module
 if sis_field_name == 'ethnicity' or sis_field_name == 'race':
-    file.write("SELECT count(staff_guid) tot_staff, {} as invalid_{} FROM staff_master WHERE {} IN {} GROUP BY {};\n\n".format(sis_column_name, sis_column_name, sis_column_name, invalid_vals, sis_column_name))
+    verification_sql = "SELECT count(staff_guid) tot_staff, {} as invalid_{} FROM staff_master WHERE {} IN {} GROUP BY {};\n".format(sis_column_name, sis_column_name, sis_column_name, invalid_vals, sis_column_name)
     
     # Remove any values that don't have a matching lookups in the EMIS
-    for r in staff_master_to_clean:
-        file.write("UPDATE staff_master SET {} = NULL WHERE tenant_id = '{}' AND staff_id = {} AND school_id = {} AND staff_guid = '{}';\n".format(sis_column_name,r['tenant_id'],r['staff_id'],r['school_id'],r['staff_guid']))
+    if len(staff_master_to_clean) > 0:
+        sync_batches.append((
+            "UPDATE staff_master SET {} = NULL WHERE tenant_id = :tenant_id AND staff_id = :staff_id AND school_id = :school_id AND staff_guid = :staff_guid".format(sis_column_name),
+            records(df_staff_master_to_clean[['tenant_id','staff_id','school_id','staff_guid']])
+        ))
         
 elif sis_field_name == 'schoolLevel' or sis_field_name == 'schoolClassification':
-    file.write("SELECT count(school_guid) tot_school, {} as invalid_{} FROM school_master WHERE {} IN {} GROUP BY {};\n\n".format(sis_column_name, sis_column_name, sis_column_name, invalid_vals, sis_column_name))
+    verification_sql = "SELECT count(school_guid) tot_school, {} as invalid_{} FROM school_master WHERE {} IN {} GROUP BY {};\n".format(sis_column_name, sis_column_name, sis_column_name, invalid_vals, sis_column_name)
+    
+    # Values that don't have a matching lookups in the EMIS are only listed (commented out), not removed
     
-    # Remove any values that don't have a matching lookups in the EMIS
-    for r in school_master_to_clean:
-        file.write("#UPDATE school_master SET {} = NULL WHERE tenant_id = '{}' AND school_id = {} AND school_guid = '{}';\n".format(sis_column_name,r['tenant_id'],r['school_id'],r['school_guid']))
-        
 elif sis_field_name == 'femaleToiletType' or sis_field_name == 'maleToiletType' or sis_field_name == 'commonToiletType':
-    file.write("SELECT count(school_id) tot_school_detail, {} as invalid_{} FROM school_detail WHERE {} IN {} GROUP BY {};\n\n".format(sis_column_name, sis_column_name, sis_column_name, invalid_vals, sis_column_name))
+    verification_sql = "SELECT count(school_id) tot_school_detail, {} as invalid_{} FROM school_detail WHERE {} IN {} GROUP BY {};\n".format(sis_column_name, sis_column_name, sis_column_name, invalid_vals, sis_column_name)
     
     # Remove any values that don't have a matching lookups in the EMIS
-    for r in school_detail_to_clean:
-        file.write("UPDATE school_detail SET {} = NULL WHERE id = '{}' AND tenant_id = '{}' AND school_id = {};\n".format(sis_column_name,r['id'],r['tenant_id'],r['school_id']))
+    if len(school_detail_to_clean) > 0:
+        sync_batches.append((
+            "UPDATE school_detail SET {} = NULL WHERE id = :id AND tenant_id = :tenant_id AND school_id = :school_id".format(sis_column_name),
+            records(df_school_detail_to_clean[['id','tenant_id','school_id']])
+        ))
         
 else:
-    pass
+    verification_sql = ""
 
 
-# The actual deletion
-file.write("\n")
-file.write("DELETE FROM dpdown_valuelist WHERE lov_name = '{}' AND school_id IS NOT NULL;\n\n".format(sis_lov_name))
-
-# Re-inserts from the EMIS values
-for school_id in school_ids:
-    # insert statement for all the lookup_values to sync (e.g. ethnicities)
-    for lookup in lookup_values[sis_field_name]:
-        if len(dpdown_valuelist_ids) != 0:
-            # still some ids for re-use
-            id = dpdown_valuelist_ids.pop(0)
-        else:
-            # continue with new IDs
-            next_id = next_id + 1
-            id = next_id
-        insert_str = "INSERT INTO dpdown_valuelist(id, tenant_id, school_id, lov_name, lov_column_value, lov_code, sort_order, created_by, created_on, updated_by, updated_on) VALUES ({}, '{}', {}, '{}', '{}', '{}', {}, '{}', '{}', '{}', '{}');\n".format(id, sis_tenant_id, school_id, sis_lov_name, lookup[1], lookup[0], lookup[2], sis_user_guid, datetime, sis_user_guid, datetime)    
-        #print(insert_str)
-        file.write(insert_str)
-        
+if sis_lookup_sync_mode == 'diff':
+    # Only the values that differ between the EMIS lookup and each school's values
+    df_lookup_insert, df_lookup_update, df_lookup_delete = diff_lookup(lookup_values[sis_field_name], df_dpdown_valuelist, school_ids)
+    print("{} values to insert, {} to update and {} to delete".format(len(df_lookup_insert), len(df_lookup_update), len(df_lookup_delete)))
+    sync_batches += lookup_sync_batches(sis_lov_name, df_lookup_insert, df_lookup_update, df_lookup_delete, next_id, sis_tenant_id, sis_user_guid, datetime)
+else:
+    # The actual deletion
+    sync_batches.append(("DELETE FROM dpdown_valuelist WHERE lov_name = :lov_name AND school_id IS NOT NULL", [{'lov_name': sis_lov_name}]))
+
+    # Re-inserts from the EMIS values
+    lookup_rows = []
+    for school_id in school_ids:
+        # insert statement for all the lookup_values to sync (e.g. ethnicities)
+        for lookup in lookup_values[sis_field_name]:
+            if len(dpdown_valuelist_ids) != 0:
+                # still some ids for re-use
+                id = dpdown_valuelist_ids.pop(0)
+            else:
+                # continue with new IDs
+                next_id = next_id + 1
+                id = next_id
+            lookup_rows.append({
+                'id': id, 'tenant_id': sis_tenant_id, 'school_id': school_id, 'lov_name': sis_lov_name,
+                'lov_column_value': lookup[1], 'lov_code': lookup[0], 'sort_order': lookup[2],
+                'created_by': sis_user_guid, 'created_on': datetime, 'updated_by': sis_user_guid, 'updated_on': datetime
+            })
+    sync_batches.append((insert_value, records(pd.DataFrame(lookup_rows))))
+
+print("{} statements in {} batches".format(sum(len(rows) for sql, rows in sync_batches), len(sync_batches)))
+
+# %%
+# Write the statements into a SQL script for auditing (and running by hand if needed)
+filename = 'data/' + country + '/' + sis_field_name + '-sync-script.sql'
+file = open(filename, "w") 
+
+file.write("USE {};\n\n".format(sis_database))
+
+# Remove all existing ethnicities in the SIS in a rolled back transaction
+file.write("START TRANSACTION;\n\n")
+
 # Some basic summary verification
-file.write("\nSELECT school_id, count(lov_name) num_{} FROM dpdown_valuelist WHERE lov_name = '{}' GROUP BY school_id;\n".format(sis_field_name, sis_lov_name))
+file.write("SELECT school_id, count(lov_name) num_{} FROM dpdown_valuelist WHERE lov_name = {} GROUP BY school_id;\n".format(sis_field_name, sql_value(sis_lov_name)))
+file.write(verification_sql + "\n")
 
-if sis_field_name == 'ethnicity' or sis_field_name == 'race':
-    file.write("SELECT count(staff_guid) tot_staff, {} as invalid_{} FROM staff_master WHERE {} IN {} GROUP BY {};\n\n".format(sis_column_name, sis_column_name, sis_column_name, invalid_vals, sis_column_name))
-elif sis_field_name == 'schoolLevel' or sis_field_name == 'schoolClassification':
-    file.write("SELECT count(school_guid) tot_school, {} as invalid_{} FROM school_master WHERE {} IN {} GROUP BY {};\n".format(sis_column_name, sis_column_name, sis_column_name, invalid_vals, sis_column_name))
-elif sis_field_name == 'femaleToiletType' or sis_field_name == 'maleToiletType' or sis_field_name == 'commonToiletType':
-    file.write("SELECT count(school_id) tot_school_detail, {} as invalid_{} FROM school_detail WHERE {} IN {} GROUP BY {};\n\n".format(sis_column_name, sis_column_name, sis_column_name, invalid_vals, sis_column_name))
-else:
-    pass
+if sis_field_name == 'schoolLevel' or sis_field_name == 'schoolClassification':
+    for r in school_master_to_clean:
+        file.write("#UPDATE school_master SET {} = NULL WHERE tenant_id = {} AND school_id = {} AND school_guid = {};\n".format(sis_column_name, sql_value(r['tenant_id']), r['school_id'], sql_value(r['school_guid'])))
+
+for statement in render_script(sync_batches):
+    file.write(statement + "\n")
+            
+# Some basic summary verification
+file.write("\nSELECT school_id, count(lov_name) num_{} FROM dpdown_valuelist WHERE lov_name = {} GROUP BY school_id;\n".format(sis_field_name, sql_value(sis_lov_name)))
+file.write(verification_sql)
 
 # Default to ROLLBACK. Final step is examination of the load script, test in development and then COMMIT when certain.
 file.write("\nROLLBACK;")
         
 file.close()
+print("Script written to {}".format(filename))
+
+# %%
+# %%time
+
+# Execute the same statements with bound parameters in one transaction
+if sis_load_data_to_sql == True:
+    with mysql_engine.begin() as conn:
+        counts = execute_batches(conn, sync_batches)
+    print("Lookup {} synced: {} rows affected".format(sis_lov_name, sum(counts)))
+else:
+    print("Not loading the data into SQL (review the script {})".format(filename))
 
 # %%
 # Close database connection
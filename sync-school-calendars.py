@@ -0,0 +1,174 @@
+# ---
+# jupyter:
+#   jupytext:
+#     formats: ipynb,py:percent
+#     text_representation:
+#       extension: .py
+#       format_name: percent
+#       format_version: '1.3'
+#       jupytext_version: 1.14.5
+#   kernelspec:
+#     display_name: Python 3 (ipykernel)
+#     language: python
+#     name: python3
+# ---
+
+# %%
+###############################################################################
+# This notebook provides some tools for better integration between the        #
+# Pacific EMIS and Pacific SIS. In particular the generation of the school    #
+# calendars of all the schools missing one for the configured school years    #
+# (sis_calendar_years, default to the emis_school_year) from the EMIS school  #
+# year dates, school weekdays and holidays set in config.json                 #
+###############################################################################
+
+# Core stuff
+import os
+import datetime as dt
+
+# Data stuff
+import pandas as pd # Data analysis
+import numpy as np
+import sqlalchemy as sa
+# Sync tools
+from pacific_sis.runtime import load_config, sis_engine
+from pacific_sis.templates import load_templates
+from pacific_sis.schoolyear import calendar_days, school_calendars
+from pacific_sis.checkpoint import CheckpointJournal, load_in_chunks
+from pacific_sis.cloning import clone_template
+# Pretty printing stuff
+from pacific_sis.runtime import display, HTML
+import pprint
+pp = pprint.PrettyPrinter(indent=4)
+
+# Initial setup
+cwd = os.getcwd()
+
+# Configuration
+config = load_config()
+        
+# EMIS config
+emis_school_year = config['emis_school_year']
+# The EMIS school years to generate calendars for
+sis_calendar_years = config.get('sis_calendar_years') or [emis_school_year]
+        
+# SIS config
+sis_database = config['sis_database']
+sis_tenant_id = config['sis_tenant_id']
+sis_user_guid = config['sis_user_guid']
+sis_country = config['sis_country']
+sis_export_data_to_excel = config['sis_export_data_to_excel']
+sis_load_data_to_sql = config['sis_load_data_to_sql']
+# Loads are committed this many schools at a time (and resumed from there if interrupted)
+sis_load_schools_per_chunk = config.get('sis_load_schools_per_chunk', 10)
+# Large initial loads: primary key order, no session checks (foreign keys checked before each commit)
+sis_bulk_load = config.get('sis_bulk_load', False)
+# The school whose calendar is used for the columns not generated
+sis_template_school_id = config.get('sis_template_school_id', 115)
+
+# Config
+country = config['country']
+datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+# MySQL Connection (created when first used)
+mysql_engine = sis_engine(config)
+
+print("Retrieving settings and creating database connections")
+
+# %%
+# Get some auxilairy data (schools, existing calendars, next IDs, templates, etc.)
+query_schools_sis = """
+SELECT school_id, school_name FROM school_master WHERE tenant_id = '{}' ORDER BY school_id;
+""".format(sis_tenant_id)
+
+query_school_calendars_sis = """
+SELECT school_id, academic_year, calender_id, default_calender FROM school_calendars WHERE tenant_id = '{}';
+""".format(sis_tenant_id)
+
+query_school_calendars_next_id = """
+SELECT COALESCE(MAX(calender_id), 0) + 1 AS next_id FROM school_calendars;
+"""
+
+# The most recent default calendar of the template school
+query_school_calendars = """
+SELECT `calender_id`, `school_id`, `tenant_id`, `academic_year`, `created_by`, `created_on`, `days`, `default_calender`, `end_date`, `rollover_id`, `session_calendar`, `start_date`, `title`, `updated_by`, `updated_on`, `visible_to_membership_id`
+FROM `school_calendars`
+WHERE tenant_id = '{}' AND school_id = {} AND default_calender = 1
+ORDER BY academic_year DESC, calender_id DESC
+LIMIT 1;
+""".format(sis_tenant_id, sis_template_school_id)
+
+with mysql_engine.begin() as conn:
+    df_schools_sis = pd.read_sql_query(sa.text(query_schools_sis), conn)
+    df_school_calendars_sis = pd.read_sql_query(sa.text(query_school_calendars_sis), conn)
+    school_calendars_next_id = conn.execute(sa.text(query_school_calendars_next_id)).mappings().first()['next_id']
+print("SIS schools")
+display(df_schools_sis)
+print("SIS existing school calendars")
+display(df_school_calendars_sis)
+
+templates = {
+    'school_calendars': {'query': query_school_calendars, 'sql_table': 'school_calendars', 'df_name': None},
+}
+
+templates = load_templates(mysql_engine, templates)
+for k,template in templates.items():
+    print("{} with {} records".format(template['sql_table'], template['df'].shape[0]))
+    display(template['df'].head(3))
+
+# %%
+# The days of each school year (same weekdays and holidays for all schools)
+df_calendar_days = pd.concat([calendar_days(year, config).assign(emis_school_year=year) for year in sis_calendar_years], ignore_index=True)
+print("School days per school year")
+display(df_calendar_days.groupby('emis_school_year')[['is_school_day']].sum())
+print("Holidays")
+display(df_calendar_days[df_calendar_days['holiday'].notna()].groupby(['emis_school_year', 'holiday'])['date'].agg(['min', 'max', 'count']))
+
+# The calendars of all schools and years not already in the SIS
+df_calendars = school_calendars(df_schools_sis['school_id'], sis_calendar_years, config)
+df_calendars = df_calendars.merge(df_school_calendars_sis[['school_id', 'academic_year']].drop_duplicates(), on=['school_id', 'academic_year'], how='left', indicator=True)
+df_calendars = df_calendars[df_calendars['_merge'] == 'left_only'].drop(columns=['_merge']).reset_index(drop=True)
+print("Number of school calendars to create: {}".format(len(df_calendars)))
+display(df_calendars)
+
+# %%
+###############################################################################
+# Prepare the school_calendars DataFrame for all the schools using the template DataFrame
+###############################################################################
+df_school_calendars_all = clone_template(templates['school_calendars']['df'], df_calendars[['school_id', 'academic_year', 'title', 'start_date', 'end_date', 'days']],
+                                         overrides={'tenant_id': sis_tenant_id, 'default_calender': 1, 'rollover_id': np.nan,
+                                                    'created_by': sis_user_guid, 'created_on': datetime, 'updated_by': sis_user_guid, 'updated_on': datetime},
+                                         ids={'calender_id': school_calendars_next_id})
+display(df_school_calendars_all)
+
+# %%
+# %%time
+
+if sis_export_data_to_excel == True:
+    
+    # Write to Excel the data for a final observation before a direct SQL insertion
+    with pd.ExcelWriter('data/'+country+'/sis-school-calendars-to-insert-data.xlsx') as writer:
+        print("Saving school_calendars with all final data records to Excel")
+        df_school_calendars_all.to_excel(writer, index=False, sheet_name='school_calendars')
+        print("Saving the days of the school years to Excel")
+        df_calendar_days.to_excel(writer, index=False, sheet_name='calendar_days')
+else:
+    print("Not exporting data to excel")
+
+# %%
+# %%time
+
+# Load all data into the database
+if sis_load_data_to_sql == True:
+    print("Loading school_calendars with all final data")
+    load_in_chunks(mysql_engine, {'school_calendars': df_school_calendars_all},
+                   CheckpointJournal.for_load(config, 'sync-school-calendars'), schools_per_chunk=sis_load_schools_per_chunk, bulk=sis_bulk_load)
+        
+    print("All school calendars imported successfully")
+else:
+    print("Not loading the data into SQL")
+
+# %%
+# Close database connection
+print("Closing the MySQL connection engine")
+mysql_engine.dispose()
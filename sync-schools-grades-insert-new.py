@@ -20,28 +20,31 @@
 # data of schools.                                                            #
 # This notebook can be used for pre-loading the SIS with all the schools      #
 # grade levels derived from the enrollments data in the EMIS.                 #
-# IMPORTANT: The gradelevels existing data should be cleaned up before        #
-# running this notebook (gradelevels-adjustments.sql)                         #
-# IMPORTANT: This notebook has a dependent variable from the notebook         #
-# sync-staff.ipynb so that one must be run first (at lest first two cells     #
+# Only the grades missing from the SIS gradelevels are inserted and the       #
+# next_grade_id of the existing grades of those schools re-linked so it can   #
+# be rerun as new grades appear in the EMIS                                   #
+# IMPORTANT: This notebook reads the schools_sis_map artifact published by    #
+# sync-staff.ipynb so that one must be run first (at lest first two cells)    #
 ###############################################################################
 
 # Core stuff
 import os
-import json
 import datetime as dt
 
 # Data stuff
 import pandas as pd # Data analysis
 import numpy as np
-import xlrd # excel 
-import pyodbc # SQL DB
-from sqlalchemy.engine import URL
-from sqlalchemy import create_engine
 import sqlalchemy as sa
 import uuid
+# Sync tools
+from pacific_sis.runtime import load_config, emis_engine, sis_engine
+from pacific_sis.artifacts import ArtifactStore
+from pacific_sis.templates import load_templates
+from pacific_sis.checkpoint import CheckpointJournal, load_in_chunks
+from pacific_sis.grades import link_next_grades
+from pacific_sis.changes import diff_matched, apply_changes
 # Pretty printing stuff
-from IPython.display import display, HTML
+from pacific_sis.runtime import display, HTML
 import pprint
 pp = pprint.PrettyPrinter(indent=4)
 
@@ -49,8 +52,7 @@ pp = pprint.PrettyPrinter(indent=4)
 cwd = os.getcwd()
 
 # Configuration
-with open('config.json', 'r') as file:
-     config = json.load(file)
+config = load_config()
         
 # EMIS config
 emis_lookup = config['emis_lookup']
@@ -63,27 +65,24 @@ sis_user_guid = config['sis_user_guid']
 sis_country = config['sis_country']
 sis_export_data_to_excel = config['sis_export_data_to_excel']
 sis_load_data_to_sql = config['sis_load_data_to_sql']
+# Loads are committed this many schools at a time (and resumed from there if interrupted)
+sis_load_schools_per_chunk = config.get('sis_load_schools_per_chunk', 10)
+# Large initial loads: primary key order, no session checks (foreign keys checked before each commit)
+sis_bulk_load = config.get('sis_bulk_load', False)
 
 # Config
 country = config['country']
 datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-# MS SQL Server connection
-mssql_connection_string = """
-    Driver={{ODBC Driver 17 for SQL Server}};
-    Server={},{};
-    Database={};
-    authentication=SqlPassword;UID={};PWD={};
-    TrustServerCertificate=yes;
-    autocommit=True
-    """.format(config['emis_server_ip'], config['emis_server_port'], config['emis_database'], config['emis_uid'], config['emis_pwd'])
+# Artifacts shared between notebooks (e.g. schools_sis_map)
+artifacts = ArtifactStore.from_config(config, producer='sync-schools-grades-insert-new')
+artifact_max_age_hours = config.get('artifact_max_age_hours')
 
-mssql_connection_url = URL.create("mssql+pyodbc", query={"odbc_connect": mssql_connection_string})
-mssql_engine = create_engine(mssql_connection_url)
+# MS SQL Server connection (created when first used)
+mssql_engine = emis_engine(config)
 
-# MySQL Connection
-mysql_connection_string = "mysql+mysqlconnector://"+config['sis_user']+":"+config['sis_pwd']+"@"+config['sis_host']+":"+config['sis_server_port']+"/"+config['sis_database']
-mysql_engine = create_engine(mysql_connection_string)
+# MySQL Connection (created when first used)
+mysql_engine = sis_engine(config)
 
 # %%
 # First get the next school_id and school_detail id to be used.
@@ -132,11 +131,20 @@ SELECT DISTINCT SE.[schNo]
   ORDER BY schNo, lvlYear
 """.format(emis_school_year-2,emis_school_year-1,emis_school_year)
 
+# The grades already in the SIS
+query_gradelevels_sis = """
+SELECT `grade_id`, `school_id`, `equivalency_id`, `next_grade_id`, `short_name`
+FROM `gradelevels`
+WHERE tenant_id = '{}';
+""".format(sis_tenant_id)
+
 with mysql_engine.begin() as conn:
     #df_school_calendars = pd.read_sql_query(sa.text(query_school_calendars), conn)
+    df_gradelevels_sis = pd.read_sql_query(sa.text(query_gradelevels_sis), conn)
+    print("Grade levels already in the SIS: {}".format(len(df_gradelevels_sis)))
     result1 = conn.execute(sa.text(query_gradelevel_next))
     #result2 = conn.execute(sa.text(query_school_detail_ids))
-    last_gradelevel_id = result1.mappings().first()['last_gradelevel_id']
+    last_gradelevel_id = result1.mappings().first()['last_gradelevel_id'] or 0
     next_gradelevel_id = last_gradelevel_id+1
     #next_school_detail_id = result2.mappings().first()['last_school_detail_id']+1
     print("Next grade_id should be {}".format(next_gradelevel_id))
@@ -159,12 +167,10 @@ templates = {
     'gradelevels': {'query': query_gradelevels, 'sql_table': 'gradelevels', 'df_name': None},
 }
 
-with mysql_engine.begin() as conn:
-    for k,template in templates.items():    
-        df = pd.read_sql_query(sa.text(template['query']), conn)    
-        template['df'] = df
-        print("{} with {} records".format(template['sql_table'], template['df'].shape[0]))
-        display(template['df'].head(3))    
+templates = load_templates(mysql_engine, templates)
+for k,template in templates.items():
+    print("{} with {} records".format(template['sql_table'], template['df'].shape[0]))
+    display(template['df'].head(3))    
 
 # %%
 # Here we first do some hacks to fix the anomolies discovered in the next cell
@@ -203,33 +209,43 @@ df_schools_gradelevels = pd.concat([df_schools_gradelevels, df_ksa209], ignore_i
 # but also raise anomalies that should be manually handled before loading into SIS
 
 df_schools_gradelevels = df_schools_gradelevels.copy()
-# Retrieve our list of schools missing from SIS    
-# %store -r schools_sis_map
+# Retrieve the SIS school mappings (published by sync-staff)
+schools_sis_map = artifacts.read_map('schools_sis_map', max_age_hours=artifact_max_age_hours)
 
-df_schools_gradelevels['grade_id'] = range(next_gradelevel_id, next_gradelevel_id + len(df_schools_gradelevels))
 df_schools_gradelevels['school_id'] = df_schools_gradelevels['schName'].map(schools_sis_map)
+df_schools_gradelevels = df_schools_gradelevels.rename(columns={'lvlYear': 'equivalency_id', 'GradeCode': 'short_name', 'Grade': 'title'})
+
+# Only the grades not already in the SIS for their school
+df_schools_gradelevels = df_schools_gradelevels.merge(df_gradelevels_sis[['school_id', 'short_name']].drop_duplicates(), on=['school_id', 'short_name'], how='left', indicator=True)
+df_schools_gradelevels = df_schools_gradelevels[df_schools_gradelevels['_merge'] == 'left_only'].drop(columns=['_merge'])
+df_schools_gradelevels = df_schools_gradelevels.sort_values(['school_id', 'equivalency_id']).reset_index(drop=True)
+print("Grade levels missing from the SIS: {} in {} schools".format(len(df_schools_gradelevels), df_schools_gradelevels['school_id'].nunique()))
+
+df_schools_gradelevels['grade_id'] = range(next_gradelevel_id, next_gradelevel_id + len(df_schools_gradelevels))
 df_schools_gradelevels['tenant_id'] = sis_tenant_id
 df_schools_gradelevels['created_by'] = sis_user_guid
 df_schools_gradelevels['created_on'] = datetime
-df_schools_gradelevels['updated_by'] = np.NaN
-df_schools_gradelevels['updated_on'] = np.NaN
-df_schools_gradelevels = df_schools_gradelevels.rename(columns={'lvlYear': 'equivalency_id', 'GradeCode': 'short_name', 'Grade': 'title'})
+df_schools_gradelevels['updated_by'] = np.nan
+df_schools_gradelevels['updated_on'] = np.nan
 df_schools_gradelevels['sort_order'] = df_schools_gradelevels['equivalency_id']+2
-df_schools_gradelevels['next_grade_id'] = np.NaN
-
-# Derive next grade levels
-
-for i in range(0, len(df_schools_gradelevels)-1):
-    if df_schools_gradelevels.loc[i+1, 'school_id'] == df_schools_gradelevels.loc[i, 'school_id']:
-        if df_schools_gradelevels.loc[i+1, 'equivalency_id'] != df_schools_gradelevels.loc[i, 'equivalency_id']+1:
-            sis_load_data_to_sql = False # Avoid loading if we get any anomalies
-            print("Anomaly with school {} and grade {} not following grade {}".format(df_schools_gradelevels.loc[i, 'school_id'], df_schools_gradelevels.loc[i+1, 'short_name'], df_schools_gradelevels.loc[i, 'short_name']))
-        df_schools_gradelevels.loc[i, 'next_grade_id'] = df_schools_gradelevels.loc[i+1, 'grade_id']
-    else:
-        df_schools_gradelevels.loc[i, 'next_grade_id'] = np.NaN
-        
-    # Print out anomalies. When a school has grades that or not subsequent of another
-    
+
+# Derive next grade levels from all the grades (existing and new) of the schools getting new grades
+df_gradelevels_affected = df_gradelevels_sis[df_gradelevels_sis['school_id'].isin(df_schools_gradelevels['school_id'])]
+df_gradelevels_chain = pd.concat([df_gradelevels_affected[['school_id', 'grade_id', 'equivalency_id']], df_schools_gradelevels[['school_id', 'grade_id', 'equivalency_id']]], ignore_index=True)
+df_gradelevels_chain['next_grade_id'], df_anomalies = link_next_grades(df_gradelevels_chain)
+
+# Print out anomalies. When a school has grades that or not subsequent of another
+if not df_anomalies.empty:
+    sis_load_data_to_sql = False # Avoid loading if we get any anomalies
+    print("Anomalies with grades not followed by the next level year")
+    display(df_anomalies)
+
+df_schools_gradelevels = df_schools_gradelevels.merge(df_gradelevels_chain[['grade_id', 'next_grade_id']], on='grade_id', how='left')
+
+# Existing grades whose next grade changes (e.g. the former last grade of a school)
+df_gradelevels_next_changes = diff_matched(df_gradelevels_chain, df_gradelevels_affected, ['school_id', 'grade_id'], ['next_grade_id'])
+print("Existing grade levels to re-link: {}".format(len(df_gradelevels_next_changes)))
+display(df_gradelevels_next_changes)
         
 # Final sort to avoid SQL violation of foreign keys by loading next grades before
 # It seems this is not necessary in one single transaction
@@ -265,9 +281,14 @@ else:
 
 # Load all data into the database
 if sis_load_data_to_sql == True:
-    with mysql_engine.begin() as conn:        
-        print("Loading gradelevels with all final data")
-        df_schools_gradelevels.to_sql('gradelevels', con=conn, index=False, if_exists='append')        
+    print("Loading gradelevels with all final data")
+    # A school's grades (and their next_grade_id) are always committed together
+    load_in_chunks(mysql_engine, {'gradelevels': df_schools_gradelevels},
+                   CheckpointJournal.for_load(config, 'sync-schools-grades-insert-new'), schools_per_chunk=sis_load_schools_per_chunk, bulk=sis_bulk_load)
+    # Once the new grades are in, point the existing grades to them
+    with mysql_engine.begin() as conn:
+        n = apply_changes(conn, 'gradelevels', df_gradelevels_next_changes, ['school_id', 'grade_id'], ['next_grade_id'], sis_tenant_id, sis_user_guid, datetime)
+        print("Re-linked the next grade of {} existing grade levels".format(n))
         
     print("All gradelevels imported successfully")
 else:
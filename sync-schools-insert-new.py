@@ -20,26 +20,28 @@
 # data of schools.                                                            #
 # This notebook can be used for pre-loading the SIS with all the schools in   #
 # the EMIS. The approach taken here is a more direct DataFrame to SQL DB      #
-# IMPORTANT: This notebook has a dependent variable from the notebook         #
-# sync-schools-update-existing.ipynb so that one must be run first            #
+# IMPORTANT: This notebook reads the df_schools_sis_to_insert artifact        #
+# published by sync-schools-update-existing.ipynb so that one must be run     #
+# first                                                                       #
 ###############################################################################
 
 # Core stuff
 import os
-import json
 import datetime as dt
 
 # Data stuff
 import pandas as pd # Data analysis
 import numpy as np
-import xlrd # excel 
-import pyodbc # SQL DB
-from sqlalchemy.engine import URL
-from sqlalchemy import create_engine
 import sqlalchemy as sa
-import uuid
+# Sync tools
+from pacific_sis.runtime import load_config, emis_engine, sis_engine
+from pacific_sis.artifacts import ArtifactStore
+from pacific_sis.templates import load_templates
+from pacific_sis.checkpoint import CheckpointJournal, load_in_chunks
+from pacific_sis.guids import make_guids, existing_guids
+from pacific_sis.cloning import clone_template
 # Pretty printing stuff
-from IPython.display import display, HTML
+from pacific_sis.runtime import display, HTML
 import pprint
 pp = pprint.PrettyPrinter(indent=4)
 
@@ -47,8 +49,7 @@ pp = pprint.PrettyPrinter(indent=4)
 cwd = os.getcwd()
 
 # Configuration
-with open('config.json', 'r') as file:
-     config = json.load(file)
+config = load_config()
         
 # EMIS config
 emis_lookup = config['emis_lookup']
@@ -60,27 +61,28 @@ sis_user_guid = config['sis_user_guid']
 sis_country = config['sis_country']
 sis_export_data_to_excel = config['sis_export_data_to_excel']
 sis_load_data_to_sql = config['sis_load_data_to_sql']
+# Loads are committed this many schools at a time (and resumed from there if interrupted)
+sis_load_schools_per_chunk = config.get('sis_load_schools_per_chunk', 10)
+# Large initial loads: primary key order, no session checks (foreign keys checked before each commit)
+sis_bulk_load = config.get('sis_bulk_load', False)
+# Derive the GUIDs of new records from the EMIS keys (UUIDv5) instead of random ones
+sis_deterministic_guids = config.get('sis_deterministic_guids', False)
+# The school whose configuration is cloned to the other schools
+sis_template_school_id = config.get('sis_template_school_id', 115)
 
 # Config
 country = config['country']
 datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-# MS SQL Server connection
-mssql_connection_string = """
-    Driver={{ODBC Driver 17 for SQL Server}};
-    Server={},{};
-    Database={};
-    authentication=SqlPassword;UID={};PWD={};
-    TrustServerCertificate=yes;
-    autocommit=True
-    """.format(config['emis_server_ip'], config['emis_server_port'], config['emis_database'], config['emis_uid'], config['emis_pwd'])
+# Artifacts shared between notebooks (e.g. schools_sis_map)
+artifacts = ArtifactStore.from_config(config, producer='sync-schools-insert-new')
+artifact_max_age_hours = config.get('artifact_max_age_hours')
 
-mssql_connection_url = URL.create("mssql+pyodbc", query={"odbc_connect": mssql_connection_string})
-mssql_engine = create_engine(mssql_connection_url)
+# MS SQL Server connection (created when first used)
+mssql_engine = emis_engine(config)
 
-# MySQL Connection
-mysql_connection_string = "mysql+mysqlconnector://"+config['sis_user']+":"+config['sis_pwd']+"@"+config['sis_host']+":"+config['sis_server_port']+"/"+config['sis_database']
-mysql_engine = create_engine(mysql_connection_string)
+# MySQL Connection (created when first used)
+mysql_engine = sis_engine(config)
 
 print("Retrieving settings and creating database connections")
 
@@ -98,102 +100,109 @@ FROM `school_detail`
 ORDER BY `id`;
 """
 
+# The schools already in the SIS (e.g. loaded by a previous, interrupted, run)
+query_schools_sis = """
+SELECT `school_name`, `school_alt_id`
+FROM `school_master`
+WHERE tenant_id = '{}';
+""".format(sis_tenant_id)
+
 with mysql_engine.begin() as conn:
     #df_school_calendars = pd.read_sql_query(sa.text(query_school_calendars), conn)
     result1 = conn.execute(sa.text(query_school_master_ids))
     result2 = conn.execute(sa.text(query_school_detail_ids))
-    template_school_id = result1.mappings().first()['last_school_id']
-    next_school_id = template_school_id+1
+    next_school_id = result1.mappings().first()['last_school_id']+1
     next_school_detail_id = result2.mappings().first()['last_school_detail_id']+1
     print("Next school_id should be {}".format(next_school_id))
     print("Next school_detail id should be {}".format(next_school_detail_id))
+    df_schools_sis = pd.read_sql_query(sa.text(query_schools_sis), conn)
 
-# Here we create "template" DataFrames for all the tables of interest.0
-# those will later on be populated with data and loaded directly into the SQL DB
+# Here we create "template" DataFrames for all the tables of interest from the template
+# school. Those will later on be populated with data and loaded directly into the SQL DB
 
 query_release_number = """
 SELECT `release_number`, `school_id`, `tenant_id`, `created_by`, `created_on`, `release_date`, `updated_by`, `updated_on` 
 FROM release_number
 WHERE tenant_id = '{}' AND school_id = {};
-""".format(sis_tenant_id, template_school_id)
+""".format(sis_tenant_id, sis_template_school_id)
 
 query_school_master = """
 SELECT `school_id`, `tenant_id`, `alternate_name`, `city`, `country`, `county`, `created_by`, `created_on`, `current_period_ends`, `district`, `division`, `features`, `latitude`, `longitude`, `max_api_checks`, `plan_id`, `school_alt_id`, `school_classification`, `school_district_id`, `school_guid`, `school_internal_id`, `school_level`, `school_name`, `school_state_id`, `state`, `street_address_1`, `street_address_2`, `updated_by`, `updated_on`, `zip`
 FROM school_master
 WHERE tenant_id = '{}' AND school_id = {};
-""".format(sis_tenant_id, template_school_id)
+""".format(sis_tenant_id, sis_template_school_id)
 
 query_block = """
 SELECT `block_id`, `school_id`, `tenant_id`, `academic_year`, `block_sort_order`, `block_title`, `created_by`, `created_on`, `full_day_minutes`, `half_day_minutes`, `rollover_id`, `updated_by`, `updated_on`
 FROM `block`
 WHERE tenant_id = '{}' AND school_id = {};
-""".format(sis_tenant_id, template_school_id)
+""".format(sis_tenant_id, sis_template_school_id)
 
 query_dpdown_valuelist = """
 SELECT `id`, `created_by`, `created_on`, `lov_code`, `lov_column_value`, `lov_name`, `school_id`, `sort_order`, `tenant_id`, `updated_by`, `updated_on`
 FROM `dpdown_valuelist`
 WHERE tenant_id = '{}' AND school_id = {};
-""".format(sis_tenant_id, template_school_id)
+""".format(sis_tenant_id, sis_template_school_id)
 
 query_fields_category = """
 SELECT `category_id`, `school_id`, `tenant_id`, `created_by`, `created_on`, `hide`, `is_system_category`, `is_system_wide_category`, `module`, `required`, `search`, `sort_order`, `title`, `updated_by`, `updated_on`
 FROM `fields_category`
 WHERE tenant_id = '{}' AND school_id = {};
-""".format(sis_tenant_id, template_school_id)
+""".format(sis_tenant_id, sis_template_school_id)
 
 query_membership = """
 SELECT `membership_id`, `school_id`, `tenant_id`, `created_by`, `created_on`, `description`, `is_active`, `is_superadmin`, `is_system`, `profile`, `profile_type`, `updated_by`, `updated_on`
 FROM `membership`
 WHERE tenant_id = '{}' AND school_id = {};
-""".format(sis_tenant_id, template_school_id)
+""".format(sis_tenant_id, sis_template_school_id)
 
 query_permission_group = """
 SELECT `permission_group_id`, `school_id`, `tenant_id`, `active`, `badgeType`, `badgeValue`, `created_by`, `created_on`, `icon`, `icon_type`, `is_active`, `is_system`, `path`, `permission_group_name`, `short_name`, `sort_order`, `title`, `type`, `updated_by`, `updated_on`
 FROM `permission_group`
 WHERE tenant_id = '{}' AND school_id = {};
-""".format(sis_tenant_id, template_school_id)
+""".format(sis_tenant_id, sis_template_school_id)
 
 query_school_calendars = """
 SELECT `calender_id`, `school_id`, `tenant_id`, `academic_year`, `created_by`, `created_on`, `days`, `default_calender`, `end_date`, `rollover_id`, `session_calendar`, `start_date`, `title`, `updated_by`, `updated_on`, `visible_to_membership_id`
 FROM `school_calendars`
 WHERE tenant_id = '{}' AND school_id = {};
-""".format(sis_tenant_id, template_school_id)
+""".format(sis_tenant_id, sis_template_school_id)
 
 query_school_detail = """
 SELECT `id`, `affiliation`, `associations`, `common_toilet_accessibility`, `comon_toilet_type`, `created_by`, `created_on`, `currently_available`, `date_school_closed`, `date_school_opened`, `electricity`, `email`, `facebook`, `fax`, `female_toilet_accessibility`, `female_toilet_type`, `gender`, `handwashing_available`, `highest_grade_level`, `hygene_education`, `instagram`, `internet`, `linkedin`, `locale`, `lowest_grade_level`, `main_source_of_drinking_water`, `male_toilet_accessibility`, `male_toilet_type`, `name_of_assistant_principal`, `name_of_principal`, `running_water`, `school_id`, `school_logo`, `school_thumbnail_logo`, `soap_and_water_available`, `status`, `telephone`, `tenant_id`, `total_common_toilets`, `total_common_toilets_usable`, `total_female_toilets`, `total_female_toilets_usable`, `total_male_toilets`, `total_male_toilets_usable`, `twitter`, `updated_by`, `updated_on`, `website`, `youtube`
 FROM `school_detail`
 WHERE tenant_id = '{}' AND school_id = {};
-""".format(sis_tenant_id, template_school_id)
+""".format(sis_tenant_id, sis_template_school_id)
 
 query_student_enrollment_code = """
 SELECT `enrollment_code`, `school_id`, `tenant_id`, `academic_year`, `created_by`, `created_on`, `rollover_id`, `short_name`, `sort_order`, `title`, `type`, `updated_by`, `updated_on`
 FROM `student_enrollment_code`
 WHERE tenant_id = '{}' AND school_id = {};
-""".format(sis_tenant_id, template_school_id)
+""".format(sis_tenant_id, sis_template_school_id)
 
 query_custom_fields = """
 SELECT `category_id`, `field_id`, `school_id`, `tenant_id`, `created_by`, `created_on`, `default_selection`, `field_name`, `hide`, `is_system_wide_field`, `module`, `required`, `search`, `select_options`, `sort_order`, `system_field`, `title`, `type`, `updated_by`, `updated_on`
 FROM `custom_fields`
 WHERE tenant_id = '{}' AND school_id = {};
-""".format(sis_tenant_id, template_school_id)
+""".format(sis_tenant_id, sis_template_school_id)
 
 query_permission_category = """
 SELECT `permission_category_id`, `school_id`, `tenant_id`, `created_by`, `created_on`, `enable_add`, `enable_delete`, `enable_edit`, `enable_view`, `is_active`, `path`, `permission_category_name`, `permission_group_id`, `short_code`, `sort_order`, `title`, `type`, `updated_by`, `updated_on`
 FROM `permission_category`
 WHERE tenant_id = '{}' AND school_id = {};
-""".format(sis_tenant_id, template_school_id)
+""".format(sis_tenant_id, sis_template_school_id)
 
 query_permission_subcategory = """
 SELECT `permission_subcategory_id`, `school_id`, `tenant_id`, `created_by`, `created_on`, `enable_add`, `enable_delete`, `enable_edit`, `enable_view`, `is_active`, `is_system`, `path`, `permission_category_id`, `permission_group_id`, `permission_subcategory_name`, `short_code`, `sort_order`, `title`, `type`, `updated_by`, `updated_on`
 FROM `permission_subcategory`
 WHERE tenant_id = '{}' AND school_id = {};
-""".format(sis_tenant_id, template_school_id)
+""".format(sis_tenant_id, sis_template_school_id)
 
 query_role_permission = """
 SELECT `role_permission_id`, `school_id`, `tenant_id`, `can_add`, `can_delete`, `can_edit`, `can_view`, `created_by`, `created_on`, `membership_id`, `permission_category_id`, `permission_group_id`, `permission_subcategory_id`, `updated_by`, `updated_on`
 FROM `role_permission`
 WHERE tenant_id = '{}' AND school_id = {};
-""".format(sis_tenant_id, template_school_id)
+""".format(sis_tenant_id, sis_template_school_id)
 
 
 templates = {
@@ -213,19 +222,30 @@ templates = {
     'role_permission': {'query': query_role_permission, 'sql_table': 'role_permission', 'df_name': None}
 }
 
-with mysql_engine.begin() as conn:
-    for k,template in templates.items():    
-        df = pd.read_sql_query(sa.text(template['query']), conn)    
-        template['df'] = df
-        print("{} with {} records".format(template['sql_table'], template['df'].shape[0]))
-        display(template['df'].head(3))
+templates = load_templates(mysql_engine, templates)
+for k,template in templates.items():
+    print("{} with {} records".format(template['sql_table'], template['df'].shape[0]))
+    display(template['df'].head(3))
 
 # %%
 # Prepare all the new schools missing from SIS to be loaded from EMIS
     
-# Retrieve our list of schools missing from SIS    
-# %store -r df_schools_sis_to_insert
-df_schools_sis_to_insert = df_schools_sis_to_insert.copy()
+# Retrieve our list of schools missing from SIS (published by sync-schools-update-existing)
+df_schools_sis_to_insert = artifacts.read('df_schools_sis_to_insert', max_age_hours=artifact_max_age_hours)
+# The artifact lists the schools missing when it was published, those loaded since (by name or EMIS
+# schNo) are left out so a rerun after an interrupted load never inserts them again under new IDs
+school_already_in_sis = (df_schools_sis_to_insert['school_name'].isin(df_schools_sis['school_name'].dropna()) |
+                         df_schools_sis_to_insert['school_alt_id'].isin(df_schools_sis['school_alt_id'].dropna()))
+if school_already_in_sis.any():
+    print("Schools already in the SIS since the artifact was published (skipped)")
+    display(df_schools_sis_to_insert[school_already_in_sis])
+df_schools_sis_to_insert = df_schools_sis_to_insert[~school_already_in_sis].reset_index(drop=True)
+df_schools_sis_to_insert['school_guid'] = make_guids(df_schools_sis_to_insert['school_alt_id'], sis_tenant_id, 'school', sis_deterministic_guids)
+if sis_deterministic_guids:
+    # Schools of a previous partially applied load are recognized by their GUID
+    school_guids_loaded = existing_guids(mysql_engine, 'school_master', 'school_guid', df_schools_sis_to_insert['school_guid'], sis_tenant_id)
+    print("Schools already loaded by a previous run (same GUID): {}".format(len(school_guids_loaded)))
+    df_schools_sis_to_insert = df_schools_sis_to_insert[~df_schools_sis_to_insert['school_guid'].isin(school_guids_loaded)].reset_index(drop=True)
 df_schools_sis_to_insert.insert(0, 'school_id', range(next_school_id, next_school_id + len(df_schools_sis_to_insert)))
 df_schools_sis_to_insert.insert(0, 'school_detail_id', range(next_school_detail_id, next_school_detail_id + len(df_schools_sis_to_insert)))
 print("New schools missing from SIS to be loaded from EMIS")
@@ -236,183 +256,59 @@ display(df_schools_sis_to_insert)
 # For each template DataFrame set the school_id to NaN
 # we will later on the the correct school_id and merely using the DataFrame as templates to fill up the data.
 for k,template in templates.items():
-    template['df']['school_id'] = np.NaN
+    template['df']['school_id'] = np.nan
     # We leave tenant_id untouch and not using the one from the config. The reason is 
     # the database we are reading the templates from is already filtering that tenant_id
     # and this what is in the data is the right one.
     display(template['df'])
 
 # %%
-# One possible implementation for school_master...
-#school_ids = df_schools_sis_to_insert['school_id'].values
-
-#school_masters = []
-#df_school_master_all = None
-
-#for school_id in school_ids:
-#    #print("Preparing school {}".format(school_id))
-#    df = templates['school_master']['df'].copy()
-#    df['school_id'] = school_id    
-#    school_masters.append(df)
-
-#if len(school_masters) > 0:
-#    df_school_master_all = pd.concat(school_masters, ignore_index=True)
-#    display(df_school_master_all)
-
-# %%
-# Another possible implementation for school_master...
 school_ids = df_schools_sis_to_insert['school_id'].values
 schools_num = len(school_ids)
 print("Number of new schools to insert: {}".format(schools_num))
 
-if schools_num > 0:
-    ###############################################################################
-    # Prepare the school_master DataFrame for all the schools using the template DataFrame
-    ###############################################################################
-    df_school_master_all = pd.concat([templates['school_master']['df']]*schools_num, ignore_index=True)
-
-    # Set all the data into the template DataFrame
-    df_school_master_all['school_id'] = df_schools_sis_to_insert['school_id']
-    df_school_master_all['school_guid'] = [str(uuid.uuid4()) for _ in range(len(df_school_master_all.index))]
-    df_school_master_all['city'] = df_schools_sis_to_insert['city']
-    df_school_master_all['country'] = sis_country
-    df_school_master_all['division'] = df_schools_sis_to_insert['division']
-    df_school_master_all['county'] = df_schools_sis_to_insert['county']
-    df_school_master_all['district'] = df_schools_sis_to_insert['district']
-    df_school_master_all['school_internal_id'] = df_schools_sis_to_insert['school_alt_id']
-    df_school_master_all['school_district_id'] = df_schools_sis_to_insert['school_district_id']
-    df_school_master_all['school_alt_id'] = df_schools_sis_to_insert['school_alt_id']
-    df_school_master_all['school_name'] = df_schools_sis_to_insert['school_name']
-    df_school_master_all['school_state_id'] = df_schools_sis_to_insert['school_state_id']
-    df_school_master_all['state'] = df_schools_sis_to_insert['state']
-    df_school_master_all['street_address_1'] = df_schools_sis_to_insert['street_address_1']
-    df_school_master_all['street_address_2'] = df_schools_sis_to_insert['street_address_2']
-    df_school_master_all['zip'] = 'N/A'
-    df_school_master_all['school_level'] = df_schools_sis_to_insert['school_level']
-    df_school_master_all['latitude'] = df_schools_sis_to_insert['latitude']
-    df_school_master_all['longitude'] = df_schools_sis_to_insert['longitude']
-
-    print("New SIS schools ready for loading (and their columns): {}".format(df_school_master_all.columns))
-    # only show the columns with data to view them all
-    display(df_school_master_all[['school_id', 'tenant_id', 'school_alt_id', 
-                                  'city', 'country', 'county', 'school_district_id', 'district', 'division', 'latitude', 'longitude', 
-                                  'plan_id', 'school_classification',  'school_guid', 'school_internal_id',
-                                  'school_level', 'school_name', 'school_state_id', 'state',
-                                  'created_by', 'created_on']])
-
-    ###############################################################################
-    # Same implementation but for school_detail...
-    ###############################################################################
-    school_ids = df_schools_sis_to_insert['school_id'].values
-    schools_num = len(school_ids)
-    print("Number of new schools to insert: {}".format(schools_num))
-
-    # Prepare the school_master DataFrame for all the schools using the template DataFrame
-    df_school_detail_all = pd.concat([templates['school_detail']['df']]*schools_num, ignore_index=True)
-
-    # Set all the data into the template DataFrame
-    df_school_detail_all['id'] = df_schools_sis_to_insert['school_detail_id']
-    df_school_detail_all['school_id'] = df_schools_sis_to_insert['school_id']
-    df_school_detail_all['affiliation'] = df_schools_sis_to_insert['affiliation']
-    df_school_detail_all['date_school_opened'] = df_schools_sis_to_insert['date_school_opened']
-    df_school_detail_all['created_on'] = df_school_master_all['created_on']
-
-    print("New SIS school_detail ready for loading (and their columns): {}".format(df_school_detail_all.columns))
-    # only show the columns with data to view them all
-    display(df_school_detail_all[
-    ['id', 'tenant_id', 'school_id', 'affiliation', 'associations', 
-     'date_school_closed', 'date_school_opened', 
-     'lowest_grade_level', 'highest_grade_level', 
-     'locale', 'name_of_principal',
-     'status',
-     'created_by', 'created_on',
-    ]])
-
-    ###############################################################################
-    # All other tables are simpler and can be done merely like this
-    ###############################################################################
-    row_in_df = len(templates['role_permission']['df'])
-    df_role_permission_all = pd.concat([templates['role_permission']['df']]*schools_num, ignore_index=True)
-    df_role_permission_all['school_id'] = df_schools_sis_to_insert['school_id'].repeat(row_in_df).reset_index(drop=True)
-    #display(df_schools_sis_to_insert['school_id'].repeat(row_in_df).reset_index(drop=True))
-    display(df_role_permission_all) 
-else:
-    print("No data to process")
-
-# %%
-school_ids = df_schools_sis_to_insert['school_id'].values
-schools_num = len(school_ids)
-print("Number of new schools to insert: {}".format(schools_num))
+# The per school values of the tables that have more than the school_id
+df_school_master_targets = pd.DataFrame({
+    'school_id': df_schools_sis_to_insert['school_id'],
+    'school_guid': df_schools_sis_to_insert['school_guid'],
+    'city': df_schools_sis_to_insert['city'],
+    'division': df_schools_sis_to_insert['division'],
+    'county': df_schools_sis_to_insert['county'],
+    'district': df_schools_sis_to_insert['district'],
+    'school_internal_id': df_schools_sis_to_insert['school_alt_id'],
+    'school_district_id': df_schools_sis_to_insert['school_district_id'],
+    'school_alt_id': df_schools_sis_to_insert['school_alt_id'],
+    'school_name': df_schools_sis_to_insert['school_name'],
+    'school_state_id': df_schools_sis_to_insert['school_state_id'],
+    'state': df_schools_sis_to_insert['state'],
+    'street_address_1': df_schools_sis_to_insert['street_address_1'],
+    'street_address_2': df_schools_sis_to_insert['street_address_2'],
+    'school_level': df_schools_sis_to_insert['school_level'],
+    'latitude': df_schools_sis_to_insert['latitude'],
+    'longitude': df_schools_sis_to_insert['longitude'],
+})
+df_school_detail_targets = pd.DataFrame({
+    'id': df_schools_sis_to_insert['school_detail_id'],
+    'school_id': df_schools_sis_to_insert['school_id'],
+    'affiliation': df_schools_sis_to_insert['affiliation'],
+    'date_school_opened': df_schools_sis_to_insert['date_school_opened'],
+})
+
+# How each template is cloned, all others only get the school_id of the new schools
+clone_settings = {
+    'school_master': {'targets': df_school_master_targets, 'overrides': {'country': sis_country, 'zip': 'N/A'}},
+    'school_detail': {'targets': df_school_detail_targets, 'overrides': {'created_on': templates['school_master']['df']['created_on'].iloc[0]}},
+    # The id is a single integer increment and does not repeat for new schools
+    'dpdown_valuelist': {'ids': {'id': templates['dpdown_valuelist']['df']['id'].max()+1}},
+}
 
 # Go through all the template DataFrame and "expand" them with the schools to insert 
 # into SIS data
 if df_schools_sis_to_insert.shape[0] > 0:
     for k,v in templates.items():
-
-        if k == 'school_master':
-            ###############################################################################
-            # Prepare the school_master DataFrame for all the schools using the template DataFrame
-            ###############################################################################
-            df = pd.concat([v['df']]*schools_num, ignore_index=True)
-
-            # Set all the data into the template DataFrame
-            df['school_id'] = df_schools_sis_to_insert['school_id']
-            df['school_guid'] = [str(uuid.uuid4()) for _ in range(len(df.index))]
-            df['city'] = df_schools_sis_to_insert['city']
-            df['country'] = sis_country
-            df['division'] = df_schools_sis_to_insert['division']
-            df['county'] = df_schools_sis_to_insert['county']
-            df['district'] = df_schools_sis_to_insert['district']
-            df['school_internal_id'] = df_schools_sis_to_insert['school_alt_id']
-            df['school_district_id'] = df_schools_sis_to_insert['school_district_id']
-            df['school_alt_id'] = df_schools_sis_to_insert['school_alt_id']
-            df['school_name'] = df_schools_sis_to_insert['school_name']
-            df['school_state_id'] = df_schools_sis_to_insert['school_state_id']
-            df['state'] = df_schools_sis_to_insert['state']
-            df['street_address_1'] = df_schools_sis_to_insert['street_address_1']
-            df['street_address_2'] = df_schools_sis_to_insert['street_address_2']
-            df['zip'] = 'N/A'
-            df['school_level'] = df_schools_sis_to_insert['school_level']
-            df['latitude'] = df_schools_sis_to_insert['latitude']
-            df['longitude'] = df_schools_sis_to_insert['longitude']
-
-            v['df'] = df
-
-        elif k == 'school_detail':
-            ###############################################################################
-            # Same implementation but for school_detail...
-            ###############################################################################
-
-            # Prepare the school_master DataFrame for all the schools using the template DataFrame
-            df = pd.concat([v['df']]*schools_num, ignore_index=True)
-
-            # Set all the data into the template DataFrame
-            df['id'] = df_schools_sis_to_insert['school_detail_id']
-            df['school_id'] = df_schools_sis_to_insert['school_id']
-            df['affiliation'] = df_schools_sis_to_insert['affiliation']
-            df['date_school_opened'] = df_schools_sis_to_insert['date_school_opened']
-            df['created_on'] = df_school_master_all['created_on']
-
-            v['df'] = df
-        elif k == 'dpdown_valuelist':
-            ###############################################################################
-            # Cases where the id is a single integer increment and does not repeat for new schools
-            ###############################################################################
-            row_in_df = len(v['df'])        
-            next_id = v['df']['id'].tail(1).item()+1
-            df = pd.concat([v['df']]*schools_num, ignore_index=True)
-            df['school_id'] = df_schools_sis_to_insert['school_id'].repeat(row_in_df).reset_index(drop=True)
-            df['id'] = range(next_id, next_id + len(df))
-
-            v['df'] = df
-        else:
-            ###############################################################################
-            # All other tables are simpler and can be done merely like this
-            ###############################################################################
-            row_in_df = len(v['df'])
-            df = pd.concat([v['df']]*schools_num, ignore_index=True)
-            df['school_id'] = df_schools_sis_to_insert['school_id'].repeat(row_in_df).reset_index(drop=True)
-            v['df'] = df
+        settings = clone_settings.get(k, {})
+        v['df'] = clone_template(v['df'], settings.get('targets', df_schools_sis_to_insert[['school_id']]),
+                                 overrides=settings.get('overrides'), ids=settings.get('ids'))
 
     # Print out to output and excel all the resulting DataFrame        
     for k,template in templates.items(): 
@@ -450,10 +346,10 @@ else:
 # Load all data into the database
 sis_load_data_to_sql
 if sis_load_data_to_sql == True:
-    with mysql_engine.begin() as conn:
-        for k,v in templates.items():
-            print("Inserting {} records into the SQL table {} of database {}".format(v['df'].shape[0], v['sql_table'], sis_database))
-            v['df'].to_sql(v['sql_table'], con=conn, index=False, if_exists='append')
+    for k,v in templates.items():
+        print("Inserting {} records into the SQL table {} of database {}".format(v['df'].shape[0], v['sql_table'], sis_database))
+    load_in_chunks(mysql_engine, {v['sql_table']: v['df'] for k,v in templates.items()},
+                   CheckpointJournal.for_load(config, 'sync-schools-insert-new'), schools_per_chunk=sis_load_schools_per_chunk, bulk=sis_bulk_load)
 
     print("All schools imported successfully")
 else:
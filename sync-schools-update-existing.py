@@ -24,19 +24,19 @@
 
 # Core stuff
 import os
-import json
 import datetime as dt
 
 # Data stuff
 import pandas as pd # Data analysis
-import xlrd # excel 
-import pyodbc # SQL DB
-from sqlalchemy.engine import URL
-from sqlalchemy import create_engine
 import sqlalchemy as sa
 
+# Sync tools
+from pacific_sis.runtime import load_config, emis_engine, sis_engine
+from pacific_sis.artifacts import ArtifactStore
+from pacific_sis.sql import records, render_script, execute_batches
+
 # Pretty printing stuff
-from IPython.display import display, HTML
+from pacific_sis.runtime import display, HTML
 import pprint
 pp = pprint.PrettyPrinter(indent=4)
 
@@ -44,8 +44,7 @@ pp = pprint.PrettyPrinter(indent=4)
 cwd = os.getcwd()
 
 # Configuration
-with open('config.json', 'r') as file:
-     config = json.load(file)
+config = load_config()
         
 # EMIS config
 emis_lookup = config['emis_lookup']
@@ -55,27 +54,21 @@ sis_database = config['sis_database']
 sis_tenant_id = config['sis_tenant_id']
 sis_user_guid = config['sis_user_guid']
 sis_country = config['sis_country']
+sis_load_data_to_sql = config['sis_load_data_to_sql']
 
 # Config
 country = config['country']
 datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-# MS SQL Server connection
-mssql_connection_string = """
-    Driver={{ODBC Driver 17 for SQL Server}};
-    Server={},{};
-    Database={};
-    authentication=SqlPassword;UID={};PWD={};
-    TrustServerCertificate=yes;
-    autocommit=True
-    """.format(config['emis_server_ip'], config['emis_server_port'], config['emis_database'], config['emis_uid'], config['emis_pwd'])
+# Artifacts shared between notebooks (e.g. schools_sis_map)
+artifacts = ArtifactStore.from_config(config, producer='sync-schools-update-existing')
+artifact_max_age_hours = config.get('artifact_max_age_hours')
 
-mssql_connection_url = URL.create("mssql+pyodbc", query={"odbc_connect": mssql_connection_string})
-mssql_engine = create_engine(mssql_connection_url)
+# MS SQL Server connection (created when first used)
+mssql_engine = emis_engine(config)
 
-# MySQL Connection
-mysql_connection_string = "mysql+mysqlconnector://"+config['sis_user']+":"+config['sis_pwd']+"@"+config['sis_host']+":"+config['sis_server_port']+"/"+config['sis_database']
-mysql_engine = create_engine(mysql_connection_string)
+# MySQL Connection (created when first used)
+mysql_engine = sis_engine(config)
 
 # %%
 # Some data configuration/mapping
@@ -206,7 +199,7 @@ print("SIS schools missing to be inserted")
 print("Available columns {}".format(df_schools_sis_to_insert.columns))
 display(df_schools_sis_to_insert)
 
-# %store df_schools_sis_to_insert
+artifacts.publish('df_schools_sis_to_insert', df_schools_sis_to_insert)
 
 # %%
 # Prepare data to update all existing schools in FedSIS with the official data in EMIS.
@@ -227,10 +220,9 @@ print("SIS schools to update with this data")
 df_schools_sis_to_update = df_schools_emis2.merge(df_schools_sis2_ids,on=['school_name'])
 
 # Do some final minor data cleanup/processing
-# Except latitude and longitude can not be 'N/A'
-df_schools_sis_to_update['latitude'] = df_schools_sis_to_update['latitude'].fillna('NULL')
-df_schools_sis_to_update['longitude'] = df_schools_sis_to_update['longitude'].fillna('NULL')
-df_schools_sis_to_update = df_schools_sis_to_update.fillna('N/A')
+# Except latitude and longitude can not be 'N/A' (they stay missing, i.e. NULL)
+text_columns = df_schools_sis_to_update.columns.difference(['latitude', 'longitude'])
+df_schools_sis_to_update[text_columns] = df_schools_sis_to_update[text_columns].fillna('N/A')
 
 # Add some additional data
 df_schools_sis_to_update['country'] = sis_country
@@ -243,7 +235,29 @@ schools_sis_to_update = df_schools_sis_to_update.to_dict('records')
 schools_sis_to_update[:3]
 
 # %%
-# Using the data prepared in previous cell produce the actual SQL script that will UPDATE everything to be in sync.
+# The UPDATE statements with bound parameters (one statement text per table for all the schools)
+update_school_detail = """
+UPDATE `school_detail` SET `affiliation` = :affiliation, `date_school_opened` = :date_school_opened, `updated_by` = :updated_by, `updated_on` = :updated_on
+WHERE school_id = :school_id AND tenant_id = :tenant_id
+"""
+
+update_school_master = """
+UPDATE `school_master` SET `school_internal_id` = :school_alt_id, `school_alt_id` = :school_alt_id, `city` = :city, `street_address_1` = :street_address_1, `street_address_2` = :street_address_2,
+`division` = :division, `school_district_id` = :school_district_id, `district` = :district, `county` = :county, `school_state_id` = :school_state_id, `state` = :state,
+`school_classification` = :school_classification, `school_level` = :school_level, `latitude` = :latitude, `longitude` = :longitude, `country` = :country,
+`updated_by` = :updated_by, `updated_on` = :updated_on
+WHERE school_id = :school_id AND tenant_id = :tenant_id
+"""
+
+sync_batches = [
+    (update_school_detail, records(df_schools_sis_to_update[['affiliation', 'date_school_opened', 'updated_by', 'updated_on', 'school_id', 'tenant_id']])),
+    (update_school_master, records(df_schools_sis_to_update[[
+        'school_alt_id', 'city', 'street_address_1', 'street_address_2', 'division', 'school_district_id', 'district', 'county', 'school_state_id', 'state',
+        'school_classification', 'school_level', 'latitude', 'longitude', 'country', 'updated_by', 'updated_on', 'school_id', 'tenant_id']])),
+]
+
+# %%
+# Using the statements prepared in previous cell produce the SQL script that will UPDATE everything to be in sync (for auditing).
 print("Generating the updates scripts to sync EMIS schools to SIS schools")
 filename = 'data/' + country + '/schools-emis-to-sis-update-script.sql'
 file = open(filename, "w") 
@@ -253,16 +267,9 @@ file.write("USE {};\n\n".format(sis_database))
 # Remove all existing ethnicities in the SIS in a rolled back transaction
 file.write("START TRANSACTION;\n\n")
 
-# Some basic summary verification
-#file.write("SELECT school_id, count(lov_name) num_{} FROM dpdown_valuelist WHERE lov_name = '{}' GROUP BY school_id;\n".format(sis_field_name, sis_lov_name))
-
 # All the UPDATE statements
-for r in schools_sis_to_update:
-    file.write("UPDATE `school_detail` SET `affiliation` = '{}', `date_school_opened` = '{}', `updated_by` = '{}', `updated_on` = '{}' WHERE school_id = {} AND tenant_id = '{}';\n".format(r['affiliation'], r['date_school_opened'], r['updated_by'], r['updated_on'], r['school_id'], r['tenant_id']));
-    file.write("UPDATE `school_master` SET `school_internal_id` = '{}', `school_alt_id` = '{}', `city` = '{}', `street_address_1` = '{}', `street_address_2` = '{}', `division` = '{}', `school_district_id` = '{}', `district` = '{}', `county` = '{}', `school_state_id` = '{}', `state` = '{}', `school_classification` = '{}', `school_level` = '{}', `latitude` = {}, `longitude` = {}, `country` = '{}', `updated_by` = '{}', `updated_on` = '{}' WHERE school_id = {} AND tenant_id = '{}';\n".format(r['school_alt_id'], r['school_alt_id'], r['city'], r['street_address_1'], r['street_address_2'], r['division'], r['school_district_id'], r['district'], r['county'], r['school_state_id'], r['state'], r['school_classification'], r['school_level'], r['latitude'], r['longitude'], r['country'], r['updated_by'], r['updated_on'], r['school_id'], r['tenant_id']));
-      
-# Some basic summary verification
-#file.write("\nSELECT school_id, count(lov_name) num_{} FROM dpdown_valuelist WHERE lov_name = '{}' GROUP BY school_id;\n".format(sis_field_name, sis_lov_name))
+for statement in render_script(sync_batches):
+    file.write(statement + "\n")
 
 # Default to ROLLBACK. Final step is examination of the load script, test in development and then COMMIT when certain.
 file.write("\nROLLBACK;")
@@ -270,3 +277,14 @@ file.write("\nROLLBACK;")
 file.close()
 
 # %%
+# %%time
+
+# Execute the same statements with bound parameters in one transaction
+if sis_load_data_to_sql == True:
+    with mysql_engine.begin() as conn:
+        counts = execute_batches(conn, sync_batches)
+    print("{} school_detail and {} school_master records updated".format(*counts))
+else:
+    print("Not loading the data into SQL (review the script {})".format(filename))
+
+# %%
@@ -23,20 +23,24 @@
 
 # Core stuff
 import os
-import json
 import datetime as dt
 
 # Data stuff
 import pandas as pd # Data analysis
 import numpy as np
-import xlrd # excel 
-import pyodbc # SQL DB
-from sqlalchemy.engine import URL
-from sqlalchemy import create_engine
 import sqlalchemy as sa
-import uuid
+# Sync tools
+from pacific_sis.runtime import load_config, emis_engine, sis_engine
+from pacific_sis.artifacts import ArtifactStore
+from pacific_sis.templates import load_templates
+from pacific_sis.checkpoint import CheckpointJournal, load_in_chunks
+from pacific_sis.memory import arrow_strings, constant_column, compact, memory_report
+from pacific_sis.engines import transform_engine
+from pacific_sis.guids import make_guids, existing_guids
+from pacific_sis.schoolyear import school_year_dates
+from pacific_sis.grades import pack_duty_flags, combine_duty_masks, grades_taught
 # Pretty printing stuff
-from IPython.display import display, HTML
+from pacific_sis.runtime import display, HTML
 import pprint
 pp = pprint.PrettyPrinter(indent=4)
 
@@ -44,8 +48,7 @@ pp = pprint.PrettyPrinter(indent=4)
 cwd = os.getcwd()
 
 # Configuration
-with open('config.json', 'r') as file:
-     config = json.load(file)
+config = load_config()
         
 # EMIS config
 emis_lookup = config['emis_lookup']
@@ -58,27 +61,34 @@ sis_user_guid = config['sis_user_guid']
 sis_country = config['sis_country']
 sis_export_data_to_excel = config['sis_export_data_to_excel']
 sis_load_data_to_sql = config['sis_load_data_to_sql']
+# Loads are committed this many schools at a time (and resumed from there if interrupted)
+sis_load_schools_per_chunk = config.get('sis_load_schools_per_chunk', 10)
+# Large initial loads: primary key order, no session checks (foreign keys checked before each commit)
+sis_bulk_load = config.get('sis_bulk_load', False)
+# Arrow backed strings for the extracted data and categoricals for the repeated values of the final frames
+sis_arrow_dtypes = config.get('sis_arrow_dtypes', False)
+# 'pandas', 'duckdb' or 'polars' to do the matching, the numbering of the new records and the final projections
+sis_transform_engine = config.get('sis_transform_engine', 'pandas')
+# Also compute every step of another engine with pandas and stop on any difference
+sis_transform_parity_check = config.get('sis_transform_parity_check', False)
+transform = transform_engine(sis_transform_engine, sis_transform_parity_check)
+# Derive the GUIDs of new records from the EMIS keys (UUIDv5) instead of random ones
+sis_deterministic_guids = config.get('sis_deterministic_guids', False)
+sis_school_year_start_date, sis_school_year_end_date = school_year_dates(emis_school_year, config)
 
 # Config
 country = config['country']
 datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-# MS SQL Server connection
-mssql_connection_string = """
-    Driver={{ODBC Driver 17 for SQL Server}};
-    Server={},{};
-    Database={};
-    authentication=SqlPassword;UID={};PWD={};
-    TrustServerCertificate=yes;
-    autocommit=True
-    """.format(config['emis_server_ip'], config['emis_server_port'], config['emis_database'], config['emis_uid'], config['emis_pwd'])
+# Artifacts shared between notebooks (e.g. schools_sis_map)
+artifacts = ArtifactStore.from_config(config, producer='sync-staff')
+artifact_max_age_hours = config.get('artifact_max_age_hours')
 
-mssql_connection_url = URL.create("mssql+pyodbc", query={"odbc_connect": mssql_connection_string})
-mssql_engine = create_engine(mssql_connection_url)
+# MS SQL Server connection (created when first used)
+mssql_engine = emis_engine(config)
 
-# MySQL Connection
-mysql_connection_string = "mysql+mysqlconnector://"+config['sis_user']+":"+config['sis_pwd']+"@"+config['sis_host']+":"+config['sis_server_port']+"/"+config['sis_database']
-mysql_engine = create_engine(mysql_connection_string)
+# MySQL Connection (created when first used)
+mysql_engine = sis_engine(config)
 
 print("Retrieving settings and creating database connections")
 
@@ -103,6 +113,20 @@ SELECT `id`, `name`
 FROM country;
 """
 
+# Get the grade levels of each schools (equivalency_id is the EMIS level year)
+query_gradelevels_sis = """
+SELECT `school_id`, `grade_id`, `equivalency_id`, `short_name`, `title`
+FROM gradelevels
+ORDER BY `school_id`, `equivalency_id`;
+"""
+
+# Get the memberships (profiles) of each schools
+query_membership_sis = """
+SELECT `school_id`, `membership_id`, `profile`
+FROM membership
+WHERE tenant_id = '{}';
+""".format(sis_tenant_id)
+
 with mysql_engine.begin() as conn:
     result1 = conn.execute(sa.text(query_staff_id_last_sis))
     next_staff_id = result1.mappings().first()['last_staff_id']+1
@@ -112,13 +136,23 @@ with mysql_engine.begin() as conn:
     print("SIS schools for school_id mappings")
     display(df_schools_sis)
     schools_sis_map = pd.Series(df_schools_sis.school_id.values,index=df_schools_sis.school_name).to_dict()
-    # %store schools_sis_map
+    artifacts.publish_map('schools_sis_map', schools_sis_map, key_name='school_name', value_name='school_id')
     
     df_countries_sis = pd.read_sql_query(sa.text(query_countries_sis), conn)
     print("SIS countries for mappings")
     display(df_countries_sis)    
     countries_sis_map = pd.Series(df_countries_sis.id.values,index=df_countries_sis.name).to_dict()   
-    # %store countries_sis_map
+    artifacts.publish_map('countries_sis_map', countries_sis_map, key_name='name', value_name='id')
+    
+    df_gradelevels_sis = pd.read_sql_query(sa.text(query_gradelevels_sis), conn)
+    print("SIS grade levels for deriving grades taught")
+    display(df_gradelevels_sis)
+    
+    df_membership_sis = pd.read_sql_query(sa.text(query_membership_sis), conn)
+    df_teacher_membership_sis = df_membership_sis[df_membership_sis['profile'] == 'Teacher']
+    print("SIS teacher memberships by schools")
+    display(df_teacher_membership_sis)
+    teacher_membership_sis_map = pd.Series(df_teacher_membership_sis.membership_id.values,index=df_teacher_membership_sis.school_id).to_dict()
     
 # Here we create "template" DataFrames for all the tables of interest.
 # They start empty and will later on be populated with data and loaded directly into the SQL DB
@@ -147,12 +181,10 @@ templates = {
     'staff_school_info': {'query': query_staff_school_info, 'sql_table': 'staff_school_info', 'df_name': None},
 }
 
-with mysql_engine.begin() as conn:
-    for k,template in templates.items():    
-        df = pd.read_sql_query(sa.text(template['query']), conn)    
-        template['df'] = df
-        print("{} with {} records".format(template['sql_table'], template['df'].shape[0]))
-        display(template['df'].head(3))
+templates = load_templates(mysql_engine, templates)
+for k,template in templates.items():
+    print("{} with {} records".format(template['sql_table'], template['df'].shape[0]))
+    display(template['df'].head(3))
 
 # %%
 # Here we'll extract from the EMIS all the staff most recent school appointment data
@@ -207,6 +239,7 @@ SELECT -- From [warehouse].[TeacherLocation]
   INNER JOIN [dbo].[Schools] S ON TL.SurveySchNo = S.schNo
   INNER JOIN [dbo].[TeacherIdentity] TI ON TL.TID = TI.tID
   WHERE SurveyYear = {}
+  ORDER BY TL.[TID], TL.[SurveySchNo]
 """.format(emis_school_year)
 
 # and staff already in SIS
@@ -216,15 +249,27 @@ SELECT `staff_id`, `school_id`, `first_given_name`, `middle_name`, `last_family_
 FROM staff_master;
 """
 
+# and the schools they are attached to
+query_staff_school_info_sis = """
+SELECT `staff_id`, `school_attached_id`
+FROM staff_school_info
+WHERE tenant_id = '{}';
+""".format(sis_tenant_id)
+
 with mssql_engine.begin() as conn:
     print("EMIS Staff")
     df_staff_emis = pd.read_sql_query(sa.text(query_staff_emis), conn)
+    if sis_arrow_dtypes:
+        df_staff_emis = arrow_strings(df_staff_emis)
     display(df_staff_emis.head(3))
     
 with mysql_engine.begin() as conn:
     print("SIS Staff")
     df_staff_sis = pd.read_sql_query(sa.text(query_staff_sis), conn)
+    if sis_arrow_dtypes:
+        df_staff_sis = arrow_strings(df_staff_sis)
     display(df_staff_sis.head(3))    
+    df_staff_school_info_sis = pd.read_sql_query(sa.text(query_staff_school_info_sis), conn)
 
 # %%
 # View all the columns
@@ -236,10 +281,11 @@ for k,template in templates.items():
     pp.pprint(template['df'].columns)
 
 not_needed_columns = [
-    'TID', 'SurveyYear', 'SchoolCode', 'RoleCode', 
+    'SurveyYear', 'SchoolCode', 'RoleCode', 
     'Tpk', 'T00', 'T01', 'T02', 'T03', 'T04', 'T05', 'T06', 'T07', 'T08',
     'T09', 'T10', 'T11', 'T12', 'T13', 'T14', 'T15', 'T', 'A', 'X',
     'Activities', 'tDatePSClosed', 'tCloseReason', 'tRegisterStatus'] # 'TAMX' used for determining membership (teacher vs non-teaching staff)
+# 'TID' is kept to group the appointments of a teacher at several schools
     
 staff_column_mappings = {
     # EMIS column: SIS column, they are not named exactly has in the EMIS but its DataFrame equivalent herein    
@@ -255,6 +301,8 @@ staff_column_mappings = {
 }
 
 df_staff_emis = df_staff_emis.rename(columns=staff_column_mappings)
+# Keep the grades taught duties (Tpk, T00-T15) packed into a single bitmask before dropping them
+df_staff_emis['duties_mask'] = pack_duty_flags(df_staff_emis)
 df_staff_emis = df_staff_emis.drop(columns=not_needed_columns)
 print("Data from EMIS with mapped column to SIS and dropped unneeded columns")
 display(df_staff_emis)
@@ -267,7 +315,7 @@ df_staff_emis = df_staff_emis[df_staff_emis['TAMX'].isin(['T','M'])].copy()
 
 # The below is a better more general solution to the problem at hand than the simpler merge and isin solution
 # See https://stackoverflow.com/questions/28901683/pandas-get-rows-which-are-not-in-other-dataframe
-df_staff_all = df_staff_emis.merge(df_staff_sis[['first_given_name','last_family_name']].drop_duplicates(), on=['first_given_name','last_family_name'], how='left', indicator=True)
+df_staff_all = df_staff_emis.assign(_merge=transform.match(df_staff_emis, df_staff_sis, ['first_given_name','last_family_name']))
 print("EMIS and SIS merged")
 display(df_staff_all)
 
@@ -279,14 +327,52 @@ df_staff_not_already_loaded = df_staff_all[(df_staff_all['_merge'] == 'left_only
 print("Staff in EMIS not in SIS")
 display(df_staff_not_already_loaded)
 
+# %%
+# Teachers already in the SIS are not loaded again but their appointments at schools they are
+# not attached to yet (e.g. a newly appointed second school) still need a staff_school_info record.
+# Only teachers whose name is unique in the SIS can be attached to their staff_id.
+df_staff_sis_ids = df_staff_sis.drop_duplicates(subset=['first_given_name','last_family_name'], keep=False)
+df_staff_attachments = df_staff_already_loaded[['TID','first_given_name','last_family_name','school_attached_name']].merge(
+    df_staff_sis_ids[['first_given_name','last_family_name','staff_id','school_id']], on=['first_given_name','last_family_name'], how='inner')
+df_staff_attachments['school_attached_id'] = df_staff_attachments['school_attached_name'].map(schools_sis_map)
+df_staff_attachments = df_staff_attachments.dropna(subset=['school_attached_id']).drop_duplicates(subset=['staff_id','school_attached_id'])
+df_staff_attachments['school_attached_id'] = df_staff_attachments['school_attached_id'].astype(int)
+is_attached = transform.match(df_staff_attachments, df_staff_school_info_sis, ['staff_id','school_attached_id']) == 'both'
+df_staff_attachments = df_staff_attachments[~is_attached].copy()
+
+def constant(value):
+    return constant_column(df_staff_attachments.index, value, sis_arrow_dtypes)
+
+df_staff_attachments['created_by'] = constant(sis_user_guid)
+df_staff_attachments['created_on'] = constant(datetime)
+df_staff_attachments['end_date'] = constant(np.nan)
+df_staff_attachments['membership_id'] = df_staff_attachments['school_attached_id'].map(teacher_membership_sis_map).fillna(4).astype(int)
+df_staff_attachments['profile'] = constant('Teacher')
+df_staff_attachments['start_date'] = constant(sis_school_year_start_date)
+df_staff_attachments['tenant_id'] = constant(sis_tenant_id)
+df_staff_attachments['updated_by'] = constant(sis_user_guid)
+df_staff_attachments['updated_on'] = constant(datetime)
+print("Staff in EMIS already in SIS appointed at schools they are not attached to yet")
+display(df_staff_attachments)
+
 # %%
 df_staff_not_already_loaded = df_staff_not_already_loaded.copy()
 
+# A teacher (TID) can be appointed at several schools and then has one EMIS record per school.
+# The first appointment is the teacher's primary school used for its single user_master and
+# staff_master records while all appointments become staff_school_info records.
+df_staff_not_already_loaded['appointment_seq'] = transform.cumcount(df_staff_not_already_loaded, 'TID')
+df_staff_not_already_loaded['staff_seq'] = transform.ngroup(df_staff_not_already_loaded, 'TID')
+is_primary_appointment = df_staff_not_already_loaded['appointment_seq'] == 0
+print("EMIS staff appointed at more than one school")
+display(df_staff_not_already_loaded[df_staff_not_already_loaded.duplicated(subset=['TID'], keep=False)])
+
 # Check for missing date of birth and duplicate teachers
 print("EMIS staff with missing date of birth")
-display(df_staff_not_already_loaded[df_staff_not_already_loaded['dob'].isna()])
+display(df_staff_not_already_loaded[is_primary_appointment & df_staff_not_already_loaded['dob'].isna()])
 print("Duplicate EMIS staff based on teacher's first and last name (should be safe to load them?!)")
-display(df_staff_not_already_loaded[df_staff_not_already_loaded.duplicated(subset=['first_given_name','last_family_name'], keep=False)])
+df_staff_persons = df_staff_not_already_loaded[is_primary_appointment]
+display(df_staff_persons[df_staff_persons.duplicated(subset=['first_given_name','last_family_name'], keep=False)])
 
 # I think best strategy for unique email with so many unknown is to usefull name (ghislainhachey@example.com). This only works if there are no
 # teachers with same first and last name. So need to check this first. And also that no such email exists already in the SIS other this data loading will (should) fail.
@@ -310,29 +396,36 @@ else:
 
 # Create all the missing columns
 
+# The constant columns are categoricals (one byte per row) when the strings are Arrow backed
+def constant(value):
+    return constant_column(df_staff_not_already_loaded.index, value, sis_arrow_dtypes)
+
 df_staff_not_already_loaded['emailaddress'] = df_staff_not_already_loaded['login_email_address']
-df_staff_not_already_loaded['school_id'] = df_staff_not_already_loaded['school_attached_name'].map(schools_sis_map)
-df_staff_not_already_loaded['tenant_id'] = sis_tenant_id
-df_staff_not_already_loaded['created_by'] = sis_user_guid
-df_staff_not_already_loaded['created_on'] = datetime
-df_staff_not_already_loaded['description'] = np.NaN
+# The school of each appointment and the teacher's primary school
+df_staff_not_already_loaded['school_attached_id'] =  df_staff_not_already_loaded['school_attached_name'].map(schools_sis_map)
+df_staff_not_already_loaded['school_id'] = df_staff_not_already_loaded.groupby('TID')['school_attached_id'].transform('first')
+df_staff_not_already_loaded['tenant_id'] = constant(sis_tenant_id)
+df_staff_not_already_loaded['created_by'] = constant(sis_user_guid)
+df_staff_not_already_loaded['created_on'] = constant(datetime)
+df_staff_not_already_loaded['description'] = constant(np.nan)
 df_staff_not_already_loaded['is_active'] = 1
-df_staff_not_already_loaded['is_tenantadmin'] = np.NaN
+df_staff_not_already_loaded['is_tenantadmin'] = constant(np.nan)
 df_staff_not_already_loaded['lang_id'] = 1
-df_staff_not_already_loaded['last_used_school_id'] = np.NaN
-df_staff_not_already_loaded['login_attempt_date'] =  np.NaN
-df_staff_not_already_loaded['login_failure_count'] = np.NaN
-df_staff_not_already_loaded['membership_id'] = 4
+df_staff_not_already_loaded['last_used_school_id'] = constant(np.nan)
+df_staff_not_already_loaded['login_attempt_date'] = constant(np.nan)
+df_staff_not_already_loaded['login_failure_count'] = constant(np.nan)
+# The teacher membership of each appointment's school (4 is the template's)
+df_staff_not_already_loaded['membership_id'] = df_staff_not_already_loaded['school_attached_id'].map(teacher_membership_sis_map).fillna(4).astype(int)
 df_staff_not_already_loaded['name'] = df_staff_not_already_loaded['first_given_name']
-df_staff_not_already_loaded['passwordhash'] = '625F45FEB6DD30645BE90B71B9D46BC2A8F8EBABD7E96343DCCB84D14E9C898B'
-df_staff_not_already_loaded['updated_by'] = sis_user_guid
-df_staff_not_already_loaded['updated_on'] = datetime
-df_staff_not_already_loaded['user_id'] = range(next_staff_id, next_staff_id + len(df_staff_not_already_loaded))
+df_staff_not_already_loaded['passwordhash'] = constant('625F45FEB6DD30645BE90B71B9D46BC2A8F8EBABD7E96343DCCB84D14E9C898B')
+df_staff_not_already_loaded['updated_by'] = constant(sis_user_guid)
+df_staff_not_already_loaded['updated_on'] = constant(datetime)
+df_staff_not_already_loaded['user_id'] = next_staff_id + df_staff_not_already_loaded['staff_seq']
 df_staff_not_already_loaded['staff_id'] = df_staff_not_already_loaded['user_id']
-df_staff_not_already_loaded['alternate_id'] = np.NaN
-df_staff_not_already_loaded['bus_dropoff'] = np.NaN
-df_staff_not_already_loaded['bus_no'] = np.NaN
-df_staff_not_already_loaded['bus_pickup'] = np.NaN
+df_staff_not_already_loaded['alternate_id'] = constant(np.nan)
+df_staff_not_already_loaded['bus_dropoff'] = constant(np.nan)
+df_staff_not_already_loaded['bus_no'] = constant(np.nan)
+df_staff_not_already_loaded['bus_pickup'] = constant(np.nan)
 # Need to pull the country of birth from EMIS but unfortunately need to exposure it, it is in the XML on the enrollment record
 # needed something quick here
 #df_staff_not_already_loaded['country_of_birth'] = df_staff_not_already_loaded['country'].map(_sis_map)
@@ -342,86 +435,101 @@ df_staff_not_already_loaded['bus_pickup'] = np.NaN
 #df_staff_not_already_loaded['first_language'] = df_staff_not_already_loaded['first_language'].map(_sis_map)
 #df_staff_not_already_loaded['second_language'] = df_staff_not_already_loaded['second_language'].map(_sis_map)
 #df_staff_not_already_loaded['third_language'] = df_staff_not_already_loaded['third_language'].map(_sis_map)
-df_staff_not_already_loaded['country_of_birth'] = np.NaN
-df_staff_not_already_loaded['nationality'] = np.NaN
-df_staff_not_already_loaded['ethnicity'] = np.NaN
-df_staff_not_already_loaded['race'] = np.NaN
-df_staff_not_already_loaded['first_language'] = np.NaN
-df_staff_not_already_loaded['second_language'] = np.NaN
-df_staff_not_already_loaded['third_language'] = np.NaN
-df_staff_not_already_loaded['disability_description'] = np.NaN
-df_staff_not_already_loaded['district_id'] = np.NaN
-df_staff_not_already_loaded['emergency_email'] = np.NaN
-df_staff_not_already_loaded['emergency_first_name'] = np.NaN
-df_staff_not_already_loaded['emergency_home_phone'] = np.NaN
-df_staff_not_already_loaded['emergency_last_name'] = np.NaN
-df_staff_not_already_loaded['emergency_mobile_phone'] = np.NaN
-df_staff_not_already_loaded['emergency_work_phone'] = np.NaN
-df_staff_not_already_loaded['end_date'] = np.NaN
-df_staff_not_already_loaded['facebook'] = np.NaN
-df_staff_not_already_loaded['linkedin'] = np.NaN
-df_staff_not_already_loaded['home_address_city'] = np.NaN
-df_staff_not_already_loaded['home_address_country'] = np.NaN
-df_staff_not_already_loaded['home_address_line_one'] = np.NaN
-df_staff_not_already_loaded['home_address_line_two'] = np.NaN
-df_staff_not_already_loaded['home_address_state'] = np.NaN
-df_staff_not_already_loaded['home_address_zip'] = np.NaN
-df_staff_not_already_loaded['home_phone'] = np.NaN
-df_staff_not_already_loaded['homeroom_teacher'] = np.NaN
-df_staff_not_already_loaded['instagram'] = np.NaN
-df_staff_not_already_loaded['is_active'] = np.NaN
-df_staff_not_already_loaded['mailing_address_city'] = np.NaN
-df_staff_not_already_loaded['mailing_address_country'] = np.NaN
-df_staff_not_already_loaded['mailing_address_line_one'] = np.NaN
-df_staff_not_already_loaded['mailing_address_line_two'] = np.NaN
-df_staff_not_already_loaded['mailing_address_same_to_home'] = np.NaN
-df_staff_not_already_loaded['mailing_address_state'] = np.NaN
-df_staff_not_already_loaded['mailing_address_zip'] = np.NaN
-df_staff_not_already_loaded['marital_status'] = np.NaN
-df_staff_not_already_loaded['middle_name'] = np.NaN
-df_staff_not_already_loaded['mobile_phone'] = np.NaN
-df_staff_not_already_loaded['office_phone'] = np.NaN
-df_staff_not_already_loaded['other_govt_issued_number'] = np.NaN
-df_staff_not_already_loaded['other_subject_taught'] = np.NaN
-df_staff_not_already_loaded['personal_email'] = np.NaN
-df_staff_not_already_loaded['physical_disability'] = np.NaN
+df_staff_not_already_loaded['country_of_birth'] = constant(np.nan)
+df_staff_not_already_loaded['nationality'] = constant(np.nan)
+df_staff_not_already_loaded['ethnicity'] = constant(np.nan)
+df_staff_not_already_loaded['race'] = constant(np.nan)
+df_staff_not_already_loaded['first_language'] = constant(np.nan)
+df_staff_not_already_loaded['second_language'] = constant(np.nan)
+df_staff_not_already_loaded['third_language'] = constant(np.nan)
+df_staff_not_already_loaded['disability_description'] = constant(np.nan)
+df_staff_not_already_loaded['district_id'] = constant(np.nan)
+df_staff_not_already_loaded['emergency_email'] = constant(np.nan)
+df_staff_not_already_loaded['emergency_first_name'] = constant(np.nan)
+df_staff_not_already_loaded['emergency_home_phone'] = constant(np.nan)
+df_staff_not_already_loaded['emergency_last_name'] = constant(np.nan)
+df_staff_not_already_loaded['emergency_mobile_phone'] = constant(np.nan)
+df_staff_not_already_loaded['emergency_work_phone'] = constant(np.nan)
+df_staff_not_already_loaded['end_date'] = constant(np.nan)
+df_staff_not_already_loaded['facebook'] = constant(np.nan)
+df_staff_not_already_loaded['linkedin'] = constant(np.nan)
+df_staff_not_already_loaded['home_address_city'] = constant(np.nan)
+df_staff_not_already_loaded['home_address_country'] = constant(np.nan)
+df_staff_not_already_loaded['home_address_line_one'] = constant(np.nan)
+df_staff_not_already_loaded['home_address_line_two'] = constant(np.nan)
+df_staff_not_already_loaded['home_address_state'] = constant(np.nan)
+df_staff_not_already_loaded['home_address_zip'] = constant(np.nan)
+df_staff_not_already_loaded['home_phone'] = constant(np.nan)
+df_staff_not_already_loaded['homeroom_teacher'] = constant(np.nan)
+df_staff_not_already_loaded['instagram'] = constant(np.nan)
+df_staff_not_already_loaded['is_active'] = constant(np.nan)
+df_staff_not_already_loaded['mailing_address_city'] = constant(np.nan)
+df_staff_not_already_loaded['mailing_address_country'] = constant(np.nan)
+df_staff_not_already_loaded['mailing_address_line_one'] = constant(np.nan)
+df_staff_not_already_loaded['mailing_address_line_two'] = constant(np.nan)
+df_staff_not_already_loaded['mailing_address_same_to_home'] = constant(np.nan)
+df_staff_not_already_loaded['mailing_address_state'] = constant(np.nan)
+df_staff_not_already_loaded['mailing_address_zip'] = constant(np.nan)
+df_staff_not_already_loaded['marital_status'] = constant(np.nan)
+df_staff_not_already_loaded['middle_name'] = constant(np.nan)
+df_staff_not_already_loaded['mobile_phone'] = constant(np.nan)
+df_staff_not_already_loaded['office_phone'] = constant(np.nan)
+df_staff_not_already_loaded['other_govt_issued_number'] = constant(np.nan)
+df_staff_not_already_loaded['other_subject_taught'] = constant(np.nan)
+df_staff_not_already_loaded['personal_email'] = constant(np.nan)
+df_staff_not_already_loaded['physical_disability'] = constant(np.nan)
 df_staff_not_already_loaded['portal_access'] = 1
-df_staff_not_already_loaded['preferred_name'] = np.NaN
-df_staff_not_already_loaded['previous_name'] = np.NaN
-df_staff_not_already_loaded['primary_grade_level_taught'] = np.NaN
-df_staff_not_already_loaded['primary_subject_taught'] = np.NaN # ? in EMIS (is it worth the time?)
-df_staff_not_already_loaded['profile1'] = 'Classroom Teacher'
-df_staff_not_already_loaded['relationship_to_staff'] = np.NaN
-df_staff_not_already_loaded['salutation'] = np.NaN
-df_staff_not_already_loaded['school_email'] = np.NaN
-df_staff_not_already_loaded['social_security_number'] = np.NaN
-df_staff_not_already_loaded['staff_guid'] = [str(uuid.uuid4()) for _ in range(len(df_staff_not_already_loaded.index))]
-df_staff_not_already_loaded['staff_photo'] = np.NaN
-df_staff_not_already_loaded['staff_thumbnail_photo'] = np.NaN
-df_staff_not_already_loaded['state_id'] = np.NaN
-df_staff_not_already_loaded['suffix'] = np.NaN
-df_staff_not_already_loaded['twitter'] = np.NaN
-df_staff_not_already_loaded['youtube'] = np.NaN
-df_staff_not_already_loaded['profile2'] = 'Teacher'
-df_staff_not_already_loaded['school_attached_id'] =  df_staff_not_already_loaded['school_attached_name'].map(schools_sis_map)
-df_staff_not_already_loaded['start_date'] = '2022-09-01'
-
-# TODO Derive grade level taught from the teacher's duties in the EMIS
-df_staff_not_already_loaded['other_grade_level_taught'] = np.NaN
+df_staff_not_already_loaded['preferred_name'] = constant(np.nan)
+df_staff_not_already_loaded['previous_name'] = constant(np.nan)
+df_staff_not_already_loaded['primary_subject_taught'] = constant(np.nan) # ? in EMIS (is it worth the time?)
+df_staff_not_already_loaded['profile1'] = constant('Classroom Teacher')
+df_staff_not_already_loaded['relationship_to_staff'] = constant(np.nan)
+df_staff_not_already_loaded['salutation'] = constant(np.nan)
+df_staff_not_already_loaded['school_email'] = constant(np.nan)
+df_staff_not_already_loaded['social_security_number'] = constant(np.nan)
+# One GUID per teacher (TID) shared by its appointments
+staff_guids = make_guids(df_staff_not_already_loaded.groupby('staff_seq')['TID'].first(), sis_tenant_id, 'staff', sis_deterministic_guids)
+df_staff_not_already_loaded['staff_guid'] = df_staff_not_already_loaded['staff_seq'].map(staff_guids)
+if sis_deterministic_guids:
+    # Teachers of a previous partially applied load are recognized by their GUID
+    staff_guids_loaded = existing_guids(mysql_engine, 'staff_master', 'staff_guid', staff_guids, sis_tenant_id)
+    print("Teachers already loaded by a previous run (same GUID): {}".format(len(staff_guids_loaded)))
+    df_staff_not_already_loaded = df_staff_not_already_loaded[~df_staff_not_already_loaded['staff_guid'].isin(staff_guids_loaded)].copy()
+df_staff_not_already_loaded['staff_photo'] = constant(np.nan)
+df_staff_not_already_loaded['staff_thumbnail_photo'] = constant(np.nan)
+df_staff_not_already_loaded['state_id'] = constant(np.nan)
+df_staff_not_already_loaded['suffix'] = constant(np.nan)
+df_staff_not_already_loaded['twitter'] = constant(np.nan)
+df_staff_not_already_loaded['youtube'] = constant(np.nan)
+df_staff_not_already_loaded['profile2'] = constant('Teacher')
+df_staff_not_already_loaded['start_date'] = constant(sis_school_year_start_date)
+
+# Derive grade level taught from the teacher's duties in the EMIS (at all its schools)
+df_staff_not_already_loaded['duties_mask'] = combine_duty_masks(df_staff_not_already_loaded['duties_mask'], df_staff_not_already_loaded['TID'])
+df_grades_taught = grades_taught(df_staff_not_already_loaded['school_id'], df_staff_not_already_loaded['duties_mask'], df_gradelevels_sis)
+df_staff_not_already_loaded['primary_grade_level_taught'] = df_grades_taught['primary_grade_level_taught']
+df_staff_not_already_loaded['other_grade_level_taught'] = df_grades_taught['other_grade_level_taught']
 
 print("Staff not already loaded in SIS")
 display(df_staff_not_already_loaded)
 
 # %%
 # Create the final DataFrames for loading the data
+# One user_master and staff_master per teacher and one staff_school_info per appointment
 
-df_user_master_final = df_staff_not_already_loaded[
+def select_columns(df, columns):
+    """The columns of df to load (projected by the transform engine)"""
+    return transform.project(df, columns)
+
+df_staff_persons = df_staff_not_already_loaded[df_staff_not_already_loaded['appointment_seq'] == 0]
+
+df_user_master_final = select_columns(df_staff_persons,
     ['emailaddress', 'school_id', 'tenant_id', 'created_by', 'created_on',
        'description', 'is_active', 'is_tenantadmin', 'lang_id',
        'last_used_school_id', 'login_attempt_date', 'login_failure_count',
        'membership_id', 'name', 'passwordhash', 'updated_by', 'updated_on',
-       'user_id']]
-df_staff_master_final = df_staff_not_already_loaded[
+       'user_id'])
+df_staff_master_final = select_columns(df_staff_persons,
     ['staff_id', 'tenant_id', 'alternate_id', 'bus_dropoff', 'bus_no',
        'bus_pickup', 'country_of_birth', 'created_by', 'created_on',
        'disability_description', 'district_id', 'dob', 'emergency_email',
@@ -444,20 +552,31 @@ df_staff_master_final = df_staff_not_already_loaded[
        'school_email', 'school_id', 'second_language',
        'social_security_number', 'staff_guid', 'staff_internal_id',
        'staff_photo', 'staff_thumbnail_photo', 'state_id', 'suffix',
-       'third_language', 'twitter', 'updated_by', 'updated_on', 'youtube']]
-df_staff_school_info_final = df_staff_not_already_loaded[
+       'third_language', 'twitter', 'updated_by', 'updated_on', 'youtube'])
+df_staff_school_info_final = select_columns(df_staff_not_already_loaded,
     ['created_by', 'created_on', 'end_date', 'membership_id', 'profile2',
        'school_attached_id', 'school_attached_name', 'school_id', 'staff_id',
-       'start_date', 'tenant_id', 'updated_by', 'updated_on']]
+       'start_date', 'tenant_id', 'updated_by', 'updated_on'])
 
 df_staff_master_final = df_staff_master_final.rename(columns={'profile1': 'profile'})
 df_staff_school_info_final = df_staff_school_info_final.rename(columns={'profile2': 'profile'})
+# with the new schools of the teachers already in the SIS
+df_staff_school_info_final = pd.concat([df_staff_school_info_final, select_columns(df_staff_attachments, list(df_staff_school_info_final.columns))], ignore_index=True)
+
+if sis_arrow_dtypes:
+    df_user_master_final = compact(df_user_master_final)
+    df_staff_master_final = compact(df_staff_master_final)
+    df_staff_school_info_final = compact(df_staff_school_info_final)
 
 print("All the final DataFrames")
 display(df_user_master_final)
 display(df_staff_master_final)
 display(df_staff_school_info_final)
 
+print("Memory footprint of the staff pipeline")
+memory_report({'df_staff_emis': df_staff_emis, 'df_staff_sis': df_staff_sis, 'df_staff_not_already_loaded': df_staff_not_already_loaded,
+               'df_user_master_final': df_user_master_final, 'df_staff_master_final': df_staff_master_final, 'df_staff_school_info_final': df_staff_school_info_final})
+
 # %%
 # %%time
 
@@ -488,13 +607,13 @@ else:
 
 # Load all data into the database
 if sis_load_data_to_sql == True:
-    with mysql_engine.begin() as conn:        
-        print("Loading user_master with all final data")
-        df_user_master_final.to_sql('user_master', con=conn, index=False, if_exists='append')
-        print("Loading staff_master with all final data")
-        df_staff_master_final.to_sql('staff_master', con=conn, index=False, if_exists='append')
-        print("Loading staff_school_info with all final data")
-        df_staff_school_info_final.to_sql('staff_school_info', con=conn, index=False, if_exists='append')
+    print("Loading user_master, staff_master and staff_school_info with all final data")
+    # All records of a teacher carry its primary school_id so they are committed together
+    load_in_chunks(mysql_engine, {
+        'user_master': df_user_master_final,
+        'staff_master': df_staff_master_final,
+        'staff_school_info': df_staff_school_info_final,
+    }, CheckpointJournal.for_load(config, 'sync-staff'), schools_per_chunk=sis_load_schools_per_chunk, bulk=sis_bulk_load)
         
     print("All staff imported successfully")
 else:
@@ -23,20 +23,28 @@
 
 # Core stuff
 import os
-import json
 import datetime as dt
 
 # Data stuff
 import pandas as pd # Data analysis
 import numpy as np
-import xlrd # excel 
-import pyodbc # SQL DB
-from sqlalchemy.engine import URL
-from sqlalchemy import create_engine
 import sqlalchemy as sa
-import uuid
+# Sync tools
+from pacific_sis.runtime import load_config, emis_engine, sis_engine
+from pacific_sis.artifacts import ArtifactStore
+from pacific_sis.templates import load_templates
+from pacific_sis.checkpoint import CheckpointJournal, load_in_chunks
+from pacific_sis.memory import arrow_strings, constant_column, compact, memory_report
+from pacific_sis.engines import transform_engine
+from pacific_sis.matching import match_students, match_keys
+from pacific_sis.crosswalk import crosswalk_exists, ensure_crosswalk, crosswalk_students, crosswalk_records
+from pacific_sis.guids import make_guids, existing_guids
+from pacific_sis.schoolyear import school_year_dates
+from pacific_sis.backfill import StudentEnrollmentBackfill
+from pacific_sis.changes import diff_matched, summarize_changes, apply_changes
+from pacific_sis.deactivation import deactivate_missing_students
 # Pretty printing stuff
-from IPython.display import display, HTML
+from pacific_sis.runtime import display, HTML
 import pprint
 pp = pprint.PrettyPrinter(indent=4)
 
@@ -44,8 +52,7 @@ pp = pprint.PrettyPrinter(indent=4)
 cwd = os.getcwd()
 
 # Configuration
-with open('config.json', 'r') as file:
-     config = json.load(file)
+config = load_config()
         
 # EMIS config
 emis_lookup = config['emis_lookup']
@@ -58,27 +65,43 @@ sis_user_guid = config['sis_user_guid']
 sis_country = config['sis_country']
 sis_export_data_to_excel = config['sis_export_data_to_excel']
 sis_load_data_to_sql = config['sis_load_data_to_sql']
+# Loads are committed this many schools at a time (and resumed from there if interrupted)
+sis_load_schools_per_chunk = config.get('sis_load_schools_per_chunk', 10)
+# Large initial loads: primary key order, no session checks (foreign keys checked before each commit)
+sis_bulk_load = config.get('sis_bulk_load', False)
+# Arrow backed strings for the extracted data and categoricals for the repeated values of the final frames
+sis_arrow_dtypes = config.get('sis_arrow_dtypes', False)
+# 'pandas', 'duckdb' or 'polars' to do the matching, the numbering of the new records and the final projections
+sis_transform_engine = config.get('sis_transform_engine', 'pandas')
+# Also compute every step of another engine with pandas and stop on any difference
+sis_transform_parity_check = config.get('sis_transform_parity_check', False)
+transform = transform_engine(sis_transform_engine, sis_transform_parity_check)
+# Derive the GUIDs of new records from the EMIS keys (UUIDv5) instead of random ones
+sis_deterministic_guids = config.get('sis_deterministic_guids', False)
+# 'pandas' downloads all the SIS students to find the new ones, 'server' uploads the EMIS keys and lets MySQL do it
+sis_student_match_mode = config.get('sis_student_match_mode', 'pandas')
+# Match the students on their EMIS stuID through the emis_student_crosswalk table first (names and DoB only as a fallback)
+sis_student_crosswalk = config.get('sis_student_crosswalk', False)
+sis_school_year_start_date, sis_school_year_end_date = school_year_dates(emis_school_year, config)
+# Past EMIS school years to backfill student enrollments for (e.g. [2014, 2015, ...])
+student_backfill_years = config.get('student_backfill_years', [])
+# Deactivate the SIS students no longer enrolled in the EMIS (otherwise only counted)
+sis_deactivate_missing_students = config.get('sis_deactivate_missing_students', False)
+sis_deactivation_exit_code = config.get('sis_deactivation_exit_code', 'Dropped Out')
 
 # Config
 country = config['country']
 datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-# MS SQL Server connection
-mssql_connection_string = """
-    Driver={{ODBC Driver 17 for SQL Server}};
-    Server={},{};
-    Database={};
-    authentication=SqlPassword;UID={};PWD={};
-    TrustServerCertificate=yes;
-    autocommit=True
-    """.format(config['emis_server_ip'], config['emis_server_port'], config['emis_database'], config['emis_uid'], config['emis_pwd'])
+# Artifacts shared between notebooks (e.g. schools_sis_map)
+artifacts = ArtifactStore.from_config(config, producer='sync-student')
+artifact_max_age_hours = config.get('artifact_max_age_hours')
 
-mssql_connection_url = URL.create("mssql+pyodbc", query={"odbc_connect": mssql_connection_string})
-mssql_engine = create_engine(mssql_connection_url)
+# MS SQL Server connection (created when first used)
+mssql_engine = emis_engine(config)
 
-# MySQL Connection
-mysql_connection_string = "mysql+mysqlconnector://"+config['sis_user']+":"+config['sis_pwd']+"@"+config['sis_host']+":"+config['sis_server_port']+"/"+config['sis_database']
-mysql_engine = create_engine(mysql_connection_string)
+# MySQL Connection (created when first used)
+mysql_engine = sis_engine(config)
 
 print("Retrieving settings and creating database connections")
 
@@ -130,9 +153,9 @@ with mysql_engine.begin() as conn:
     display(df_calender_id_sis)
     calender_sis_map = pd.Series(df_calender_id_sis.calender_id.values,index=df_calender_id_sis.school_id).to_dict()
     
-# Retrieve our list of schools missing from SIS    
-# %store -r schools_sis_map
-# %store -r countries_sis_map
+# Retrieve the SIS school and country mappings (published by sync-staff)
+schools_sis_map = artifacts.read_map('schools_sis_map', max_age_hours=artifact_max_age_hours)
+countries_sis_map = artifacts.read_map('countries_sis_map', max_age_hours=artifact_max_age_hours)
     
 # Here we create "template" DataFrames for all the tables of interest.
 # They start empty and will later on be populated with data and loaded directly into the SQL DB
@@ -154,17 +177,16 @@ templates = {
     'student_enrollment': {'query': query_student_enrollment, 'sql_table': 'student_enrollment', 'df_name': None},
 }
 
-with mysql_engine.begin() as conn:
-    for k,template in templates.items():    
-        df = pd.read_sql_query(sa.text(template['query']), conn)    
-        template['df'] = df
-        print("{} with {} records".format(template['sql_table'], template['df'].shape[0]))
-        display(template['df'].head(3))
+templates = load_templates(mysql_engine, templates)
+for k,template in templates.items():
+    print("{} with {} records".format(template['sql_table'], template['df'].shape[0]))
+    display(template['df'].head(3))
 
 # %%
 # Here we'll extract from the EMIS all the student most recent enrollments
 query_student_emis = """
-SELECT stuCardID
+SELECT S.stuID
+	,stuCardID
 	,stuGiven
 	,stuMiddleNames
 	,stuFamilyName
@@ -189,21 +211,39 @@ ORDER BY schNo, stueClass;
 
 # and student already in SIS
 
+student_sis_columns = ['school_id', 'student_id', 'student_internal_id', 'alternate_id', 'first_given_name', 'middle_name', 'last_family_name', 'dob', 'gender', 'race', 'ethnicity', 'country_of_birth', 'nationality', 'special_education_indicator', 'enrollment_type', 'is_active']
 query_student_sis = """
-SELECT `school_id`, `student_id`, `student_internal_id`, `alternate_id`, `first_given_name`, `middle_name`, `last_family_name`, `dob`, `gender`, `race`, `ethnicity`, `country_of_birth`, `nationality`, `special_education_indicator`, `enrollment_type`, `is_active`
+SELECT {}
 FROM student_master
 WHERE tenant_id = '{}';
+""".format(', '.join('`{}`'.format(c) for c in student_sis_columns), sis_tenant_id)
+
+# and their current (active) enrollment
+query_student_enrollment_sis = """
+SELECT `school_id`, `student_id`, `enrollment_id`, `grade_id`, `grade_level_title`
+FROM student_enrollment
+WHERE tenant_id = '{}' AND is_active = 1
+ORDER BY `school_id`, `student_id`, `enrollment_id`;
 """.format(sis_tenant_id)
 
 with mssql_engine.begin() as conn:
     df_student_emis = pd.read_sql_query(sa.text(query_student_emis), conn)
+    if sis_arrow_dtypes:
+        df_student_emis = arrow_strings(df_student_emis)
     print("EMIS students")
     display(df_student_emis)
     
 with mysql_engine.begin() as conn:
-    df_student_sis = pd.read_sql_query(sa.text(query_student_sis), conn)
-    print("SIS students")
-    display(df_student_sis)    
+    if sis_student_match_mode != 'server':
+        df_student_sis = pd.read_sql_query(sa.text(query_student_sis), conn)
+        if sis_arrow_dtypes:
+            df_student_sis = arrow_strings(df_student_sis)
+        print("SIS students")
+        display(df_student_sis)    
+    df_student_enrollment_sis = pd.read_sql_query(sa.text(query_student_enrollment_sis), conn)
+    df_student_enrollment_sis = df_student_enrollment_sis.drop_duplicates(subset=['school_id', 'student_id'], keep='last')
+    print("SIS students current enrollments")
+    display(df_student_enrollment_sis)
 
 # %%
 # View all the columns
@@ -240,13 +280,34 @@ display(df_student_emis)
 
 df_student_emis = df_student_emis.copy()
 
+# Students already in the crosswalk are matched on their EMIS stuID (created and backfilled from the
+# stuCardID on the first loading run), only the others are matched on names and date of birth below
+df_student_crosswalk = pd.DataFrame(columns=['emis_stu_id'] + student_sis_columns)
+if sis_student_crosswalk:
+    if sis_load_data_to_sql == True:
+        ensure_crosswalk(mysql_engine, df_student_emis['stuID'], df_student_emis['alternate_id'], sis_tenant_id, datetime)
+    if crosswalk_exists(mysql_engine):
+        df_student_crosswalk = crosswalk_students(mysql_engine, df_student_emis['stuID'], sis_tenant_id, student_sis_columns)
+    else:
+        print("No crosswalk in the SIS yet (created on the first run loading data), matching on names only")
+student_in_crosswalk = df_student_emis['stuID'].astype(str).str.strip().isin(df_student_crosswalk['emis_stu_id'])
+print("EMIS students found in the crosswalk: {} of {}".format(student_in_crosswalk.sum(), len(df_student_emis)))
+df_student_emis_unmatched = df_student_emis[~student_in_crosswalk]
+
 # The below is a better more general solution to the problem at hand than the simpler merge and isin solution
 # See https://stackoverflow.com/questions/28901683/pandas-get-rows-which-are-not-in-other-dataframe
 # When using all first name, last name and DoB a few hundreds students additional are loaded that would otherwise be removed from the dataframe...better.
-df_student_all = df_student_emis.merge(df_student_sis[['first_given_name','last_family_name','dob']].drop_duplicates(), on=['first_given_name','last_family_name','dob'], how='left', indicator=True)
+if sis_student_match_mode == 'server':
+    # Only the EMIS keys go to MySQL and only the missing ones (and the SIS students with the same stuCardID) come back
+    student_missing, df_student_sis = match_students(mysql_engine, df_student_emis_unmatched, sis_tenant_id, student_sis_columns)
+    df_student_all = df_student_emis_unmatched.assign(_merge=student_missing.map({True: 'left_only', False: 'both'}))
+else:
+    # Names compared case insensitively like the server does (see pacific_sis.matching)
+    df_student_all = df_student_emis_unmatched.assign(_merge=transform.match(match_keys(df_student_emis_unmatched), match_keys(df_student_sis), ['first_given_name','last_family_name','dob']))
 print("EMIS and SIS merged")
 display(df_student_all)
 
+df_student_all = pd.concat([df_student_emis[student_in_crosswalk].assign(_merge='both'), df_student_all], ignore_index=True)
 df_student_already_loaded = df_student_all[(df_student_all['_merge'] == 'both')]
 print("Student in EMIS already in SIS")
 display(df_student_already_loaded)
@@ -255,6 +316,52 @@ df_student_not_already_loaded = df_student_all[(df_student_all['_merge'] == 'lef
 print("Student in EMIS not in SIS")
 display(df_student_not_already_loaded)
 
+# %%
+# Changes in the EMIS for students already in SIS (grade, special education and demographics).
+# Matched on the EMIS stuCardID (alternate_id in SIS) so corrected names and date of birth are
+# caught too. Only the changed columns are then updated (see the load cell below).
+
+student_master_update_columns = ['first_given_name', 'middle_name', 'last_family_name', 'dob', 'gender', 'ethnicity', 'special_education_indicator']
+student_enrollment_update_columns = ['grade_id', 'grade_level_title']
+
+# Students in the crosswalk are matched on their stuID, the others on their stuCardID
+df_student_emis_xw = df_student_emis[student_in_crosswalk].assign(emis_stu_id=df_student_emis['stuID'].astype(str).str.strip())
+df_student_emis_xw = df_student_emis_xw.drop_duplicates(subset=['emis_stu_id'], keep=False)
+df_student_emis_xw = df_student_emis_xw.merge(df_student_crosswalk[['emis_stu_id', 'school_id', 'student_id']], on='emis_stu_id', how='inner').drop(columns=['emis_stu_id'])
+
+# Students with an ambiguous stuCardID on either side can't be safely matched
+df_student_emis_cmp = df_student_emis_unmatched.dropna(subset=['alternate_id']).drop_duplicates(subset=['alternate_id'], keep=False).copy()
+df_student_sis_cmp = df_student_sis.dropna(subset=['alternate_id']).drop_duplicates(subset=['alternate_id'], keep=False).copy()
+df_student_emis_cmp = df_student_emis_cmp.merge(df_student_sis_cmp[['alternate_id', 'school_id', 'student_id']], on='alternate_id', how='inner')
+student_card_ids_matched = df_student_emis_cmp['alternate_id']
+df_student_emis_cmp = pd.concat([df_student_emis_xw, df_student_emis_cmp], ignore_index=True).drop_duplicates(subset=['school_id', 'student_id'], keep=False)
+df_student_sis_cmp = pd.concat([df_student_crosswalk[student_sis_columns], df_student_sis_cmp], ignore_index=True).drop_duplicates(subset=['school_id', 'student_id'])
+
+# Same representation on both sides before comparing
+for df in [df_student_emis_cmp, df_student_sis_cmp]:
+    df['dob'] = pd.to_datetime(df['dob'], errors='coerce').dt.strftime('%Y-%m-%d')
+    df['special_education_indicator'] = pd.to_numeric(df['special_education_indicator'], errors='coerce')
+
+df_student_master_changes = diff_matched(df_student_emis_cmp, df_student_sis_cmp, ['school_id', 'student_id'], student_master_update_columns)
+print("Students already in SIS with changes in EMIS: {}".format(summarize_changes(df_student_master_changes, student_master_update_columns)))
+display(df_student_master_changes)
+
+df_student_emis_cmp['school_grade_val'] = df_student_emis_cmp['school_id'].apply(str) + '-' + df_student_emis_cmp['stueClass']
+df_student_emis_cmp['grade_id'] = df_student_emis_cmp['school_grade_val'].map(gradelevels_sis_map)
+df_student_emis_cmp['grade_level_title'] = df_student_emis_cmp['school_grade_val'].map(gradelevels_title_sis_map)
+df_student_emis_cmp = df_student_emis_cmp.merge(df_student_enrollment_sis[['school_id', 'student_id', 'enrollment_id']], on=['school_id', 'student_id'], how='inner')
+
+df_student_enrollment_changes = diff_matched(df_student_emis_cmp, df_student_enrollment_sis, ['school_id', 'student_id', 'enrollment_id'], student_enrollment_update_columns)
+print("Student enrollments already in SIS with a grade change in EMIS: {}".format(summarize_changes(df_student_enrollment_changes, student_enrollment_update_columns)))
+display(df_student_enrollment_changes)
+
+# Students whose names or date of birth were corrected in the EMIS are not matched on those above
+# but are on their stuCardID here, they are updated and must not be inserted again
+student_matched_on_card = df_student_not_already_loaded['alternate_id'].isin(student_card_ids_matched)
+print("EMIS students not matched on names and date of birth but on stuCardID (updated, not inserted): {}".format(student_matched_on_card.sum()))
+display(df_student_not_already_loaded[student_matched_on_card])
+df_student_not_already_loaded = df_student_not_already_loaded[~student_matched_on_card]
+
 # %%
 df_student_not_already_loaded = df_student_not_already_loaded.copy()
 
@@ -266,115 +373,122 @@ display(df_student_not_already_loaded[df_student_not_already_loaded.duplicated(s
 
 # Create all the missing columns/data
 
+# The constant columns are categoricals (one byte per row) when the strings are Arrow backed
+def constant(value):
+    return constant_column(df_student_not_already_loaded.index, value, sis_arrow_dtypes)
+
 df_student_not_already_loaded['school_id'] = df_student_not_already_loaded['school_name'].map(schools_sis_map)
-df_student_not_already_loaded['tenant_id'] = sis_tenant_id
-df_student_not_already_loaded['admission_number'] = np.NaN
-df_student_not_already_loaded['alert_description'] = np.NaN
-df_student_not_already_loaded['associationship'] = np.NaN
-df_student_not_already_loaded['bus_no'] = np.NaN
+df_student_not_already_loaded['tenant_id'] = constant(sis_tenant_id)
+df_student_not_already_loaded['admission_number'] = constant(np.nan)
+df_student_not_already_loaded['alert_description'] = constant(np.nan)
+df_student_not_already_loaded['associationship'] = constant(np.nan)
+df_student_not_already_loaded['bus_no'] = constant(np.nan)
 #df_student_not_already_loaded['country_of_birth'] = df_student_not_already_loaded['schName'].map(countries_sis_map)
-df_student_not_already_loaded['country_of_birth'] = np.NaN
-df_student_not_already_loaded['created_by'] = sis_user_guid
-df_student_not_already_loaded['created_on'] = datetime
-df_student_not_already_loaded['critical_alert'] = np.NaN
-df_student_not_already_loaded['dentist'] = np.NaN
-df_student_not_already_loaded['dentist_phone'] = np.NaN
-df_student_not_already_loaded['district_id'] = np.NaN
-df_student_not_already_loaded['economic_disadvantage'] = np.NaN	
-df_student_not_already_loaded['eligibility_504'] = np.NaN
-df_student_not_already_loaded['enrollment_type'] = 'Internal'
-df_student_not_already_loaded['estimated_grad_date'] = np.NaN
+df_student_not_already_loaded['country_of_birth'] = constant(np.nan)
+df_student_not_already_loaded['created_by'] = constant(sis_user_guid)
+df_student_not_already_loaded['created_on'] = constant(datetime)
+df_student_not_already_loaded['critical_alert'] = constant(np.nan)
+df_student_not_already_loaded['dentist'] = constant(np.nan)
+df_student_not_already_loaded['dentist_phone'] = constant(np.nan)
+df_student_not_already_loaded['district_id'] = constant(np.nan)
+df_student_not_already_loaded['economic_disadvantage'] = constant(np.nan)
+df_student_not_already_loaded['eligibility_504'] = constant(np.nan)
+df_student_not_already_loaded['enrollment_type'] = constant('Internal')
+df_student_not_already_loaded['estimated_grad_date'] = constant(np.nan)
 # No need to map since the SIS stored the name and not the ID
 #df_student_not_already_loaded['ethnicity'] = df_student_not_already_loaded['ethnicity'].map(_sis_map)
-df_student_not_already_loaded['facebook'] = np.NaN
+df_student_not_already_loaded['facebook'] = constant(np.nan)
 #df_student_not_already_loaded['first_language_id'] = df_student_not_already_loaded['first_language'].map(_sis_map)
 #df_student_not_already_loaded['second_language_id'] = df_student_not_already_loaded['second_language'].map(_sis_map)
 #df_student_not_already_loaded['third_language_id'] = df_student_not_already_loaded['third_language'].map(_sis_map)
-df_student_not_already_loaded['first_language_id'] = np.NaN
-df_student_not_already_loaded['second_language_id'] = np.NaN
-df_student_not_already_loaded['third_language_id'] = np.NaN
-df_student_not_already_loaded['free_lunch_eligibility'] = np.NaN
-df_student_not_already_loaded['home_address_city'] = np.NaN
-df_student_not_already_loaded['home_address_country'] = np.NaN
-df_student_not_already_loaded['home_address_line_one'] = np.NaN
-df_student_not_already_loaded['home_address_line_two'] = np.NaN
-df_student_not_already_loaded['home_address_state'] = np.NaN
-df_student_not_already_loaded['home_address_zip'] = np.NaN
-df_student_not_already_loaded['home_phone'] = np.NaN
-df_student_not_already_loaded['instagram'] = np.NaN
-df_student_not_already_loaded['insurance_company'] = np.NaN
-df_student_not_already_loaded['insurance_company_phone'] = np.NaN
+df_student_not_already_loaded['first_language_id'] = constant(np.nan)
+df_student_not_already_loaded['second_language_id'] = constant(np.nan)
+df_student_not_already_loaded['third_language_id'] = constant(np.nan)
+df_student_not_already_loaded['free_lunch_eligibility'] = constant(np.nan)
+df_student_not_already_loaded['home_address_city'] = constant(np.nan)
+df_student_not_already_loaded['home_address_country'] = constant(np.nan)
+df_student_not_already_loaded['home_address_line_one'] = constant(np.nan)
+df_student_not_already_loaded['home_address_line_two'] = constant(np.nan)
+df_student_not_already_loaded['home_address_state'] = constant(np.nan)
+df_student_not_already_loaded['home_address_zip'] = constant(np.nan)
+df_student_not_already_loaded['home_phone'] = constant(np.nan)
+df_student_not_already_loaded['instagram'] = constant(np.nan)
+df_student_not_already_loaded['insurance_company'] = constant(np.nan)
+df_student_not_already_loaded['insurance_company_phone'] = constant(np.nan)
 df_student_not_already_loaded['is_active'] = 1
-df_student_not_already_loaded['lep_indicator'] = np.NaN
-df_student_not_already_loaded['linkedin'] = np.NaN
-df_student_not_already_loaded['mailing_address_city'] = np.NaN
-df_student_not_already_loaded['mailing_address_country'] = np.NaN
-df_student_not_already_loaded['mailing_address_line_one'] = np.NaN
-df_student_not_already_loaded['mailing_address_line_two'] = np.NaN
-df_student_not_already_loaded['mailing_address_same_to_home'] = np.NaN
-df_student_not_already_loaded['mailing_address_state'] = np.NaN
-df_student_not_already_loaded['mailing_address_zip'] = np.NaN
-df_student_not_already_loaded['marital_status'] = np.NaN
-df_student_not_already_loaded['medical_facility'] = np.NaN
-df_student_not_already_loaded['medical_facility_phone'] = np.NaN
-df_student_not_already_loaded['mobile_phone'] = np.NaN
+df_student_not_already_loaded['lep_indicator'] = constant(np.nan)
+df_student_not_already_loaded['linkedin'] = constant(np.nan)
+df_student_not_already_loaded['mailing_address_city'] = constant(np.nan)
+df_student_not_already_loaded['mailing_address_country'] = constant(np.nan)
+df_student_not_already_loaded['mailing_address_line_one'] = constant(np.nan)
+df_student_not_already_loaded['mailing_address_line_two'] = constant(np.nan)
+df_student_not_already_loaded['mailing_address_same_to_home'] = constant(np.nan)
+df_student_not_already_loaded['mailing_address_state'] = constant(np.nan)
+df_student_not_already_loaded['mailing_address_zip'] = constant(np.nan)
+df_student_not_already_loaded['marital_status'] = constant(np.nan)
+df_student_not_already_loaded['medical_facility'] = constant(np.nan)
+df_student_not_already_loaded['medical_facility_phone'] = constant(np.nan)
+df_student_not_already_loaded['mobile_phone'] = constant(np.nan)
 #df_student_not_already_loaded['nationality'] = df_student_not_already_loaded['nationality'].map(_sis_map)
-df_student_not_already_loaded['nationality'] = np.NaN
-df_student_not_already_loaded['other_govt_issued_number'] = np.NaN
-df_student_not_already_loaded['personal_email'] = np.NaN
-df_student_not_already_loaded['policy_holder'] = np.NaN
-df_student_not_already_loaded['policy_number'] = np.NaN
-df_student_not_already_loaded['preferred_name'] = np.NaN
-df_student_not_already_loaded['previous_name'] = np.NaN
-df_student_not_already_loaded['primary_care_physician'] = np.NaN
-df_student_not_already_loaded['primary_care_physician_phone'] = np.NaN
+df_student_not_already_loaded['nationality'] = constant(np.nan)
+df_student_not_already_loaded['other_govt_issued_number'] = constant(np.nan)
+df_student_not_already_loaded['personal_email'] = constant(np.nan)
+df_student_not_already_loaded['policy_holder'] = constant(np.nan)
+df_student_not_already_loaded['policy_number'] = constant(np.nan)
+df_student_not_already_loaded['preferred_name'] = constant(np.nan)
+df_student_not_already_loaded['previous_name'] = constant(np.nan)
+df_student_not_already_loaded['primary_care_physician'] = constant(np.nan)
+df_student_not_already_loaded['primary_care_physician_phone'] = constant(np.nan)
 #df_student_not_already_loaded['race'] = df_student_not_already_loaded['race'].map(_sis_map)
-df_student_not_already_loaded['race'] = np.NaN
-df_student_not_already_loaded['roll_number'] = np.NaN
-df_student_not_already_loaded['salutation'] = np.NaN
-df_student_not_already_loaded['school_bus_drop_off'] = np.NaN
-df_student_not_already_loaded['school_bus_pick_up'] = np.NaN
-df_student_not_already_loaded['school_email'] = np.NaN
-df_student_not_already_loaded['second_language_id'] = np.NaN
-df_student_not_already_loaded['section_id'] = np.NaN
-df_student_not_already_loaded['social_security_number'] = np.NaN
-df_student_not_already_loaded['state_id'] = np.NaN
-df_student_not_already_loaded['student_guid'] = [str(uuid.uuid4()) for _ in range(len(df_student_not_already_loaded.index))]
+df_student_not_already_loaded['race'] = constant(np.nan)
+df_student_not_already_loaded['roll_number'] = constant(np.nan)
+df_student_not_already_loaded['salutation'] = constant(np.nan)
+df_student_not_already_loaded['school_bus_drop_off'] = constant(np.nan)
+df_student_not_already_loaded['school_bus_pick_up'] = constant(np.nan)
+df_student_not_already_loaded['school_email'] = constant(np.nan)
+df_student_not_already_loaded['second_language_id'] = constant(np.nan)
+df_student_not_already_loaded['section_id'] = constant(np.nan)
+df_student_not_already_loaded['social_security_number'] = constant(np.nan)
+df_student_not_already_loaded['state_id'] = constant(np.nan)
+df_student_not_already_loaded['student_guid'] = make_guids(df_student_not_already_loaded['alternate_id'], sis_tenant_id, 'student', sis_deterministic_guids)
+if sis_deterministic_guids:
+    # Students of a previous partially applied load are recognized by their GUID
+    student_guids_loaded = existing_guids(mysql_engine, 'student_master', 'student_guid', df_student_not_already_loaded['student_guid'], sis_tenant_id)
+    print("Students already loaded by a previous run (same GUID): {}".format(len(student_guids_loaded)))
+    df_student_not_already_loaded = df_student_not_already_loaded[~df_student_not_already_loaded['student_guid'].isin(student_guids_loaded)].copy()
 df_student_not_already_loaded['student_internal_id'] = df_student_not_already_loaded['alternate_id']
-df_student_not_already_loaded['student_photo'] = np.NaN
-df_student_not_already_loaded['student_portal_id'] = np.NaN
-df_student_not_already_loaded['student_thumbnail_photo'] = np.NaN
-df_student_not_already_loaded['suffix'] = np.NaN
-df_student_not_already_loaded['twitter'] = np.NaN
-df_student_not_already_loaded['updated_by'] = sis_user_guid
-df_student_not_already_loaded['updated_on'] = datetime                              
-df_student_not_already_loaded['vision'] = np.NaN
-df_student_not_already_loaded['vision_phone'] = np.NaN
-df_student_not_already_loaded['youtube'] = np.NaN
+df_student_not_already_loaded['student_photo'] = constant(np.nan)
+df_student_not_already_loaded['student_portal_id'] = constant(np.nan)
+df_student_not_already_loaded['student_thumbnail_photo'] = constant(np.nan)
+df_student_not_already_loaded['suffix'] = constant(np.nan)
+df_student_not_already_loaded['twitter'] = constant(np.nan)
+df_student_not_already_loaded['updated_by'] = constant(sis_user_guid)
+df_student_not_already_loaded['updated_on'] = constant(datetime)
+df_student_not_already_loaded['vision'] = constant(np.nan)
+df_student_not_already_loaded['vision_phone'] = constant(np.nan)
+df_student_not_already_loaded['youtube'] = constant(np.nan)
 
 # Now student_enrollment data
 df_student_not_already_loaded['enrollment_id'] = 1
 df_student_not_already_loaded['calender_id'] = df_student_not_already_loaded['school_id'].map(calender_sis_map)
-df_student_not_already_loaded['enrollment_code'] = 'New'
-df_student_not_already_loaded['enrollment_date'] = '2022-09-01'
-df_student_not_already_loaded['exit_code'] = np.NaN
-df_student_not_already_loaded['exit_date'] = np.NaN
+df_student_not_already_loaded['enrollment_code'] = constant('New')
+df_student_not_already_loaded['enrollment_date'] = constant(sis_school_year_start_date)
+df_student_not_already_loaded['exit_code'] = constant(np.nan)
+df_student_not_already_loaded['exit_date'] = constant(np.nan)
 
 # Grades
 df_student_not_already_loaded['school_grade_val'] = df_student_not_already_loaded['school_id'].apply(str) + '-' + df_student_not_already_loaded['stueClass']
 df_student_not_already_loaded['grade_id'] = df_student_not_already_loaded['school_grade_val'].map(gradelevels_sis_map)
 df_student_not_already_loaded['grade_level_title'] = df_student_not_already_loaded['school_grade_val'].map(gradelevels_title_sis_map)
-df_student_not_already_loaded['rolling_option'] = 'Next grade at current school'
-df_student_not_already_loaded['rollover_id'] = np.NaN
-df_student_not_already_loaded['school_transferred'] = np.NaN
-df_student_not_already_loaded['transferred_grade'] = np.NaN
-df_student_not_already_loaded['transferred_school_id'] = np.NaN
+df_student_not_already_loaded['rolling_option'] = constant('Next grade at current school')
+df_student_not_already_loaded['rollover_id'] = constant(np.nan)
+df_student_not_already_loaded['school_transferred'] = constant(np.nan)
+df_student_not_already_loaded['transferred_grade'] = constant(np.nan)
+df_student_not_already_loaded['transferred_school_id'] = constant(np.nan)
 
 # Generate student_id
-df_student_not_already_loaded = df_student_not_already_loaded.merge(df_last_student_id[['school_id', 'last_student_id']], on='school_id', how='left', indicator='last_student_exists')
-df_student_not_already_loaded['last_student_id'] = df_student_not_already_loaded['last_student_id'].fillna(0)
-df_student_not_already_loaded['temp_id'] = df_student_not_already_loaded.groupby('school_id').cumcount()
-df_student_not_already_loaded['student_id'] = df_student_not_already_loaded['last_student_id'] + df_student_not_already_loaded['temp_id'] + 1
+# Numbered within each school after the school's last student_id
+df_student_not_already_loaded['student_id'] = transform.cumcount(df_student_not_already_loaded, 'school_id', df_last_student_id, 'last_student_id') + 1
 
 print("Student not already loaded in SIS")
 display(df_student_not_already_loaded)
@@ -382,7 +496,11 @@ display(df_student_not_already_loaded)
 # %%
 # Create the final DataFrames for loading the data
 
-df_student_master_final = df_student_not_already_loaded[
+def select_columns(df, columns):
+    """The columns of df to load (projected by the transform engine)"""
+    return transform.project(df, columns)
+
+df_student_master_final = select_columns(df_student_not_already_loaded,
     ['school_id', 'student_id', 'tenant_id', 'admission_number',
        'alert_description', 'alternate_id', 'associationship', 'bus_no',
        'country_of_birth', 'created_by', 'created_on', 'critical_alert',
@@ -408,19 +526,27 @@ df_student_master_final = df_student_not_already_loaded[
        'special_education_indicator', 'state_id', 'student_guid',
        'student_internal_id', 'student_photo', 'student_portal_id',
        'student_thumbnail_photo', 'suffix', 'third_language_id', 'twitter',
-       'updated_by', 'updated_on', 'vision', 'vision_phone', 'youtube']]
-df_student_enrollment_final = df_student_not_already_loaded[
+       'updated_by', 'updated_on', 'vision', 'vision_phone', 'youtube'])
+df_student_enrollment_final = select_columns(df_student_not_already_loaded,
     ['enrollment_id', 'school_id', 'student_id', 'tenant_id', 'calender_id',
        'created_by', 'created_on', 'enrollment_code', 'enrollment_date',
        'exit_code', 'exit_date', 'grade_id', 'grade_level_title', 'is_active',
        'rolling_option', 'rollover_id', 'school_name', 'school_transferred',
        'student_guid', 'transferred_grade', 'transferred_school_id',
-       'updated_by', 'updated_on']]
+       'updated_by', 'updated_on'])
+
+if sis_arrow_dtypes:
+    df_student_master_final = compact(df_student_master_final)
+    df_student_enrollment_final = compact(df_student_enrollment_final)
 
 print("All the final DataFrames")
 display(df_student_master_final)
 display(df_student_enrollment_final)
 
+print("Memory footprint of the student pipeline")
+memory_report({'df_student_emis': df_student_emis, 'df_student_sis': df_student_sis, 'df_student_not_already_loaded': df_student_not_already_loaded,
+               'df_student_master_final': df_student_master_final, 'df_student_enrollment_final': df_student_enrollment_final})
+
 # %%
 # %%time
 
@@ -449,14 +575,54 @@ else:
 
 # Load all data into the database
 if sis_load_data_to_sql == True:
-    with mysql_engine.begin() as conn:
-        print("Loading student_master with all final data")
-        df_student_master_final.to_sql('student_master', con=conn, index=False, if_exists='append')
-        print("Loading student_enrollment with all final data")
-        df_student_enrollment_final.to_sql('student_enrollment', con=conn, index=False, if_exists='append')
+    print("Loading student_master and student_enrollment with all final data")
+    student_frames = {
+        'student_master': df_student_master_final,
+        'student_enrollment': df_student_enrollment_final,
+    }
+    if sis_student_crosswalk:
+        # Committed with their students so the crosswalk never misses one
+        student_frames['emis_student_crosswalk'] = crosswalk_records(df_student_not_already_loaded, sis_tenant_id, datetime)
+    # The changes from EMIS are applied in the same transaction as the inserts of their school
+    student_updates = {
+        'student_master updated': (df_student_master_changes, lambda conn, df: apply_changes(
+            conn, 'student_master', df, ['school_id', 'student_id'], student_master_update_columns, sis_tenant_id, sis_user_guid, datetime)),
+        'student_enrollment updated': (df_student_enrollment_changes, lambda conn, df: apply_changes(
+            conn, 'student_enrollment', df, ['school_id', 'student_id', 'enrollment_id'], student_enrollment_update_columns, sis_tenant_id, sis_user_guid, datetime)),
+    }
+    loaded = load_in_chunks(mysql_engine, student_frames, CheckpointJournal.for_load(config, 'sync-student'),
+                            schools_per_chunk=sis_load_schools_per_chunk, bulk=sis_bulk_load, updates=student_updates)
+    print("{} student_master records updated".format(loaded['student_master updated']))
+    print("{} student_enrollment records updated".format(loaded['student_enrollment updated']))
         
     print("All student imported successfully")
 else:
     print("Not loading the data into SQL")
 
 # %%
+# %%time
+# Backfill the enrollments of past years for the students in the SIS (matched on the EMIS stuCardID).
+# Years are loaded in parallel, a transaction per chunk of the EMIS stream, and a rerun skips the
+# years already completed (see data/<country>/checkpoints/student-enrollment-backfill.json).
+# The enrollments of each student are then renumbered in chronological order.
+
+if sis_load_data_to_sql == True and len(student_backfill_years) > 0:
+    backfill = StudentEnrollmentBackfill(config, mssql_engine, mysql_engine, schools_sis_map, gradelevels_sis_map, gradelevels_title_sis_map, calender_sis_map)
+    backfilled = backfill.run([y for y in student_backfill_years if y < emis_school_year])
+    print("Historical student enrollments loaded: {}".format(backfilled))
+else:
+    print("Not backfilling historical student enrollments")
+
+# %%
+# %%time
+# Students still active in the SIS but not enrolled in the EMIS this year (graduated, transferred
+# abroad, dropped out, etc.) are found by the database and deactivated a few schools at a time.
+# Without sis_deactivate_missing_students this is only a dry run counting them.
+
+dry_run = not (sis_load_data_to_sql == True and sis_deactivate_missing_students == True)
+df_students_to_deactivate = deactivate_missing_students(mysql_engine, df_student_emis['alternate_id'], sis_tenant_id, sis_user_guid, datetime,
+                                                        sis_deactivation_exit_code, dt.date.today().isoformat(), dry_run=dry_run)
+print("SIS students to deactivate by schools{}".format(" (dry run)" if dry_run else ""))
+display(df_students_to_deactivate)
+
+# %%
@@ -20,26 +20,27 @@
 # producing a default configuration for subjects. This is not based on the    #
 # EMIS as such granular attendance feature is only found in the SIS           #
 #                                                                             #
-# WARNING - this depends on a bit of hard coded value and must be done in     #
-# coordination with the script subjects-cleanup.sql                           #
+# The subjects of the template school (sis_template_school_id) are cloned     #
+# to all the schools without subjects for the current academic year           #
 ###############################################################################
 
 # Core stuff
 import os
-import json
 import datetime as dt
 
 # Data stuff
 import pandas as pd # Data analysis
 import numpy as np
-import xlrd # excel 
-import pyodbc # SQL DB
-from sqlalchemy.engine import URL
-from sqlalchemy import create_engine
 import sqlalchemy as sa
 import uuid
+# Sync tools
+from pacific_sis.runtime import load_config, emis_engine, sis_engine
+from pacific_sis.templates import load_templates
+from pacific_sis.checkpoint import CheckpointJournal, load_in_chunks
+from pacific_sis.schoolyear import academic_year
+from pacific_sis.cloning import schools_without, clone_template
 # Pretty printing stuff
-from IPython.display import display, HTML
+from pacific_sis.runtime import display, HTML
 import pprint
 pp = pprint.PrettyPrinter(indent=4)
 
@@ -47,8 +48,7 @@ pp = pprint.PrettyPrinter(indent=4)
 cwd = os.getcwd()
 
 # Configuration
-with open('config.json', 'r') as file:
-     config = json.load(file)
+config = load_config()
         
 # EMIS config
 emis_lookup = config['emis_lookup']
@@ -61,130 +61,66 @@ sis_user_guid = config['sis_user_guid']
 sis_country = config['sis_country']
 sis_export_data_to_excel = config['sis_export_data_to_excel']
 sis_load_data_to_sql = config['sis_load_data_to_sql']
+# Loads are committed this many schools at a time (and resumed from there if interrupted)
+sis_load_schools_per_chunk = config.get('sis_load_schools_per_chunk', 10)
+# Large initial loads: primary key order, no session checks (foreign keys checked before each commit)
+sis_bulk_load = config.get('sis_bulk_load', False)
+# The school whose configuration is cloned to the other schools
+sis_template_school_id = config.get('sis_template_school_id', 115)
+# The SIS academic year of the EMIS school year
+sis_academic_year = academic_year(emis_school_year, config)
 
 # Config
 country = config['country']
 datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-# MS SQL Server connection
-mssql_connection_string = """
-    Driver={{ODBC Driver 17 for SQL Server}};
-    Server={},{};
-    Database={};
-    authentication=SqlPassword;UID={};PWD={};
-    TrustServerCertificate=yes;
-    autocommit=True
-    """.format(config['emis_server_ip'], config['emis_server_port'], config['emis_database'], config['emis_uid'], config['emis_pwd'])
+# MS SQL Server connection (created when first used)
+mssql_engine = emis_engine(config)
 
-mssql_connection_url = URL.create("mssql+pyodbc", query={"odbc_connect": mssql_connection_string})
-mssql_engine = create_engine(mssql_connection_url)
-
-# MySQL Connection
-mysql_connection_string = "mysql+mysqlconnector://"+config['sis_user']+":"+config['sis_pwd']+"@"+config['sis_host']+":"+config['sis_server_port']+"/"+config['sis_database']
-mysql_engine = create_engine(mysql_connection_string)
+# MySQL Connection (created when first used)
+mysql_engine = sis_engine(config)
 
 print("Retrieving settings and creating database connections")
 
 # %%
 # Get some auxilairy data (mappings, next IDs, templates, etc.)
 
-# Get the schools with no configured subject
-# Hard coded stuff to get this working in a quick and dirty way
-query_schools_with_no_subject_sis = """
-SELECT school_id FROM school_master WHERE 
-school_id NOT IN (26,27,28,40,41,42,43,44,45,46,47)
-AND
-tenant_id = '{}';
-""".format(sis_tenant_id, sis_tenant_id)
-
-# All school_ids in SIS with previous year subjects
-query_schools_with_subject_sis = """
-SELECT school_id FROM school_master WHERE tenant_id = '{}' AND school_id IN (26,27,28,40,41,42,43,44,45,46,47);
-""".format(sis_tenant_id)
-
-with mysql_engine.begin() as conn:
-    df_schools_with_no_subject_sis = pd.read_sql_query(sa.text(query_schools_with_no_subject_sis), conn)
-    print("Schools with no subject configured")
-    display(df_schools_with_no_subject_sis)
-    df_schools_with_subject_sis = pd.read_sql_query(sa.text(query_schools_with_subject_sis), conn)
-    print("Schools with subject configured previous year")
-    display(df_schools_with_subject_sis)    
+# Get the schools with no configured subject for the academic year
+df_schools_with_no_subject_sis = schools_without(mysql_engine, 'subject', sis_tenant_id, where='AND t.academic_year = {}'.format(sis_academic_year))
+print("Schools with no subject configured for academic year {}".format(sis_academic_year))
+display(df_schools_with_no_subject_sis)
     
 # Here we create "template" DataFrames for all the tables of interest.
 # They start empty and will later on be populated with data and loaded directly into the SQL DB
-# There is some hard coded shit here (I needed something extremely quick and dirty)
-# template for all remaining schools
+# The template is the most recent subjects of the template school
 query_subjects = """
 SELECT `tenant_id`, `school_id`, `subject_id`, `subject_name`, `created_by`, `created_on`, `updated_by`, `updated_on`, `academic_year`, `rollover_id`
 FROM `subject`
-WHERE `academic_year` = 2021
-""".format(sis_tenant_id)
-
-# template for schools with records also in previous year
-query_subjects2 = """
-SELECT `tenant_id`, `school_id`, `subject_id`, `subject_name`, `created_by`, `created_on`, `updated_by`, `updated_on`, `academic_year`, `rollover_id`
-FROM `subject`
-""".format(sis_tenant_id)
+WHERE tenant_id = '{}' AND school_id = {} AND `academic_year` = (
+    SELECT MAX(`academic_year`) FROM `subject` WHERE tenant_id = '{}' AND school_id = {}
+);
+""".format(sis_tenant_id, sis_template_school_id, sis_tenant_id, sis_template_school_id)
 
 templates = {
     'subject': {'query': query_subjects, 'sql_table': 'subject', 'df_name': None},
-    'subject2': {'query': query_subjects2, 'sql_table': 'subject', 'df_name': None},
 }
 
-with mysql_engine.begin() as conn:
-    for k,template in templates.items():    
-        df = pd.read_sql_query(sa.text(template['query']), conn)    
-        template['df'] = df
-        print("{} with {} records".format(template['sql_table'], template['df'].shape[0]))
-        display(template['df'].head(3))
+templates = load_templates(mysql_engine, templates)
+for k,template in templates.items():
+    print("{} with {} records".format(template['sql_table'], template['df'].shape[0]))
+    display(template['df'].head(3))
 
 # %%
-# Schools that had subjects in previous year. So create two sets
-# 26,27,28,40,41,42,43,44,45,46,47
-
-template_school_id = templates['subject2']['df']['school_id'].unique()[0]
 school_ids_no_subject = df_schools_with_no_subject_sis['school_id'].values
-school_ids_with_subject = [26,27,28,40,41,42,43,44,45,46,47] #df_schools_sis['school_id'].values
 schools_num_no_subject = len(school_ids_no_subject)
-schools_num_with_subject = len(school_ids_with_subject)
 print("Number of schools without subject configuration: {}".format(schools_num_no_subject))
-print("Number of schools with subject in previous year configuration: {}".format(schools_num_with_subject))
 
-    
-# Prepare a dataset for all schools with no subject
-if schools_num_no_subject > 0:
-    ###############################################################################
-    # Prepare the subject DataFrame for all the schools using the template DataFrame
-    ###############################################################################
-    df_subjects_all = pd.concat([templates['subject']['df']]*schools_num_no_subject, ignore_index=True)
-    df_subjects_all['tenant_id'] = sis_tenant_id
-    df_school_ids = pd.DataFrame(data=df_schools_with_no_subject_sis['school_id'].repeat(6))
-    df_school_ids.reset_index(drop=True, inplace=True)
-    df_subjects_all['school_id'] = df_school_ids['school_id']    
-    df_subjects_all['created_by'] = sis_user_guid
-    df_subjects_all['created_on'] = datetime
-    df_subjects_all['academic_year'] = 2022
-    display(df_subjects_all)
-    
-# Prepare a dataset for schools already in the system (with previous year subjects)
-if schools_num_with_subject > 0:
-    ###############################################################################
-    # Prepare the subject DataFrame for all the schools using the template DataFrame
-    ###############################################################################
-    df_subjects2_all = pd.concat([templates['subject2']['df']]*schools_num_with_subject, ignore_index=True)
-    df_subjects2_all['tenant_id'] = sis_tenant_id
-    df_school_ids = pd.DataFrame(data=df_schools_with_subject_sis['school_id'].repeat(12))
-    df_school_ids.reset_index(drop=True, inplace=True)
-    df_subjects2_all['school_id'] = df_school_ids['school_id']    
-    df_subjects2_all['created_by'] = sis_user_guid
-    df_subjects2_all['created_on'] = datetime        
-    #df_subjects2_all.loc[df_subjects2_all['rollover_id'] == 1, 'academic_year'] = 2022
-    display(df_subjects2_all)
-    
-df_subjects_all = pd.concat([df_subjects2_all, df_subjects_all], ignore_index=True)
-
-# Drop rows already in the system (the ones used as template)
-df_subjects_all.drop(df_subjects_all[df_subjects_all.school_id == template_school_id].index, inplace=True)
+###############################################################################
+# Prepare the subject DataFrame for all the schools using the template DataFrame
+###############################################################################
+df_subjects_all = clone_template(templates['subject']['df'], df_schools_with_no_subject_sis[['school_id']],
+                                 overrides={'tenant_id': sis_tenant_id, 'created_by': sis_user_guid, 'created_on': datetime, 'academic_year': sis_academic_year})
+display(df_subjects_all)
 
 # %%
 # %%time
@@ -211,9 +147,9 @@ else:
 
 # Load all data into the database
 if sis_load_data_to_sql == True:
-    with mysql_engine.begin() as conn:
-        print("Loading subject with all final data")
-        df_subjects_all.to_sql('subject', con=conn, index=False, if_exists='append')        
+    print("Loading subject with all final data")
+    load_in_chunks(mysql_engine, {'subject': df_subjects_all},
+                   CheckpointJournal.for_load(config, 'sync-subjects'), schools_per_chunk=sis_load_schools_per_chunk, bulk=sis_bulk_load)
         
     print("All subject configuration imported successfully")
 else:
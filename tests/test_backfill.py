@@ -0,0 +1,40 @@
+"""Preparing the historical student enrollments of the backfill."""
+
+import warnings
+
+import pandas as pd
+import pytest
+
+from pacific_sis.backfill import StudentEnrollmentBackfill, student_enrollment_columns
+
+
+@pytest.fixture
+def backfill():
+    # The SIS state of _load_sis_state without a database
+    backfill = StudentEnrollmentBackfill.__new__(StudentEnrollmentBackfill)
+    backfill.config = {'sis_school_year_start': '09-01', 'sis_school_year_end': '06-30'}
+    backfill.tenant_id, backfill.user_guid = 'T', 'U'
+    backfill.schools_sis_map = {'School A': 1, 'School B': 2}
+    backfill.gradelevels_sis_map = {'1-G1': 11, '2-G2': 22}
+    backfill.gradelevels_title_sis_map = {'1-G1': 'Grade 1', '2-G2': 'Grade 2'}
+    backfill.calender_sis_map = {1: 100, 2: 200}
+    backfill.enrollment_code = backfill.exit_code = 'Rolled Over'
+    backfill.df_students = pd.DataFrame({'school_id': [1, 1, 2], 'student_id': [1, 2, 1], 'student_guid': ['g1', 'g2', 'g3'], 'alternate_id': ['C1', 'C2', 'C3']})
+    backfill.df_last_enrollment_id = pd.DataFrame({'school_id': [1, 1, 2], 'student_id': [1, 2, 1], 'last_enrollment_id': [1, 3, 1]})
+    # Student C3 already has its 2020 (2019-20) enrollment
+    backfill.df_enrollment_dates = pd.DataFrame({'school_id': [2], 'student_id': [1], 'enrollment_date': ['2019-09-01']})
+    return backfill
+
+
+def test_prepare(backfill):
+    df_emis = pd.DataFrame({'stuCardID': ['C1', 'C2', 'C3', 'C9'], 'schName': ['School A', 'School B', 'School B', 'School A'],
+                            'stueYear': 2020, 'stueClass': ['G1', 'G2', 'G2', 'G1']})
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        df = backfill.prepare(df_emis, 2020, 2)
+    assert list(df.columns) == student_enrollment_columns
+    assert df[['school_id', 'student_id', 'enrollment_id']].values.tolist() == [[1, 1, 3], [1, 2, 5]]
+    # The school and grade of the year, not those of the student_master record
+    assert df['calender_id'].tolist() == [100, 200]
+    assert df['grade_id'].tolist() == [11, 22]
+    assert df['enrollment_date'].tolist() == ['2019-09-01'] * 2
@@ -0,0 +1,45 @@
+"""Detecting the changes of records already in the SIS."""
+
+import numpy as np
+import pandas as pd
+
+from pacific_sis.changes import diff_matched, summarize_changes
+
+keys = ['school_id', 'student_id']
+columns = ['first_given_name', 'special_education_indicator']
+
+
+def test_diff_matched():
+    df_emis = pd.DataFrame({'school_id': [1, 1, 1, 1, 2], 'student_id': [1, 2, 3, 4, 9],
+                            'first_given_name': ['Ana', 'Ben', np.nan, 'Dee', 'Eve'],
+                            'special_education_indicator': [0, 1, 1, np.nan, 0]})
+    df_sis = pd.DataFrame({'school_id': [1, 1, 1, 1], 'student_id': [1, 2, 3, 4],
+                           'first_given_name': ['Ana', 'Benn', 'Cy', np.nan],
+                           'special_education_indicator': [0, 1, 0, 1]})
+    df = diff_matched(df_emis, df_sis, keys, columns)
+    # Student 1 is unchanged and student 9 not in the SIS
+    assert df['student_id'].tolist() == [2, 3, 4]
+    assert df['first_given_name_changed'].tolist() == [True, False, True]
+    assert df['special_education_indicator_changed'].tolist() == [False, True, False]
+    assert summarize_changes(df, columns) == {'first_given_name': 2, 'special_education_indicator': 1}
+
+
+def test_missing_emis_values_are_never_a_change():
+    df_emis = pd.DataFrame({'school_id': [1], 'student_id': [1], 'first_given_name': [None], 'special_education_indicator': [np.nan]})
+    df_sis = pd.DataFrame({'school_id': [1], 'student_id': [1], 'first_given_name': ['Ana'], 'special_education_indicator': [1]})
+    assert diff_matched(df_emis, df_sis, keys, columns).empty
+
+
+def test_missing_on_both_sides_is_not_a_change():
+    df = pd.DataFrame({'school_id': [1], 'student_id': [1], 'first_given_name': [np.nan], 'special_education_indicator': [np.nan]})
+    assert diff_matched(df, df.copy(), keys, columns).empty
+
+
+def test_arrow_strings():
+    df_emis = pd.DataFrame({'school_id': [1, 1], 'student_id': [1, 2], 'first_given_name': pd.array(['Ana', None], dtype='string[pyarrow]'),
+                            'special_education_indicator': [0, 0]})
+    df_sis = pd.DataFrame({'school_id': [1, 1], 'student_id': [1, 2], 'first_given_name': pd.array([None, 'Ben'], dtype='string[pyarrow]'),
+                           'special_education_indicator': [0, 0]})
+    df = diff_matched(df_emis, df_sis, keys, columns)
+    assert df['student_id'].tolist() == [1]
+    assert df['first_given_name_changed'].tolist() == [True]
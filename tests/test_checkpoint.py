@@ -0,0 +1,74 @@
+"""Resuming an interrupted chunked load with the checkpoint journal."""
+
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+from pacific_sis.checkpoint import CheckpointJournal, load_in_chunks
+
+CONFIG = {'country': 'XX', 'emis_database': 'emis', 'emis_school_year': 2024, 'sis_database': 'sis', 'sis_tenant_id': 'T'}
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    # The journal is written to data/<country>/checkpoints of the working directory
+    monkeypatch.chdir(tmp_path)
+    engine = sa.create_engine('sqlite:///' + str(tmp_path / 'sis.db'))
+    with engine.begin() as conn:
+        conn.execute(sa.text("CREATE TABLE student (school_id INTEGER, student_id INTEGER, PRIMARY KEY (school_id, student_id))"))
+    return engine
+
+
+def students(*schools):
+    return pd.DataFrame([(school, student) for school in schools for student in (1, 2)], columns=['school_id', 'student_id'])
+
+
+def loaded_schools(engine):
+    with engine.connect() as conn:
+        return sorted(r[0] for r in conn.execute(sa.text("SELECT DISTINCT school_id FROM student")))
+
+
+def test_rerun_skips_the_committed_schools(engine):
+    df = students(1, 2, 3)
+    # School 2 has a duplicate primary key, its chunk is rolled back
+    df_broken = pd.concat([df, df[df['school_id'] == 2].head(1)], ignore_index=True)
+    with pytest.raises(pd.errors.DatabaseError):
+        load_in_chunks(engine, {'student': df_broken}, CheckpointJournal.for_load(CONFIG, 'sync-student'), schools_per_chunk=1)
+    assert loaded_schools(engine) == [1]
+
+    # The rerun prepares other records (school 2 fixed), the journal still skips school 1
+    loaded = load_in_chunks(engine, {'student': df}, CheckpointJournal.for_load(CONFIG, 'sync-student'), schools_per_chunk=1)
+    assert loaded == {'student': 4}
+    assert loaded_schools(engine) == [1, 2, 3]
+
+
+def test_journal_of_another_load_is_discarded(engine):
+    journal = CheckpointJournal.for_load(CONFIG, 'sync-student')
+    journal.mark_done(1)
+    assert CheckpointJournal.for_load(CONFIG, 'sync-student').is_done(1)
+    assert not CheckpointJournal.for_load(dict(CONFIG, emis_school_year=2025), 'sync-student').is_done(1)
+
+
+def test_updates_are_committed_with_the_inserts_of_their_school(engine):
+    with engine.begin() as conn:
+        conn.execute(sa.text("CREATE TABLE grade (school_id INTEGER, grade TEXT)"))
+        conn.execute(sa.text("INSERT INTO grade VALUES (1, 'old'), (2, 'old'), (4, 'old')"))
+
+    def apply(conn, df):
+        for school_id in df['school_id']:
+            conn.execute(sa.text("UPDATE grade SET grade = 'new' WHERE school_id = :s"), {'s': int(school_id)})
+        return len(df)
+
+    df = students(1, 2)
+    df_broken = pd.concat([df, df[df['school_id'] == 2].head(1)], ignore_index=True)
+    updates = {'grade updated': (pd.DataFrame({'school_id': [1, 2, 4]}), apply)}
+    with pytest.raises(pd.errors.DatabaseError):
+        load_in_chunks(engine, {'student': df_broken}, CheckpointJournal.for_load(CONFIG, 'sync-student'), schools_per_chunk=1, updates=updates)
+    with engine.connect() as conn:
+        assert dict(conn.execute(sa.text("SELECT school_id, grade FROM grade")).fetchall()) == {1: 'new', 2: 'old', 4: 'old'}
+
+    # School 4 has only updates, it is still a chunk of its own
+    loaded = load_in_chunks(engine, {'student': df}, CheckpointJournal.for_load(CONFIG, 'sync-student'), schools_per_chunk=1, updates=updates)
+    assert loaded == {'student': 2, 'grade updated': 2}
+    with engine.connect() as conn:
+        assert dict(conn.execute(sa.text("SELECT school_id, grade FROM grade")).fetchall()) == {1: 'new', 2: 'new', 4: 'new'}
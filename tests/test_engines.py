@@ -0,0 +1,114 @@
+"""Parity of the duckdb and polars transform engines with the pandas one (what the notebooks run)."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pacific_sis.engines import PandasEngine, ParityCheckedEngine, TransformParityError, transform_engine
+from pacific_sis.memory import arrow_strings
+
+
+@pytest.fixture(params=['duckdb', 'polars'])
+def engine(request):
+    pytest.importorskip(request.param)
+    return transform_engine(request.param)
+
+
+@pytest.fixture
+def reference():
+    return PandasEngine()
+
+
+def assert_numbers_equal(actual, expected):
+    assert list(actual.index) == list(expected.index)
+    np.testing.assert_array_equal(np.asarray(actual, dtype=float), np.asarray(expected, dtype=float))
+
+
+def assert_labels_equal(actual, expected):
+    assert list(actual.index) == list(expected.index)
+    assert actual.astype(str).tolist() == expected.astype(str).tolist()
+
+
+@pytest.fixture
+def df_students():
+    # school_id is float when some school names are not mapped to a SIS school
+    return pd.DataFrame({
+        'first_given_name': ['Ana', 'Ben', 'Ana', None, 'Cy', 'Dee', None],
+        'last_family_name': ['Lee', 'Roe', 'Lee', 'Kai', 'Poe', None, None],
+        'dob': ['2010-01-01', '2011-02-02', '2010-01-01', '2012-03-03', None, '2013-04-04', None],
+        'school_id': [1.0, 2.0, 1.0, np.nan, 3.0, 2.0, np.nan],
+    }, index=[10, 11, 12, 13, 14, 15, 16])
+
+
+@pytest.fixture
+def df_students_sis():
+    return pd.DataFrame({
+        'first_given_name': ['Ana', 'Ana', None, 'Cy', None],
+        'last_family_name': ['Lee', 'Lee', 'Kai', 'Poe', None],
+        'dob': ['2010-01-01', '2010-01-01', '2012-03-03', '2009-09-09', None],
+    })
+
+
+def test_match_null_keys(engine, reference, df_students, df_students_sis):
+    on = ['first_given_name', 'last_family_name', 'dob']
+    assert_labels_equal(engine.match(df_students, df_students_sis, on), reference.match(df_students, df_students_sis, on))
+
+
+def test_match_arrow_strings(engine, reference, df_students, df_students_sis):
+    on = ['first_given_name', 'last_family_name', 'dob']
+    df, df_sis = arrow_strings(df_students), arrow_strings(df_students_sis)
+    assert_labels_equal(engine.match(df, df_sis, on), reference.match(df, df_sis, on))
+
+
+def test_match_float_and_int_keys(engine, reference, df_students):
+    df_attached = pd.DataFrame({'school_id': [1, 3, 4]})
+    assert_labels_equal(engine.match(df_students, df_attached, ['school_id']), reference.match(df_students, df_attached, ['school_id']))
+
+
+def test_cumcount_float_keys_and_int_start(engine, reference, df_students):
+    df_last_student_id = pd.DataFrame({'school_id': [1, 2, 9], 'last_student_id': [100, 200, 900]})
+    assert_numbers_equal(engine.cumcount(df_students, 'school_id', df_last_student_id, 'last_student_id'),
+                         reference.cumcount(df_students, 'school_id', df_last_student_id, 'last_student_id'))
+
+
+def test_cumcount_null_keys(engine, reference, df_students):
+    assert_numbers_equal(engine.cumcount(df_students, 'school_id'), reference.cumcount(df_students, 'school_id'))
+
+
+@pytest.fixture
+def df_appointments():
+    # Teachers (TID) appointed at several schools, not consecutive and one without TID
+    return pd.DataFrame({
+        'TID': [7, 3, 7, 5, 3, 7, np.nan, 9],
+        'school_attached_name': ['A', 'B', 'C', 'A', 'D', 'B', 'E', 'A'],
+    }, index=[4, 2, 9, 1, 8, 3, 6, 5])
+
+
+def test_cumcount_repeated_tids(engine, reference, df_appointments):
+    assert_numbers_equal(engine.cumcount(df_appointments, 'TID'), reference.cumcount(df_appointments, 'TID'))
+
+
+def test_ngroup_repeated_tids(engine, reference, df_appointments):
+    assert_numbers_equal(engine.ngroup(df_appointments, 'TID'), reference.ngroup(df_appointments, 'TID'))
+
+
+def test_project(engine, reference, df_students):
+    columns = ['school_id', 'first_given_name', 'dob']
+    df_expected = reference.project(df_students, columns)
+    df_actual = engine.project(df_students, columns)
+    assert list(df_actual.columns) == columns
+    assert_numbers_equal(df_actual['school_id'].set_axis(df_expected.index), df_expected['school_id'])
+    for c in ['first_given_name', 'dob']:
+        # Missing strings are None or NaN depending on the engine
+        assert df_actual[c].astype(object).where(df_actual[c].notna(), None).tolist() == df_expected[c].astype(object).where(df_expected[c].notna(), None).tolist()
+
+
+def test_parity_check_raises_on_difference(df_appointments):
+    class ShiftedEngine(PandasEngine):
+        name = 'shifted'
+
+        def ngroup(self, df, by):
+            return super().ngroup(df, by) + 1
+
+    with pytest.raises(TransformParityError):
+        ParityCheckedEngine(ShiftedEngine()).ngroup(df_appointments, 'TID')
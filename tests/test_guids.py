@@ -0,0 +1,38 @@
+"""GUIDs of the records created in the SIS."""
+
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from pacific_sis.guids import deterministic_guids, make_guids
+
+
+def test_deterministic_guids_are_stable():
+    keys = pd.Series(['C1', ' C2 ', 'C3'], index=[5, 6, 7])
+    guids = deterministic_guids(keys, 'T', 'student')
+    assert list(guids.index) == [5, 6, 7]
+    assert guids.tolist() == deterministic_guids(pd.Series(['C1', 'C2', 'C3']), 'T', 'student').tolist()
+    assert all(uuid.UUID(g).version == 5 for g in guids)
+
+
+def test_deterministic_guids_depend_on_tenant_and_entity():
+    keys = pd.Series(['C1'])
+    guids = {deterministic_guids(keys, t, e).iloc[0] for t, e in [('T', 'student'), ('U', 'student'), ('T', 'staff')]}
+    assert len(guids) == 3
+
+
+def test_missing_and_repeated_keys_get_random_guids(capsys):
+    keys = pd.Series(['C1', None, 'C2', np.nan, 'C2'])
+    guids = deterministic_guids(keys, 'T', 'student')
+    assert guids.notna().all() and guids.is_unique
+    assert uuid.UUID(guids.iloc[0]).version == 5
+    assert [uuid.UUID(g).version for g in guids.iloc[1:]] == [4, 4, 4, 4]
+    assert "2 student records share their key" in capsys.readouterr().out
+
+
+def test_make_guids_random_by_default():
+    keys = pd.Series(['C1', 'C1'], index=[3, 4])
+    guids = make_guids(keys, 'T', 'student')
+    assert list(guids.index) == [3, 4]
+    assert guids.is_unique
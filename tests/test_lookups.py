@@ -0,0 +1,51 @@
+"""Minimal difference sync of the EMIS lookups."""
+
+import pandas as pd
+
+from pacific_sis.lookups import diff_lookup, lookup_sync_batches, delete_value, update_value, insert_value
+
+
+def dpdown_valuelist(rows):
+    return pd.DataFrame(rows, columns=['id', 'school_id', 'lov_code', 'lov_column_value', 'sort_order'])
+
+
+def test_diff_lookup():
+    lookup = [('A', 'Asian', 1), ('B', 'Black', 2), ('C', 'Chamorro', 3), ('A', 'Asian again', 9)]
+    df_sis = dpdown_valuelist([
+        (10, 1, 'A', 'Asian', 1),
+        (11, 1, 'B', 'Black ', '2'),     # Same once normalized
+        (12, 1, 'X', 'Gone', 3),         # No longer in the EMIS
+        (13, 1, 'A', 'Asian', 1),        # Duplicate code, the first one is kept
+        (20, 2, 'A', 'Asiatic', 1),      # Changed
+        (21, 2, 'B', 'Black', None),     # Sort order changed
+        (30, None, 'A', 'Asian', 1),     # Not of a school
+    ])
+    df_insert, df_update, df_delete = diff_lookup(lookup, df_sis, [1, 2])
+    assert sorted(map(tuple, df_insert[['school_id', 'lov_code']].values.tolist())) == [(1, 'C'), (2, 'C')]
+    assert df_update[['id', 'lov_column_value', 'sort_order']].values.tolist() == [[20, 'Asian', 1], [21, 'Black', 2]]
+    assert df_delete['id'].tolist() == [12, 13]
+
+
+def test_diff_lookup_up_to_date():
+    df_sis = dpdown_valuelist([(10, 1, 'A', 'Asian', 1)])
+    df_insert, df_update, df_delete = diff_lookup([('A', 'Asian', 1)], df_sis, [1])
+    assert df_insert.empty and df_update.empty and df_delete.empty
+
+
+def test_new_values_reuse_the_deleted_ids_first():
+    df_insert = pd.DataFrame({'school_id': [1.0, 1.0, 2.0], 'lov_code': ['C', 'D', 'C'], 'lov_column_value': ['c', 'd', 'c'], 'sort_order': [3, 4, 3]})
+    df_update = pd.DataFrame({'id': [20], 'school_id': [2], 'lov_code': ['A'], 'lov_column_value': ['a'], 'sort_order': [1]})
+    df_delete = pd.DataFrame({'id': [12], 'school_id': [1]})
+    batches = lookup_sync_batches('Race', df_insert, df_update, df_delete, 100, 'T', 'U', '2024-01-01 00:00:00')
+    assert [sql for sql, rows in batches] == [delete_value, update_value, insert_value]
+    (_, deletes), (_, updates), (_, inserts) = batches
+    assert deletes == [{'lov_name': 'Race', 'id': 12}]
+    assert updates[0]['id'] == 20 and updates[0]['updated_by'] == 'U'
+    assert [(r['id'], r['school_id'], r['lov_code']) for r in inserts] == [(12, 1, 'C'), (101, 1, 'D'), (102, 2, 'C')]
+    # IDs never reused twice nor colliding with existing ones
+    assert len({r['id'] for r in inserts}) == len(inserts)
+
+
+def test_no_batches_without_differences():
+    empty = pd.DataFrame(columns=['id', 'school_id', 'lov_code', 'lov_column_value', 'sort_order'])
+    assert lookup_sync_batches('Race', empty, empty, empty[['id', 'school_id']], 100, 'T', 'U', 'now') == []
@@ -0,0 +1,46 @@
+"""Matching the EMIS students to the SIS students."""
+
+import numpy as np
+import pandas as pd
+
+from pacific_sis.engines import PandasEngine
+from pacific_sis.matching import match_keys, key_column_types, key_columns
+
+
+def test_names_are_matched_case_insensitively():
+    df_emis = pd.DataFrame({'first_given_name': ['ANA ', 'Ben', None, 'Émile'], 'last_family_name': ['lee', 'Roe', 'Kai', 'Zola'],
+                            'dob': ['2010-01-01', '2011-02-02', '2012-03-03', '2013-04-04']}, index=[5, 6, 7, 8])
+    df_sis = pd.DataFrame({'first_given_name': ['Ana', 'Ben', None, 'Emile'], 'last_family_name': ['Lee', 'Roe', 'KAI', 'Zola'],
+                           'dob': ['2010-01-01', '2011-02-03', '2012-03-03', '2013-04-04']})
+    df_keys = match_keys(df_emis)
+    assert list(df_keys.columns) == key_columns and list(df_keys.index) == [5, 6, 7, 8]
+    assert df_keys['first_given_name'].tolist()[:2] == ['ana', 'ben'] and pd.isna(df_keys['first_given_name'].iloc[2])
+    # Unlike an accent insensitive collation the accents still differ
+    assert PandasEngine().match(df_keys, match_keys(df_sis), key_columns).tolist() == ['both', 'left_only', 'both', 'left_only']
+
+
+def test_match_keys_of_arrow_strings():
+    df = pd.DataFrame({'first_given_name': pd.array([' Ana', None], dtype='string[pyarrow]'),
+                       'last_family_name': pd.array(['LEE', 'Roe'], dtype='string[pyarrow]'), 'dob': [np.nan, '2011-02-02']})
+    df_keys = match_keys(df)
+    assert df_keys['first_given_name'].iloc[0] == 'ana' and pd.isna(df_keys['first_given_name'].iloc[1])
+    assert df_keys['last_family_name'].tolist() == ['lee', 'roe']
+
+
+class FakeConnection:
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, stmt, *args):
+        return self.rows
+
+
+def test_temp_table_columns_take_the_student_master_collations():
+    conn = FakeConnection([('first_given_name', 'utf8mb4', 'utf8mb4_0900_ai_ci'), ('last_family_name', 'utf8mb4', 'utf8mb4_0900_ai_ci'),
+                           ('alternate_id', 'latin1', 'latin1_swedish_ci'), ('gender', 'utf8mb4', 'utf8mb4_0900_ai_ci')])
+    assert key_column_types(conn) == {
+        'alternate_id': 'VARCHAR(255) CHARACTER SET latin1 COLLATE latin1_swedish_ci',
+        'first_given_name': 'VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci',
+        'last_family_name': 'VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci',
+    }
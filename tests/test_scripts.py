@@ -0,0 +1,79 @@
+"""Reading and batching the generated .sql sync scripts."""
+
+from pacific_sis.scripts import iter_statements, _split_values, parse_statement, iter_batches, script_schools
+
+
+def statements(text):
+    return list(iter_statements(text.splitlines(keepends=True)))
+
+
+def test_statements_split_on_semicolons():
+    assert statements("USE sis;\nDELETE FROM t\nWHERE id = 1;\n\nSELECT 1") == ["USE sis", "DELETE FROM t\nWHERE id = 1", "SELECT 1"]
+
+
+def test_semicolons_and_comments_inside_literals():
+    script = """
+INSERT INTO t (a, b) VALUES ('x; y', 'it''s # not a comment');
+UPDATE t SET a = 'C:\\\\dir\\\\' WHERE b = "-- nor this"; -- but this is
+# and this
+DELETE FROM t WHERE a = 'back\\'slash;'; # trailing
+"""
+    assert statements(script) == [
+        "INSERT INTO t (a, b) VALUES ('x; y', 'it''s # not a comment')",
+        "UPDATE t SET a = 'C:\\\\dir\\\\' WHERE b = \"-- nor this\"",
+        "DELETE FROM t WHERE a = 'back\\'slash;'",
+    ]
+
+
+def test_literal_spanning_lines():
+    assert statements("INSERT INTO t (a) VALUES ('one;\ntwo');\nSELECT 1;") == ["INSERT INTO t (a) VALUES ('one;\ntwo')", "SELECT 1"]
+
+
+def test_split_values():
+    assert _split_values("(1, 'a, b', NULL, 'it''s (x)')") == ['1', "'a, b'", 'NULL', "'it''s (x)'"]
+    assert _split_values("('back\\'slash', CONCAT('a', 'b'))") == ["'back\\'slash'", "CONCAT('a', 'b')"]
+    # Several rows are not a single row
+    assert _split_values("(1, 'a'), (2, 'b')") is None
+
+
+def test_parse_statement_school():
+    assert parse_statement("INSERT INTO `t` (`id`, `school_id`) VALUES (7, 12)")['school_id'] == 12
+    assert parse_statement("INSERT INTO t (id, school_id) VALUES (7, NULL)")['school_id'] is None
+    assert parse_statement("UPDATE t SET a = 1 WHERE school_id = 3 AND id = 4")['school_id'] == 3
+    assert parse_statement("DELETE FROM t WHERE school_id IS NOT NULL")['school_id'] is None
+    assert parse_statement("UPDATE t SET a = 1 WHERE school_id = 3 OR school_id = 4")['school_id'] is None
+
+
+def batches(texts, batch_size=500):
+    return list(iter_batches(((t, parse_statement(t)) for t in texts), batch_size))
+
+
+def test_consecutive_inserts_are_merged():
+    texts = [
+        "INSERT INTO t (id, school_id) VALUES (1, 5)",
+        "INSERT INTO t (id, school_id) VALUES (2, 5)",
+        "INSERT INTO t (id, school_id) VALUES (3, 6)",
+        "UPDATE t SET a = 1 WHERE school_id = 6",
+        "INSERT INTO t (id, school_id) VALUES (4, 6)",
+        "INSERT INTO u (id, school_id) VALUES (5, 6)",
+    ]
+    assert batches(texts) == [
+        ("INSERT INTO `t` (id, school_id) VALUES\n(1, 5),\n(2, 5)", 2, 5),
+        ("INSERT INTO `t` (id, school_id) VALUES\n(3, 6)", 1, 6),
+        ("UPDATE t SET a = 1 WHERE school_id = 6", 1, 6),
+        ("INSERT INTO `t` (id, school_id) VALUES\n(4, 6)", 1, 6),
+        ("INSERT INTO `u` (id, school_id) VALUES\n(5, 6)", 1, 6),
+    ]
+
+
+def test_batch_size():
+    texts = ["INSERT INTO t (id) VALUES ({})".format(i) for i in range(5)]
+    assert [count for sql, count, school_id in batches(texts, batch_size=2)] == [2, 2, 1]
+
+
+def test_script_schools(tmp_path):
+    path = tmp_path / 'sync-script.sql'
+    path.write_text("START TRANSACTION;\nUPDATE t SET a = 1 WHERE school_id = 9;\nINSERT INTO t (school_id) VALUES (2);\nSELECT * FROM t;\nROLLBACK;\n")
+    assert script_schools(str(path)) == [9, 2]
+    path.write_text("DELETE FROM t WHERE school_id IS NOT NULL;\nINSERT INTO t (school_id) VALUES (2);\n")
+    assert script_schools(str(path)) is None
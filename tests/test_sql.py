@@ -0,0 +1,47 @@
+"""Rendering the parameterized statements into the .sql audit scripts."""
+
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+from pacific_sis.sql import sql_value, render_statement, render_script, records
+
+
+def test_sql_value():
+    assert sql_value(None) == 'NULL'
+    assert sql_value(np.nan) == 'NULL'
+    assert sql_value(pd.NA) == 'NULL'
+    assert sql_value(True) == '1' and sql_value(np.bool_(False)) == '0'
+    assert sql_value(np.int64(7)) == '7'
+    assert sql_value(2.5) == '2.5'
+    assert sql_value(dt.date(2024, 1, 31)) == "'2024-01-31'"
+    assert sql_value("O'Brien") == "'O''Brien'"
+    assert sql_value('C:\\dir') == "'C:\\\\dir'"
+    assert sql_value('NaN') == "'NaN'"
+
+
+def test_render_statement():
+    sql = "UPDATE t SET a = :a, b = :b WHERE id = :id"
+    assert render_statement(sql, {'a': "it's", 'b': None, 'id': 3}) == "UPDATE t SET a = 'it''s', b = NULL WHERE id = 3"
+
+
+def test_render_statement_ignores_colons_of_literals_and_casts():
+    sql = "UPDATE t SET updated_on = '2024-01-01 12:30:00', a = x::text, b = :b WHERE id = :id"
+    assert render_statement(sql, {'b': 'x:y', 'id': 1}) == "UPDATE t SET updated_on = '2024-01-01 12:30:00', a = x::text, b = 'x:y' WHERE id = 1"
+
+
+def test_parameter_values_are_not_rendered_again():
+    # A value holding :name is a literal, not a parameter
+    assert render_statement("INSERT INTO t (a, b) VALUES (:a, :b)", {'a': ':b', 'b': 1}) == "INSERT INTO t (a, b) VALUES (':b', 1)"
+
+
+def test_render_script():
+    batches = [("DELETE FROM t WHERE id = :id", records(pd.DataFrame({'id': [1, 2]}))),
+               ("UPDATE t SET a = :a WHERE id = :id", records(pd.DataFrame({'a': [np.nan], 'id': [3]})))]
+    assert render_script(batches) == ["DELETE FROM t WHERE id = 1;", "DELETE FROM t WHERE id = 2;", "UPDATE t SET a = NULL WHERE id = 3;"]
+
+
+def test_render_statement_leaves_literals_alone():
+    sql = """UPDATE t SET a = 'see :b', c = "x :d", e = 'it''s :b' WHERE id = :id"""
+    assert render_statement(sql, {'id': 1}) == """UPDATE t SET a = 'see :b', c = "x :d", e = 'it''s :b' WHERE id = 1"""